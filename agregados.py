@@ -0,0 +1,300 @@
+"""Agregados materializados del tablero de Datos Post-Venta.
+
+Una tabla pequeña con sumas por (Talla Camisa, Niño/Niña, Colegio) que se
+mantiene junto con la caché de almacenamiento: al guardar, editar, pagar,
+entregar tela o eliminar solo se suman las filas nuevas y se restan las
+anteriores. Cada métrica del tablero (y cada filtro por talla) se lee de esa
+tabla, sin recorrer las ventas.
+
+La lista de corte de producción (camisas por talla y tipo, pantalones por
+rango de largo y cintura, tela sugerida contra entregada) es otra tabla igual
+sobre las ventas abiertas (calculos.filas_ventas_abiertas): una venta que se
+liquida sale de ella aunque siga activa, con los dos backends.
+"""
+import threading
+
+import numpy as np
+import pandas as pd
+
+import almacenamiento
+from calculos import filas_ventas_abiertas
+from instrumentacion import span
+
+LLAVES = ['Talla Camisa', 'Tipo', 'Colegio']
+METRICAS = {
+    'Camisas': 'Camisas',
+    'Pantalones': 'Pantalones',
+    'Venta': 'Subtotal niño(a)',
+    'Pendiente': 'Saldo Pendiente (Distribuido)',
+    'Tela Sugerida': 'Tela Sugerida (mts)',
+    'Tela Entregada': 'Metros Tela (mts)',
+}
+
+
+def _texto(serie):
+    """Texto por fila; en categóricas se convierte cada categoría una vez, no cada fila."""
+    if isinstance(serie.dtype, pd.CategoricalDtype):
+        categorias = np.append(serie.cat.categories.astype(str).to_numpy(dtype=object), 'nan')
+        return categorias[serie.cat.codes.to_numpy()]  # código -1 (vacío) -> 'nan', como astype(str)
+    return serie.astype(str).to_numpy()
+
+
+def _tipo(tipo_detalle):
+    # Igual que el conteo original: contiene "Niño" / "Niña"; el resto solo suma pantalones y dinero.
+    if isinstance(tipo_detalle.dtype, pd.CategoricalDtype):
+        por_categoria = _tipo(pd.Series(np.append(tipo_detalle.cat.categories.astype(str), 'nan')))
+        return por_categoria[tipo_detalle.cat.codes.to_numpy()]
+    tipo = tipo_detalle.astype(str)
+    return np.where(tipo.str.contains("Niño", regex=False), "Niño",
+                    np.where(tipo.str.contains("Niña", regex=False), "Niña", "Otro"))
+
+
+def agregar_filas(df):
+    """Sumas por (talla, tipo, colegio) de un conjunto de filas."""
+    if df.empty or 'Tipo Detalle' not in df.columns:
+        return pd.DataFrame(columns=list(METRICAS), index=pd.MultiIndex.from_arrays([[]] * 3, names=LLAVES),
+                            dtype=float)
+    datos = pd.DataFrame({
+        'Talla Camisa': _texto(df['Talla Camisa']),
+        'Tipo': _tipo(df['Tipo Detalle']),
+        'Colegio': _texto(df['Colegio']),
+        **{nombre: pd.to_numeric(df[columna], errors='coerce').fillna(0).to_numpy(dtype=float)
+           for nombre, columna in METRICAS.items()},
+    })
+    return datos.groupby(LLAVES, sort=False).sum()
+
+
+class TablaIncremental:
+    """Sumas de agregar(df) mantenidas con los eventos de la caché."""
+    agregar = staticmethod(agregar_filas)
+
+    def __init__(self, df):
+        self.tabla = self.agregar(df)
+        self.origen = df
+
+    def aplicar(self, evento, df_anterior, df_nuevo, filas):
+        """Suma/resta el cambio de un evento de la caché (ver almacenamiento.suscribir)."""
+        if evento == 'insertar':
+            delta = self.agregar(filas)
+        elif evento == 'actualizar':
+            delta = self.agregar(filas).sub(self.agregar(df_anterior.loc[filas.index]), fill_value=0)
+        else:  # 'eliminar'
+            delta = -self.agregar(filas)
+        self.tabla = self.tabla.add(delta, fill_value=0)
+        self.origen = df_nuevo
+
+
+class AgregadosPostVenta(TablaIncremental):
+    """Tabla del tablero de Datos Post-Venta (ver agregar_filas)."""
+
+    def resumen(self, talla=None):
+        """Mismas métricas que calculos.resumen_post_venta, leídas de la tabla."""
+        tabla = self.tabla
+        if talla is not None:
+            tabla = tabla[tabla.index.get_level_values('Talla Camisa') == talla]
+        por_tipo = tabla.groupby(level='Tipo').sum()
+        totales = tabla.sum()
+        camisas = por_tipo['Camisas']
+        sugerida = round(float(totales['Tela Sugerida']), 6)
+        entregada = round(float(totales['Tela Entregada']), 6)
+        # Conteos y pesos son enteros en la base; la tabla los suma como float.
+        return {
+            'camisas_nino': int(round(camisas.get("Niño", 0))),
+            'camisas_nina': int(round(camisas.get("Niña", 0))),
+            'pantalones': int(round(totales['Pantalones'])),
+            'venta_total': int(round(totales['Venta'])),
+            'pendiente': int(round(totales['Pendiente'])),
+            'tela_sugerida': sugerida,
+            'tela_entregada': entregada,
+            'balance_tela': entregada - sugerida,
+        }
+
+
+# --- LISTA DE CORTE ---
+PASO_MEDIDA = 5  # cm de cada rango de largo y de cintura
+SIN_MEDIDA = -1
+LLAVES_CORTE = ['Colegio', 'Tipo', 'Talla Camisa', 'Largo', 'Cintura']
+METRICAS_CORTE = {nombre: METRICAS[nombre] for nombre in ('Camisas', 'Pantalones', 'Tela Sugerida', 'Tela Entregada')}
+TALLAS_ORDEN = ["4", "6", "8", "10", "12", "14", "16", "S", "M", "L", "XL"]
+
+
+def _rango(serie):
+    """Inicio del rango de PASO_MEDIDA cm de cada medida (SIN_MEDIDA si falta o es 0)."""
+    medida = pd.to_numeric(serie, errors='coerce').fillna(0).to_numpy(dtype=float)
+    return np.where(medida > 0, np.floor(medida / PASO_MEDIDA) * PASO_MEDIDA, SIN_MEDIDA).astype(int)
+
+
+def _nombre_rango(inicio):
+    return "Sin medida" if inicio == SIN_MEDIDA else f"{inicio}-{inicio + PASO_MEDIDA - 1}"
+
+
+def agregar_corte(df):
+    """Sumas por (colegio, tipo, talla, rango de largo, rango de cintura) de un conjunto de filas."""
+    if df.empty or 'Tipo Detalle' not in df.columns:
+        return pd.DataFrame(columns=list(METRICAS_CORTE), dtype=float,
+                            index=pd.MultiIndex.from_arrays([[]] * len(LLAVES_CORTE), names=LLAVES_CORTE))
+    datos = pd.DataFrame({
+        'Colegio': _texto(df['Colegio']),
+        'Tipo': _tipo(df['Tipo Detalle']),
+        'Talla Camisa': _texto(df['Talla Camisa']),
+        'Largo': _rango(df['Largo Pant (cm)']),
+        'Cintura': _rango(df['Medidas Cin (cm)']),
+        **{nombre: pd.to_numeric(df[columna], errors='coerce').fillna(0).to_numpy(dtype=float)
+           for nombre, columna in METRICAS_CORTE.items()},
+    })
+    return datos.groupby(LLAVES_CORTE, sort=False).sum()
+
+
+def agregar_tela_ventas(df):
+    """Tela sugerida y entregada por (colegio, venta) de un conjunto de filas."""
+    metricas = ['Tela Sugerida', 'Tela Entregada']
+    if df.empty or 'Tipo Detalle' not in df.columns:
+        return pd.DataFrame(columns=metricas, dtype=float,
+                            index=pd.MultiIndex.from_arrays([[]] * 2, names=['Colegio', 'ID']))
+    datos = pd.DataFrame({
+        'Colegio': _texto(df['Colegio']),
+        'ID': _texto(df['ID']),
+        **{nombre: pd.to_numeric(df[METRICAS[nombre]], errors='coerce').fillna(0).to_numpy(dtype=float)
+           for nombre in metricas},
+    })
+    return datos.groupby(['Colegio', 'ID'], sort=False).sum()
+
+
+def _abiertas(df):
+    return df[filas_ventas_abiertas(df)]
+
+
+class ListaCorte(TablaIncremental):
+    """Pendiente de confección de las ventas abiertas (ver agregar_corte).
+
+    La tela se guarda además por venta (agregar_tela_ventas): la que sobra en
+    una venta no tapa la que falta en otra. Las vistas se calculan una vez por
+    colegio y se comparten: no modificarlas.
+    """
+    agregar = staticmethod(agregar_corte)
+
+    def __init__(self, df):
+        abiertas = _abiertas(df)
+        super().__init__(abiertas)
+        self.origen = df
+        self.tela_ventas = agregar_tela_ventas(abiertas)
+        self._vistas = {}  # (vista, colegio) -> resultado, hasta el próximo cambio de la tabla
+
+    def aplicar(self, evento, df_anterior, df_nuevo, filas):
+        # Un pago o una entrega de tela puede cerrar la venta entera: se resta la
+        # venta completa como estaba y se suma como queda, si sigue abierta.
+        ids = filas['ID'].unique()
+        antes = _abiertas(df_anterior[df_anterior['ID'].isin(ids)])
+        despues = _abiertas(df_nuevo[df_nuevo['ID'].isin(ids)])
+        self.tabla = (self.tabla.add(agregar_corte(despues), fill_value=0)
+                      .sub(agregar_corte(antes), fill_value=0))
+        self.tela_ventas = (self.tela_ventas.add(agregar_tela_ventas(despues), fill_value=0)
+                            .sub(agregar_tela_ventas(antes), fill_value=0))
+        self.origen = df_nuevo
+        self._vistas = {}
+
+    def _vista(self, nombre, colegio, calcular, columna='tabla'):
+        # Primero las vistas y luego la tabla: aplicar cambia la tabla antes de vaciarlas,
+        # así una vista de la tabla anterior nunca queda guardada con la nueva.
+        vistas, tabla = self._vistas, getattr(self, columna)
+        llave = (nombre, colegio)
+        if llave not in vistas:
+            if colegio is not None:
+                tabla = tabla[tabla.index.get_level_values('Colegio') == colegio]
+            vistas[llave] = calcular(tabla)
+        return vistas[llave]
+
+    def colegios(self):
+        return self._vista('colegios', None, self._colegios)
+
+    @staticmethod
+    def _colegios(tabla):
+        return sorted(c for c in tabla.index.unique('Colegio') if c != 'nan')
+
+    def camisas(self, colegio=None):
+        """Camisas por talla (filas) y tipo (Niño, Niña, Total)."""
+        return self._vista('camisas', colegio, self._camisas)
+
+    @staticmethod
+    def _camisas(tabla):
+        por_talla = tabla['Camisas'].groupby(level=['Talla Camisa', 'Tipo']).sum()
+        tabla = por_talla.unstack('Tipo', fill_value=0).reindex(columns=["Niño", "Niña"], fill_value=0)
+        tabla['Total'] = tabla.sum(axis=1)
+        tabla = tabla[tabla['Total'] > 0].astype(int)
+        orden = {t: n for n, t in enumerate(TALLAS_ORDEN)}
+        tabla = tabla.sort_index(key=lambda tallas: tallas.map(lambda t: orden.get(t, len(orden))))
+        return tabla.rename_axis(index='Talla Camisa', columns=None).reset_index()
+
+    def pantalones(self, colegio=None):
+        """Pantalones por rango de largo y de cintura, de menor a mayor (los sin medida al final)."""
+        return self._vista('pantalones', colegio, self._pantalones)
+
+    @staticmethod
+    def _pantalones(tabla):
+        por_medida = tabla['Pantalones'].groupby(level=['Largo', 'Cintura']).sum()
+        por_medida = por_medida[por_medida > 0].astype(int).reset_index()
+        por_medida = por_medida.sort_values(['Largo', 'Cintura'],
+                                            key=lambda c: c.where(c != SIN_MEDIDA, np.iinfo(np.int64).max))
+        return pd.DataFrame({
+            'Largo Pant (cm)': por_medida['Largo'].map(_nombre_rango).to_numpy(),
+            'Cintura (cm)': por_medida['Cintura'].map(_nombre_rango).to_numpy(),
+            'Pantalones': por_medida['Pantalones'].to_numpy(),
+        })
+
+    def tela(self, colegio=None):
+        """Metros sugeridos, entregados y por entregar (lo que falta en cada venta, sumado)."""
+        return self._vista('tela', colegio, self._tela, 'tela_ventas')
+
+    @staticmethod
+    def _tela(tabla):
+        sugerida, entregada = tabla['Tela Sugerida'], tabla['Tela Entregada']
+        return {'sugerida': round(float(sugerida.sum()), 2), 'entregada': round(float(entregada.sum()), 2),
+                'pendiente': round(float((sugerida - entregada).clip(lower=0).sum()), 2)}
+
+
+# --- MANTENIMIENTO CON LA CACHÉ ---
+_lock = threading.Lock()
+_agregados = None
+_lista_corte = None
+
+
+def _mantener(tabla, evento, df_anterior, df_nuevo, filas):
+    if evento != 'recargar' and tabla is not None and tabla.origen is df_anterior:
+        tabla.aplicar(evento, df_anterior, df_nuevo, filas)
+        return tabla
+    return None
+
+
+def _al_cambiar_datos(evento, df_anterior, df_nuevo, filas):
+    global _agregados, _lista_corte
+    with _lock:
+        _agregados = _mantener(_agregados, evento, df_anterior, df_nuevo, filas)
+        _lista_corte = _mantener(_lista_corte, evento, df_anterior, df_nuevo, filas)
+
+
+almacenamiento.suscribir(_al_cambiar_datos)
+
+
+def obtener_agregados(df):
+    """Agregados del DataFrame compartido devuelto por cargar_datos (se calculan una vez)."""
+    global _agregados
+    with _lock:
+        if _agregados is None or _agregados.origen is not df:
+            with span('agregados_construir', len(df)):
+                _agregados = AgregadosPostVenta(df)
+        return _agregados
+
+
+def resumen_post_venta(df, talla=None):
+    with span('agregados_post_venta'):
+        return obtener_agregados(df).resumen(talla)
+
+
+def obtener_lista_corte(df):
+    """Lista de corte del DataFrame de ventas activas de cargar_datos() (se calcula una vez)."""
+    global _lista_corte
+    with _lock:
+        if _lista_corte is None or _lista_corte.origen is not df:
+            with span('lista_corte_construir', len(df)):
+                _lista_corte = ListaCorte(df)
+        return _lista_corte
@@ -0,0 +1,1499 @@
+"""Capa de almacenamiento de ventas.
+
+El backend por defecto es SQLite: cada venta se inserta fila por fila y las
+ediciones, pagos y entregas de tela actualizan solo las filas afectadas.
+Excel queda como formato de importación/exportación (y como backend
+alternativo con VENTAS_BACKEND=excel).
+"""
+import glob
+import json
+import os
+import queue
+import shutil
+import sqlite3
+import threading
+import time
+import zlib
+from contextlib import closing, contextmanager
+from datetime import datetime, timedelta
+
+import pandas as pd
+import pytz
+
+from instrumentacion import span
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+try:
+    import pyarrow as pa
+    from pyarrow import feather
+except ImportError:  # el espejo columnar es opcional
+    pa = None
+    feather = None
+
+ARCHIVO_DB = 'base_datos_ventas.xlsx'
+ARCHIVO_SQLITE = 'base_datos_ventas.sqlite3'
+ARCHIVO_ESPEJO = 'base_datos_ventas.feather'
+DIRECTORIO_ARCHIVO = 'archivo_ventas'  # particiones frías: ventas_AAAA-MM.sqlite3
+BACKEND = os.environ.get('VENTAS_BACKEND', 'sqlite')
+# Una venta liquidada (sin saldo ni tela pendiente) pasa al archivo tras estos días sin movimientos.
+DIAS_ARCHIVO = int(os.environ.get('VENTAS_DIAS_ARCHIVO', 30))
+# Conexiones SQLite abiertas que se conservan para reutilizar (app, cola y API).
+CONEXIONES_POOL = int(os.environ.get('VENTAS_CONEXIONES_POOL', 8))
+# Instantáneas del diario que se conservan; antes de la más antigua ya no se puede reconstruir.
+INSTANTANEAS_GUARDADAS = int(os.environ.get('VENTAS_INSTANTANEAS_GUARDADAS', 5))
+# Las fechas de las filas (y del diario) son hora de Bogotá, no la del servidor.
+ZONA_HORARIA = pytz.timezone('America/Bogota')
+
+# Columnas que escribe guardar_venta, en orden, con su afinidad en SQLite.
+ESQUEMA_VENTAS = {
+    "ID": "TEXT",
+    "Fecha Venta": "TEXT",
+    "Cliente": "TEXT",
+    "Celular Principal": "TEXT",
+    "Celular Adicional": "TEXT",
+    "Colegio": "TEXT",
+    "Descripción": "TEXT",
+    "Tipo Detalle": "TEXT",
+    "Nombre Alumno": "TEXT",
+    "Camisas": "INTEGER",
+    "Talla Camisa": "TEXT",
+    "Pantalones": "INTEGER",
+    "Largo Pant (cm)": "REAL",
+    "Medidas Cin (cm)": "REAL",
+    "Medidas Cad (cm)": "REAL",
+    "Medidas Pier (cm)": "REAL",
+    "Tela Sugerida (mts)": "REAL",
+    "Subtotal niño(a)": "INTEGER",
+    "Pagado (Distribuido)": "INTEGER",
+    "Saldo Pendiente (Distribuido)": "INTEGER",
+    "Estado Pago": "TEXT",
+    "Medio Pago": "TEXT",
+    "Fecha Abono": "TEXT",
+    "Fecha Total Pago": "TEXT",
+    "Entrega Tela": "TEXT",
+    "Metros Tela (mts)": "REAL",
+    "Fecha Entrega Tela": "TEXT",
+    "Fecha Entrega Nueva Tela": "TEXT",
+    "Versión Precios": "INTEGER",  # lista de precios con que se calculó la fila (ver pedidos)
+}
+COLUMNAS_VENTA = list(ESQUEMA_VENTAS)
+DTYPES_TEXTO = {'ID': str, 'Celular Principal': str, 'Celular Adicional': str}
+DIGITOS_SECUENCIA = 4  # IDs de venta: AAAAMMDD-NNNN
+
+# Tipos del DataFrame en memoria (cargar_datos). Las enumeraciones son
+# categóricas: las de categorías fijas conservan ese orden (tallas de menor a
+# mayor) y admiten valores heredados que aparezcan; None = categorías tomadas
+# de los datos. Las fechas se guardan en la base como texto FORMATO_FECHA.
+FORMATO_FECHA = '%Y-%m-%d %H:%M'
+CATEGORIAS_VENTA = {
+    "Talla Camisa": ["4", "6", "8", "10", "12", "14", "16", "S", "M", "L", "XL", "N/A"],
+    "Estado Pago": ["Pendiente", "Abono", "Pago Total"],
+    "Medio Pago": ["", "Efectivo", "Transferencia"],
+    "Entrega Tela": ["No", "Si", "No Aplica"],
+    "Colegio": None,
+    "Tipo Detalle": None,
+}
+COLUMNAS_FECHA = ["Fecha Venta", "Fecha Abono", "Fecha Total Pago", "Fecha Entrega Tela"]
+
+
+class ConflictoVersion(Exception):
+    """La venta cambió (otra sesión la modificó) desde que se leyó su versión."""
+
+    def __init__(self, id_venta):
+        super().__init__(f"La venta {id_venta} fue modificada por otro usuario.")
+        self.id_venta = id_venta
+
+
+class VentaArchivada(Exception):
+    """La venta está en una partición del archivo: solo lectura."""
+
+    def __init__(self, id_venta=None):
+        venta = f"La venta {id_venta}" if id_venta else "La venta"
+        super().__init__(f"{venta} está archivada (solo lectura) o ya no existe.")
+        self.id_venta = id_venta
+
+
+class YaAplicada(Exception):
+    """Otra escritura (otro proceso) ya aplicó y quitó esas entradas de la cola."""
+
+
+@contextmanager
+def bloqueo_archivo(ruta):
+    """Bloqueo exclusivo entre procesos sobre ruta + '.lock'."""
+    with open(f"{ruta}.lock", 'a+b') as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def _q(columna):
+    return '"' + columna.replace('"', '""') + '"'
+
+
+def _a_python(valor):
+    """Convierte escalares de numpy/pandas a tipos que sqlite3 sabe enlazar."""
+    if valor is None:
+        return None
+    try:
+        if pd.isna(valor):
+            return None
+    except (TypeError, ValueError):
+        pass
+    if isinstance(valor, datetime):  # incluye pd.Timestamp
+        return valor.strftime(FORMATO_FECHA)
+    if hasattr(valor, 'item'):
+        return valor.item()
+    return valor
+
+
+def _normalizar_columnas(df):
+    """Garantiza las columnas de la venta (en orden) sin descartar extras."""
+    for col in COLUMNAS_VENTA:
+        if col not in df.columns:
+            df[col] = None
+    extras = [c for c in df.columns if c not in ESQUEMA_VENTAS]
+    return df[COLUMNAS_VENTA + extras]
+
+
+def _completar_columnas(df):
+    """Agrega vacías las columnas de la venta posteriores a los datos (bases, archivos y espejos viejos)."""
+    faltan = [c for c in COLUMNAS_VENTA if c not in df.columns]
+    if df.empty or not faltan:
+        return df
+    df = df.copy(deep=False)
+    for columna in faltan:
+        df[columna] = None
+    return df
+
+
+def _agregar_columnas(con):
+    """ALTER TABLE para las columnas de ESQUEMA_VENTAS que la tabla ventas aún no tiene."""
+    existentes = {fila[1] for fila in con.execute("PRAGMA table_info(ventas)")}
+    for columna, afinidad in ESQUEMA_VENTAS.items():
+        if columna not in existentes:
+            con.execute(f"ALTER TABLE ventas ADD COLUMN {_q(columna)} {afinidad}")
+
+
+def _a_fecha(serie, estricto):
+    texto = serie.astype(object).where(serie.notna() & (serie.astype(object) != ''), None)
+    fechas = pd.to_datetime(texto, format=FORMATO_FECHA, errors='coerce')
+    otras = fechas.isna() & texto.notna()
+    if otras.any():  # fechas con segundos, ISO o celdas de fecha de Excel
+        fechas[otras] = pd.to_datetime(texto[otras], format='mixed', errors='raise' if estricto else 'coerce')
+    return fechas
+
+
+def _como_texto(valor):
+    # Excel devuelve como número una talla escrita como número (8, o 8.0 si la columna tiene vacíos).
+    if valor is None or isinstance(valor, str):
+        return valor
+    if isinstance(valor, float) and valor.is_integer():
+        valor = int(valor)
+    return str(valor)
+
+
+def _a_categoria(serie, categorias):
+    if isinstance(serie.dtype, pd.CategoricalDtype) and (
+            categorias is None or list(serie.cat.categories[:len(categorias)]) == categorias):
+        return serie
+    valores = serie.astype(object).where(serie.notna(), None)
+    if any(not isinstance(valor, str) for valor in valores.dropna().unique()):
+        valores = valores.map(_como_texto)
+    if categorias is None:
+        return valores.astype('category')
+    extras = sorted(set(valores.dropna()) - set(categorias))
+    return pd.Series(pd.Categorical(valores, categories=categorias + extras), index=serie.index)
+
+
+def aplicar_tipos(df, estricto=False):
+    """Lleva las columnas de la venta presentes en df a sus tipos en memoria.
+
+    Enumeraciones -> category, cantidades y pesos -> Int64, medidas y metros
+    -> float64, fechas -> datetime64 y el resto -> str (Arrow). Las columnas
+    que ya tienen su tipo no se tocan. Con estricto (al escribir) un valor
+    que no convierte lanza ValueError; al cargar queda vacío.
+    """
+    df = df.copy(deep=False)
+    errores = 'raise' if estricto else 'coerce'
+    for columna in [c for c in COLUMNAS_VENTA if c in df.columns]:
+        serie = df[columna]
+        if columna in CATEGORIAS_VENTA:
+            nueva = _a_categoria(serie, CATEGORIAS_VENTA[columna])
+        elif columna in COLUMNAS_FECHA:
+            nueva = serie if pd.api.types.is_datetime64_dtype(serie.dtype) else _a_fecha(serie, estricto)
+        elif ESQUEMA_VENTAS[columna] == 'INTEGER':
+            if serie.dtype == 'Int64':
+                continue
+            numeros = pd.to_numeric(serie.where(serie.astype(object) != ''), errors=errores)
+            nueva = numeros.round().astype('Int64')
+        elif ESQUEMA_VENTAS[columna] == 'REAL':
+            if serie.dtype == 'float64':
+                continue
+            nueva = pd.to_numeric(serie.where(serie.astype(object) != ''), errors=errores).astype('float64')
+        else:
+            if serie.dtype == 'str':
+                continue
+            nueva = serie.astype('str')
+        df[columna] = nueva
+    return df
+
+
+def formatear_id(prefijo, numero):
+    return f"{prefijo}-{numero:0{DIGITOS_SECUENCIA}d}"
+
+
+def _numero_id(id_venta, prefijo):
+    """Consecutivo de un ID 'prefijo-NNNN' (0 si no tiene ese formato)."""
+    resto = str(id_venta)[len(prefijo) + 1:] if id_venta else ''
+    return int(resto) if resto.isdigit() else 0
+
+
+def separar_ids_repetidos(df):
+    """Nuevo ID para las filas de ventas que comparten ID con otra venta.
+
+    Antes el ID era la hora al segundo, así que dos ventas cerradas en el
+    mismo segundo quedaban con el mismo ID. Dentro de un ID, en orden de
+    registro, empieza otra venta cuando cambian Cliente o Celular, o cuando
+    se repite un Tipo Detalle ('Niño 1' dos veces). La primera venta conserva
+    el ID y las siguientes reciben ID-2, ID-3... Devuelve una Series (índice de
+    df -> ID nuevo) solo con las filas que cambian.
+    """
+    if df.empty or 'ID' not in df.columns:
+        return pd.Series(dtype=object)
+    datos = df.reindex(columns=['ID', 'Cliente', 'Celular Principal', 'Tipo Detalle']).astype(str)
+    ids = datos['ID']
+    cliente = datos['Cliente'] + '|' + datos['Celular Principal']
+    tramo = cliente.ne(cliente.groupby(ids).shift()).groupby(ids).cumsum()
+    repeticion = datos.groupby([ids, tramo, datos['Tipo Detalle']]).cumcount()
+    venta = datos.groupby([ids, tramo, repeticion], sort=False).ngroup()
+    numero = venta.groupby(ids).rank(method='dense').astype(int)
+    cambian = numero > 1
+    return ids[cambian] + '-' + numero[cambian].astype(str)
+
+
+# --- BACKEND SQLITE ---
+class _ConexionPool(sqlite3.Connection):
+    """Conexión que al cerrarse vuelve al pool en vez de cerrarse de verdad.
+
+    Así `with closing(self._conectar()) as con` sigue igual en todo el
+    backend; lo que quedó sin confirmar se deshace antes de devolverla.
+    """
+    pool = None
+
+    def close(self):
+        if self.pool is not None:
+            try:
+                if self.in_transaction:
+                    self.rollback()
+                self.pool.put_nowait(self)
+                return
+            except (queue.Full, sqlite3.Error):
+                pass
+        super().close()
+
+
+class AlmacenSQLite:
+    LLAVES_ESTABLES = True  # _fila no cambia al borrar otras filas
+    VACIOS_NULOS = False  # "" se guarda y se lee como ""
+
+    def __init__(self, ruta=ARCHIVO_SQLITE, ruta_excel_legado=ARCHIVO_DB, directorio_archivo=DIRECTORIO_ARCHIVO):
+        self.ruta = ruta
+        self.directorio_archivo = directorio_archivo
+        self._local = threading.local()
+        self._pool = queue.LifoQueue(maxsize=CONEXIONES_POOL)
+        self._crear_esquema()
+        self._iniciar_diario()
+        if ruta_excel_legado:
+            self._migrar_excel(ruta_excel_legado)
+        self._separar_ids()
+
+    def _conectar(self):
+        """Conexión del pool (o una nueva); se devuelve al pool con close()."""
+        try:
+            return self._pool.get_nowait()
+        except queue.Empty:
+            pass
+        # check_same_thread=False: pasa de un hilo a otro por el pool, pero la usa uno a la vez.
+        con = sqlite3.connect(self.ruta, timeout=30, check_same_thread=False, factory=_ConexionPool)
+        con.execute("PRAGMA journal_mode=WAL")
+        con.execute("PRAGMA synchronous=NORMAL")
+        con.pool = self._pool
+        return con
+
+    def cerrar_conexiones(self):
+        """Cierra las conexiones que esperan en el pool."""
+        while True:
+            try:
+                con = self._pool.get_nowait()
+            except queue.Empty:
+                return
+            con.pool = None
+            con.close()
+
+    def _crear_esquema(self):
+        columnas = ", ".join(f"{_q(c)} {t}" for c, t in ESQUEMA_VENTAS.items())
+        with closing(self._conectar()) as con, con:
+            con.execute(f"CREATE TABLE IF NOT EXISTS ventas (_fila INTEGER PRIMARY KEY AUTOINCREMENT, {columnas})")
+            _agregar_columnas(con)
+            con.execute('CREATE INDEX IF NOT EXISTS idx_ventas_id ON ventas ("ID")')
+            con.execute("CREATE TABLE IF NOT EXISTS meta (clave TEXT PRIMARY KEY, valor INTEGER)")
+            con.execute("INSERT OR IGNORE INTO meta VALUES ('version', 0)")
+            # Versión por venta (etag) para la concurrencia optimista de ediciones y pagos.
+            con.execute('CREATE TABLE IF NOT EXISTS versiones ("ID" TEXT PRIMARY KEY, version INTEGER NOT NULL)')
+            # Último consecutivo entregado por prefijo de fecha (IDs de venta).
+            con.execute("CREATE TABLE IF NOT EXISTS secuencias (prefijo TEXT PRIMARY KEY, ultimo INTEGER NOT NULL)")
+            # Cola durable de escrituras pendientes (ver cola_escritura).
+            con.execute("CREATE TABLE IF NOT EXISTS cola (seq INTEGER PRIMARY KEY AUTOINCREMENT, "
+                        "creada REAL NOT NULL, proceso TEXT, tipo TEXT NOT NULL, datos TEXT NOT NULL)")
+            # Diario de movimientos (solo se agregan filas) e instantáneas para reconstruirlo (ver diario).
+            con.execute('CREATE TABLE IF NOT EXISTS eventos (seq INTEGER PRIMARY KEY AUTOINCREMENT, '
+                        'registrado TEXT NOT NULL, tipo TEXT NOT NULL, "ID" TEXT, datos TEXT NOT NULL)')
+            con.execute('CREATE INDEX IF NOT EXISTS idx_eventos_id ON eventos ("ID")')
+            con.execute("CREATE TABLE IF NOT EXISTS instantaneas (seq INTEGER PRIMARY KEY, "
+                        "registrada TEXT NOT NULL, filas INTEGER NOT NULL, contenido BLOB NOT NULL)")
+
+    @contextmanager
+    def _escribir(self):
+        """Transacción de escritura que además incrementa la versión de los datos."""
+        with closing(self._conectar()) as con, con:
+            con.execute("BEGIN IMMEDIATE")
+            antes = con.execute("SELECT valor FROM meta WHERE clave = 'version'").fetchone()[0]
+            yield con
+            reclamar = getattr(self._local, 'reclamar', None)
+            if reclamar:
+                self._quitar_de_cola(con, reclamar, exigir=True)
+                self._local.reclamar = None  # solo la primera transacción del bloque
+            con.execute("UPDATE meta SET valor = valor + 1 WHERE clave = 'version'")
+            self._local.transicion = (antes, antes + 1)
+
+    def ultima_transicion(self):
+        """(versión antes, versión después) de la última escritura de este hilo."""
+        return getattr(self._local, 'transicion', (None, None))
+
+    def version(self):
+        with closing(self._conectar()) as con:
+            return con.execute("SELECT valor FROM meta WHERE clave = 'version'").fetchone()[0]
+
+    def versiones_ventas(self, ids):
+        ids = [str(i) for i in ids]
+        versiones = dict.fromkeys(ids, 0)
+        with closing(self._conectar()) as con:
+            for inicio in range(0, len(ids), 500):
+                bloque = ids[inicio:inicio + 500]
+                filas = con.execute(
+                    f'SELECT "ID", version FROM versiones WHERE "ID" IN ({", ".join("?" for _ in bloque)})', bloque)
+                versiones.update(filas.fetchall())
+        return versiones
+
+    @staticmethod
+    def _verificar_versiones(con, versiones):
+        for id_venta, esperada in (versiones or {}).items():
+            fila = con.execute('SELECT version FROM versiones WHERE "ID" = ?', (str(id_venta),)).fetchone()
+            if esperada is not None and (fila[0] if fila else 0) != esperada:
+                raise ConflictoVersion(id_venta)
+
+    @staticmethod
+    def _incrementar_versiones(con, ids):
+        con.executemany('INSERT INTO versiones VALUES (?, 1) ON CONFLICT("ID") DO UPDATE SET version = version + 1',
+                        [(str(i),) for i in set(ids)])
+
+    def _migrar_excel(self, ruta_excel):
+        """Importa una sola vez la base Excel heredada si SQLite está vacío."""
+        if not os.path.exists(ruta_excel) or self._contar() > 0:
+            return
+        try:
+            df = pd.read_excel(ruta_excel, dtype=DTYPES_TEXTO)
+        except Exception:
+            return
+        if 'Tela Sugerida (mts)' in df.columns and not df.empty:
+            self.insertar(df.to_dict('records'))
+
+    # --- COLA DE ESCRITURAS ---
+    def encolar(self, tipo, datos, proceso):
+        """Guarda una escritura pendiente (fsync) y devuelve su número de secuencia."""
+        with closing(self._conectar()) as con:
+            con.execute("PRAGMA synchronous=FULL")
+            try:
+                with con:
+                    cur = con.execute("INSERT INTO cola (creada, proceso, tipo, datos) VALUES (?, ?, ?, ?)",
+                                      (time.time(), proceso, tipo, datos))
+            finally:
+                con.execute("PRAGMA synchronous=NORMAL")  # vuelve al pool como las demás
+            return cur.lastrowid
+
+    def pendientes_cola(self, proceso, antiguedad):
+        """Entradas de otros procesos con más de antiguedad segundos (huérfanas si el proceso murió)."""
+        with closing(self._conectar()) as con:
+            return con.execute("SELECT seq, tipo, datos FROM cola WHERE proceso IS NOT ? AND creada < ? ORDER BY seq",
+                               (proceso, time.time() - antiguedad)).fetchall()
+
+    @contextmanager
+    def reclamando(self, seqs):
+        """La próxima escritura de este hilo quita seqs de la cola en la misma transacción.
+
+        Si alguna ya no está (otro proceso la aplicó) se lanza YaAplicada y no
+        se escribe nada: cada entrada se aplica una sola vez.
+        """
+        self._local.reclamar = list(seqs)
+        try:
+            yield
+        finally:
+            self._local.reclamar = None
+
+    def quitar_de_cola(self, seqs):
+        with closing(self._conectar()) as con, con:
+            self._quitar_de_cola(con, seqs)
+
+    @staticmethod
+    def _quitar_de_cola(con, seqs, exigir=False):
+        seqs = list(seqs)
+        quitadas = 0
+        for inicio in range(0, len(seqs), 500):
+            bloque = seqs[inicio:inicio + 500]
+            quitadas += con.execute(f"DELETE FROM cola WHERE seq IN ({', '.join('?' for _ in bloque)})",
+                                    bloque).rowcount
+        if exigir and quitadas != len(seqs):
+            raise YaAplicada(seqs)
+
+    def _separar_ids(self):
+        """Migración única: separa las ventas que quedaron con el mismo ID."""
+        with closing(self._conectar()) as con:
+            if con.execute("SELECT 1 FROM meta WHERE clave = 'ids_separados'").fetchone():
+                return
+        with self._escribir() as con:
+            if con.execute("SELECT 1 FROM meta WHERE clave = 'ids_separados'").fetchone():
+                return  # otro proceso la hizo mientras esperábamos el bloqueo
+            self._incrementar_versiones(con, self._separar_en(con))
+            con.execute("INSERT INTO meta VALUES ('ids_separados', 1)")
+
+    @staticmethod
+    def _separar_en(con):
+        """Aplica separar_ids_repetidos dentro de la transacción; devuelve los IDs tocados."""
+        df = pd.read_sql_query(
+            'SELECT _fila, "ID", "Cliente", "Celular Principal", "Tipo Detalle" FROM ventas ORDER BY _fila',
+            con, index_col='_fila')
+        nuevos = separar_ids_repetidos(df)
+        con.executemany('UPDATE ventas SET "ID" = ? WHERE _fila = ?',
+                        [(id_nuevo, int(fila)) for fila, id_nuevo in nuevos.items()])
+        AlmacenSQLite._anotar(con, 'edicion', [
+            (df.at[fila, 'ID'], {'filas': {int(fila): {'ID': [df.at[fila, 'ID'], id_nuevo]}}})
+            for fila, id_nuevo in nuevos.items()])
+        return set(df.loc[nuevos.index, 'ID']) | set(nuevos)
+
+    def siguiente_id(self, prefijo):
+        """Reserva el siguiente ID 'prefijo-NNNN'; único entre sesiones y procesos."""
+        return self.reservar_ids(prefijo, 1)[0]
+
+    def reservar_ids(self, prefijo, cantidad):
+        """Reserva cantidad IDs consecutivos en una sola transacción (importaciones)."""
+        with closing(self._conectar()) as con, con:
+            con.execute("BEGIN IMMEDIATE")
+            fila = con.execute("SELECT ultimo FROM secuencias WHERE prefijo = ?", (prefijo,)).fetchone()
+            # El máximo guardado cubre datos restaurados de otra base con su propio contador.
+            maximo = con.execute('SELECT MAX("ID") FROM ventas WHERE "ID" > ? AND "ID" < ?',
+                                 (f"{prefijo}-", f"{prefijo}.")).fetchone()[0]
+            numero = max(fila[0] if fila else 0, _numero_id(maximo, prefijo))
+            con.execute("INSERT INTO secuencias VALUES (?, ?) ON CONFLICT(prefijo) DO UPDATE SET ultimo = excluded.ultimo",
+                        (prefijo, numero + cantidad))
+        return [formatear_id(prefijo, numero + n) for n in range(1, cantidad + 1)]
+
+    def _contar(self):
+        with closing(self._conectar()) as con:
+            return con.execute("SELECT COUNT(*) FROM ventas").fetchone()[0]
+
+    def cargar(self):
+        with closing(self._conectar()) as con:
+            df = pd.read_sql_query("SELECT * FROM ventas ORDER BY _fila", con, index_col='_fila')
+        if df.empty:
+            return pd.DataFrame()
+        df.index.name = None
+        return df
+
+    def insertar(self, filas):
+        """Inserta filas nuevas; devuelve las llaves (_fila) asignadas."""
+        columnas = COLUMNAS_VENTA
+        sql = (f"INSERT INTO ventas ({', '.join(_q(c) for c in columnas)}) "
+               f"VALUES ({', '.join('?' for _ in columnas)})")
+        llaves = []
+        por_venta = {}
+        with self._escribir() as con:
+            for fila in filas:
+                valores = [_a_python(fila.get(c)) for c in columnas]
+                cur = con.execute(sql, valores)
+                llaves.append(cur.lastrowid)
+                por_venta.setdefault(fila.get('ID'), {})[cur.lastrowid] = {
+                    c: v for c, v in zip(columnas, valores) if v is not None}
+            self._incrementar_versiones(con, [fila.get('ID') for fila in filas])
+            self._anotar(con, 'venta', [(i, {'filas': f}) for i, f in por_venta.items()])
+        return llaves
+
+    def actualizar(self, df_filas, versiones=None, evento=None):
+        """Actualiza solo las filas recibidas; el índice es la llave _fila.
+
+        versiones ({ID: versión leída}) activa la verificación optimista: si
+        alguna venta cambió desde entonces se lanza ConflictoVersion y no se
+        escribe nada. evento = (tipo, {ID: datos}) nombra el movimiento en el
+        diario (por defecto 'edicion'); cada venta anota solo lo que cambió.
+        """
+        columnas = [c for c in df_filas.columns if c in ESQUEMA_VENTAS]
+        if not columnas or df_filas.empty:
+            return
+        sql = (f"UPDATE ventas SET {', '.join(f'{_q(c)} = ?' for c in columnas)} "
+               "WHERE _fila = ?")
+        valores = [
+            [_a_python(v) for v in fila] + [int(llave)]
+            for llave, fila in zip(df_filas.index, df_filas[columnas].itertuples(index=False, name=None))
+        ]
+        llaves = [v[-1] for v in valores]
+        tipo, extras = evento or ('edicion', {})
+        with self._escribir() as con:
+            self._verificar_versiones(con, versiones)
+            antes = {}
+            for inicio in range(0, len(llaves), 500):
+                bloque = llaves[inicio:inicio + 500]
+                antes.update((fila[0], fila[1:]) for fila in con.execute(
+                    f'SELECT _fila, "ID", {", ".join(_q(c) for c in columnas)} FROM ventas '
+                    f'WHERE _fila IN ({", ".join("?" for _ in bloque)})', bloque))
+            if len(antes) != len(valores):
+                # Filas que ya no están entre las activas: la venta se archivó o se eliminó.
+                raise VentaArchivada(df_filas['ID'].iloc[0] if 'ID' in df_filas.columns else None)
+            con.executemany(sql, valores)
+            cambios = {}
+            for fila in valores:
+                id_venta, *previos = antes[fila[-1]]
+                distintos = {c: [v0, v1] for c, v0, v1 in zip(columnas, previos, fila) if v0 != v1}
+                if distintos:
+                    cambios.setdefault(id_venta, {})[fila[-1]] = distintos
+            ids = {v[0] for v in antes.values()}
+            if 'ID' in columnas:
+                ids.update(fila[columnas.index('ID')] for fila in valores)
+            self._incrementar_versiones(con, ids)
+            self._anotar(con, tipo, [(i, {'filas': f, **extras.get(str(i), {})}) for i, f in cambios.items()])
+
+    def eliminar(self, id_venta, version=None):
+        with self._escribir() as con:
+            self._verificar_versiones(con, {id_venta: version})
+            borradas = self._filas_diario(con, 'SELECT * FROM ventas WHERE "ID" = ?', (str(id_venta),))
+            con.execute('DELETE FROM ventas WHERE "ID" = ?', (str(id_venta),))
+            if not borradas and str(id_venta) in self.ids_archivo():
+                raise VentaArchivada(id_venta)
+            self._incrementar_versiones(con, [id_venta])
+            if borradas:
+                self._anotar(con, 'eliminacion', [(id_venta, {'filas': borradas})])
+
+    def reemplazar(self, df):
+        """Sustituye todo el contenido (restauración) en una sola transacción."""
+        df = _normalizar_columnas(df.copy())
+        columnas = COLUMNAS_VENTA
+        sql = (f"INSERT INTO ventas ({', '.join(_q(c) for c in columnas)}) "
+               f"VALUES ({', '.join('?' for _ in columnas)})")
+        valores = [[_a_python(v) for v in fila]
+                   for fila in df[columnas].itertuples(index=False, name=None)]
+        with self._descartando_archivo() as apartar_archivo, self._escribir() as con:
+            apartar_archivo()
+            con.execute("DELETE FROM ventas")
+            con.executemany(sql, valores)
+            # Todo lo leído antes de la restauración queda obsoleto.
+            con.execute("UPDATE versiones SET version = version + 1")
+            self._incrementar_versiones(con, df['ID'].dropna().unique())
+            self._anotar(con, 'restauracion', [(None, {'modo': 'reemplazar', 'filas': len(df)})])
+            seq, estado = self._estado_en(con, ((), {}))
+        self._guardar_estado(seq, estado)
+
+    def restaurar(self, bloques, modo='reemplazar'):
+        """Carga bloques de filas en una sola transacción (ver restauracion).
+
+        modo: 'reemplazar' borra todo (archivo incluido) antes de cargar,
+        'actualizar' reemplaza las ventas cuyo ID viene en los bloques (una
+        archivada vuelve a las activas) y 'agregar' omite las filas de IDs que
+        ya existen, activos o archivados. Si un bloque falla no queda nada escrito.
+        """
+        columnas = COLUMNAS_VENTA
+        sql = (f"INSERT INTO ventas ({', '.join(_q(c) for c in columnas)}) "
+               f"VALUES ({', '.join('?' for _ in columnas)})")
+        ids = set()
+        insertadas = omitidas = 0
+        # El archivo que sigue vigente se lee antes de tomar el bloqueo (ver _estado_en).
+        archivo = ((), {}) if modo == 'reemplazar' else self._leer_archivo()
+        with self._descartando_archivo(modo == 'reemplazar') as apartar_archivo, self._escribir() as con:
+            apartar_archivo()
+            if modo == 'reemplazar':
+                con.execute("DELETE FROM ventas")
+                con.execute("UPDATE versiones SET version = version + 1")
+            existentes = set()
+            if modo == 'agregar':
+                existentes = {i for (i,) in con.execute('SELECT DISTINCT "ID" FROM ventas')} | self.ids_archivo()
+            for bloque in bloques:
+                bloque = _normalizar_columnas(bloque.copy())
+                if modo == 'agregar':
+                    nuevas = ~bloque['ID'].isin(existentes)
+                    omitidas += int((~nuevas).sum())
+                    bloque = bloque[nuevas]
+                elif modo == 'actualizar':
+                    # Las filas de una venta pueden venir en bloques distintos: se borra solo la primera vez.
+                    con.executemany('DELETE FROM ventas WHERE "ID" = ?',
+                                    [(i,) for i in set(bloque['ID']) - ids])
+                ids.update(bloque['ID'])
+                con.executemany(sql, ([_a_python(v) for v in fila]
+                                      for fila in bloque[columnas].itertuples(index=False, name=None)))
+                insertadas += len(bloque)
+            ids |= self._separar_en(con)
+            self._incrementar_versiones(con, ids)
+            # El diario no guarda las filas restauradas: la instantánea las cubre.
+            self._anotar(con, 'restauracion', [(None, {'modo': modo, 'filas': insertadas})])
+            if self.firma_archivo() != archivo[0]:  # se archivó entre la lectura y el bloqueo
+                archivo = self._leer_archivo()
+            seq, estado = self._estado_en(con, archivo)
+        self._guardar_estado(seq, estado)
+        return {'insertadas': insertadas, 'omitidas': omitidas, 'ventas': len(ids)}
+
+
+    # --- DIARIO DE MOVIMIENTOS ---
+    # Cada escritura anota sus eventos en la misma transacción que la aplica;
+    # el diario solo recibe INSERT. Las instantáneas guardan el estado
+    # completo (activas y archivo) en un seq del diario: reconstruir parte de
+    # la última y aplica solo los eventos posteriores. Se conservan las
+    # INSTANTANEAS_GUARDADAS más recientes.
+    @staticmethod
+    def _anotar(con, tipo, eventos):
+        """Agrega al diario un evento por (ID, datos)."""
+        registrado = datetime.now(ZONA_HORARIA).strftime('%Y-%m-%d %H:%M:%S')
+        con.executemany('INSERT INTO eventos (registrado, tipo, "ID", datos) VALUES (?, ?, ?, ?)',
+                        [(registrado, tipo, None if i is None else str(i), json.dumps(datos, ensure_ascii=False))
+                         for i, datos in eventos])
+
+    @staticmethod
+    def _filas_diario(con, sql, parametros=()):
+        """{_fila: {columna: valor}} sin los valores vacíos, como se guardan en el diario."""
+        cur = con.execute(sql, parametros)
+        columnas = [d[0] for d in cur.description]
+        return {fila[0]: {c: v for c, v in zip(columnas[1:], fila[1:]) if v is not None} for fila in cur}
+
+    def _iniciar_diario(self):
+        """Instantánea de una base anterior al diario, o la que le faltó a la última restauración."""
+        with closing(self._conectar()) as con, con:
+            con.execute("BEGIN IMMEDIATE")
+            if not con.execute("SELECT 1 FROM eventos UNION ALL SELECT 1 FROM instantaneas LIMIT 1").fetchone():
+                if not (con.execute("SELECT 1 FROM ventas LIMIT 1").fetchone() or self.particiones()):
+                    return
+            else:
+                # Una caída entre confirmar la restauración y guardar su instantánea: si
+                # no se escribió nada después, el estado actual es el de la restauración.
+                ultimo, tipo = (con.execute("SELECT seq, tipo FROM eventos ORDER BY seq DESC LIMIT 1").fetchone()
+                                or (0, None))
+                con_instantanea = con.execute("SELECT 1 FROM instantaneas WHERE seq = ?", (ultimo,)).fetchone()
+                if tipo != 'restauracion' or con_instantanea:
+                    return
+            seq, estado = self._estado_en(con, self._leer_archivo())
+            self._insertar_instantanea(con, seq, len(estado), self._comprimir(estado))
+
+    def _leer_archivo(self):
+        """(firma, {_fila: valores}) de las particiones, con la firma de lo que se alcanzó a leer."""
+        firma, filas = [], {}
+        for ruta in self.particiones():
+            try:
+                firma_particion = self._firma_particion(ruta)
+                with self._abrir_particion(ruta) as particion:
+                    filas.update(self._filas_diario(particion, "SELECT * FROM ventas"))
+            except (FileNotFoundError, sqlite3.OperationalError):
+                continue  # una restauración completa lo apartó; la firma ya no lo cuenta
+            firma.append(firma_particion)
+        return tuple(firma), filas
+
+    def _estado_en(self, con, archivo):
+        """(seq, estado) del último evento visto por con, con las filas archivadas de archivo.
+
+        archivo ((firma, filas) de _leer_archivo) se lee sin bloquear a nadie:
+        solo archivar y restaurar lo cambian, y quien lo pasa comprueba
+        después que su firma siga igual.
+        """
+        seq = con.execute("SELECT COALESCE(MAX(seq), 0) FROM eventos").fetchone()[0]
+        estado = self._filas_diario(con, "SELECT * FROM ventas")
+        activas = {valores.get('ID') for valores in estado.values()}
+        for fila, valores in archivo[1].items():
+            if valores.get('ID') not in activas:  # manda la copia activa, como en cargar_datos
+                estado[fila] = valores
+        return seq, estado
+
+    @staticmethod
+    def _comprimir(estado):
+        return zlib.compress(json.dumps(estado, ensure_ascii=False).encode())
+
+    @staticmethod
+    def _insertar_instantanea(con, seq, filas, contenido):
+        """Guarda la instantánea y borra las que pasan de INSTANTANEAS_GUARDADAS."""
+        con.execute("INSERT OR REPLACE INTO instantaneas VALUES (?, ?, ?, ?)",
+                    (seq, datetime.now(ZONA_HORARIA).strftime('%Y-%m-%d %H:%M:%S'), filas, contenido))
+        podada = con.execute("SELECT seq FROM instantaneas ORDER BY seq DESC LIMIT 1 OFFSET ?",
+                             (max(INSTANTANEAS_GUARDADAS, 1),)).fetchone()
+        if podada:
+            con.execute("DELETE FROM instantaneas WHERE seq <= ?", podada)
+            # instantanea() distingue así "antes de la primera" de "ya se borró".
+            con.execute("INSERT INTO meta VALUES ('instantanea_podada', ?) "
+                        "ON CONFLICT(clave) DO UPDATE SET valor = MAX(valor, excluded.valor)", podada)
+
+    def _guardar_estado(self, seq, estado):
+        """Comprime y guarda fuera de la transacción que leyó estado; solo el INSERT bloquea."""
+        contenido = self._comprimir(estado)
+        with closing(self._conectar()) as con, con:
+            con.execute("BEGIN IMMEDIATE")
+            self._insertar_instantanea(con, seq, len(estado), contenido)
+
+    def guardar_instantanea(self):
+        """Instantánea del estado actual, o None si hay que reintentarla; no cambia los datos.
+
+        Las activas se leen en una transacción de lectura (WAL: no detiene a
+        los escritores) y el archivo antes de ella. Si al guardar ya se
+        archivó o restauró después de seq, lo leído del archivo puede no ser
+        el de seq y no se guarda nada.
+        """
+        archivo = self._leer_archivo()
+        with closing(self._conectar()) as con:
+            con.execute("BEGIN")  # seq y activas de un mismo momento
+            try:
+                seq, estado = self._estado_en(con, archivo)
+            finally:
+                con.rollback()
+        contenido = self._comprimir(estado)
+        with closing(self._conectar()) as con, con:
+            con.execute("BEGIN IMMEDIATE")
+            movido = con.execute("SELECT 1 FROM eventos WHERE seq > ? AND tipo IN ('archivo', 'restauracion') "
+                                 "LIMIT 1", (seq,)).fetchone()
+            if movido or self.firma_archivo() != archivo[0]:
+                return None
+            self._insertar_instantanea(con, seq, len(estado), contenido)
+        return seq
+
+    def eventos(self, desde=0, hasta=None, id_venta=None):
+        """[(seq, registrado, tipo, ID, datos)] con desde < seq <= hasta, en orden."""
+        sql = "SELECT seq, registrado, tipo, \"ID\", datos FROM eventos WHERE seq > ?"
+        parametros = [desde]
+        if hasta is not None:
+            sql += " AND seq <= ?"
+            parametros.append(hasta)
+        if id_venta is not None:
+            sql += ' AND "ID" = ?'
+            parametros.append(str(id_venta))
+        with closing(self._conectar()) as con:
+            return [(seq, registrado, tipo, i, json.loads(datos))
+                    for seq, registrado, tipo, i, datos in con.execute(sql + " ORDER BY seq", parametros)]
+
+    def instantanea(self, hasta=None):
+        """(seq, {_fila: {columna: valor}}) de la última instantánea con seq <= hasta, o None.
+
+        ValueError si la que correspondía ya se borró (ver INSTANTANEAS_GUARDADAS).
+        """
+        filtro = "WHERE seq <= ?" if hasta is not None else ""
+        with closing(self._conectar()) as con:
+            fila = con.execute(f"SELECT seq, contenido FROM instantaneas {filtro} ORDER BY seq DESC LIMIT 1",
+                               [hasta] if hasta is not None else []).fetchone()
+            podada = con.execute("SELECT 1 FROM meta WHERE clave = 'instantanea_podada'").fetchone()
+        if fila is None:
+            if podada:
+                raise ValueError(f"El diario ya no tiene instantáneas anteriores al evento {hasta}.")
+            return None
+        return fila[0], {int(k): v for k, v in json.loads(zlib.decompress(fila[1])).items()}
+
+    def eventos_sin_instantanea(self):
+        with closing(self._conectar()) as con:
+            return con.execute("SELECT (SELECT COALESCE(MAX(seq), 0) FROM eventos) - "
+                               "(SELECT COALESCE(MAX(seq), 0) FROM instantaneas)").fetchone()[0]
+
+    # --- PARTICIONES FRÍAS (ARCHIVO) ---
+    # Las ventas liquidadas pasan a un archivo SQLite por mes de Fecha Venta.
+    # Solo archivar() escribe en ellos; las lecturas los abren en modo ro. Si
+    # una venta quedara a la vez activa y archivada (caída entre los dos
+    # commits de archivar) manda la copia activa, y la próxima pasada la
+    # vuelve a mover.
+    def particiones(self):
+        return sorted(glob.glob(os.path.join(self.directorio_archivo, 'ventas_*.sqlite3')))
+
+    def firma_archivo(self):
+        """(nombre, mtime, tamaño) de cada partición: cambia solo cuando se escribe el archivo."""
+        firma = []
+        for ruta in self.particiones():
+            try:
+                firma.append(self._firma_particion(ruta))
+            except FileNotFoundError:  # una restauración completa lo apartó entre medio
+                continue
+        return tuple(firma)
+
+    @staticmethod
+    def _firma_particion(ruta):
+        info = os.stat(ruta)
+        return os.path.basename(ruta), info.st_mtime_ns, info.st_size
+
+    @staticmethod
+    def _abrir_particion(ruta):
+        return closing(sqlite3.connect(f"file:{ruta}?mode=ro", uri=True, timeout=30))
+
+    def cargar_archivo(self):
+        partes = []
+        for ruta in self.particiones():
+            with self._abrir_particion(ruta) as con:
+                partes.append(pd.read_sql_query("SELECT * FROM ventas ORDER BY _fila", con, index_col='_fila'))
+        partes = [p for p in partes if not p.empty]
+        if not partes:
+            return pd.DataFrame()
+        df = pd.concat(partes)
+        df.index.name = None
+        return df
+
+    def ids_archivo(self):
+        ids = set()
+        for ruta in self.particiones():
+            with self._abrir_particion(ruta) as con:
+                ids.update(i for (i,) in con.execute('SELECT DISTINCT "ID" FROM ventas'))
+        return ids
+
+    def _liquidadas(self, con, limite):
+        # Sin saldo, sin tela en "No" y sin fechas de movimiento posteriores al límite.
+        return [i for (i,) in con.execute(f"""
+            SELECT "ID" FROM ventas WHERE "ID" IS NOT NULL GROUP BY "ID"
+            HAVING SUM(COALESCE({_q('Saldo Pendiente (Distribuido)')}, 0)) <= 0
+               AND COALESCE(SUM({_q('Entrega Tela')} = 'No'), 0) = 0
+               AND MIN({_q('Fecha Venta')}) IS NOT NULL
+               AND MAX(MAX(COALESCE({_q('Fecha Venta')}, ''), COALESCE({_q('Fecha Total Pago')}, ''),
+                           COALESCE({_q('Fecha Entrega Tela')}, ''))) < ?""", (limite,))]
+
+    def archivar(self, limite):
+        """Mueve a su partición mensual las ventas liquidadas sin movimientos desde limite.
+
+        Devuelve los IDs movidos. La partición se confirma antes que el
+        borrado de las activas, así que una caída intermedia no pierde ventas.
+        """
+        with closing(self._conectar()) as con:
+            if not self._liquidadas(con, limite):
+                return []  # caso habitual: ni siquiera se toma el bloqueo de escritura
+        with self._escribir() as con:
+            ids = self._liquidadas(con, limite)
+            filas = pd.concat([
+                pd.read_sql_query(f'SELECT * FROM ventas WHERE "ID" IN ({", ".join("?" for _ in bloque)}) ORDER BY _fila',
+                                  con, params=bloque)
+                for bloque in (ids[i:i + 500] for i in range(0, len(ids), 500))
+            ])
+            periodo = filas.groupby('ID')['Fecha Venta'].transform('min').str[:7]
+            os.makedirs(self.directorio_archivo, exist_ok=True)
+            for mes, grupo in filas.groupby(periodo):
+                self._escribir_particion(os.path.join(self.directorio_archivo, f"ventas_{mes}.sqlite3"), grupo)
+            for inicio in range(0, len(ids), 500):
+                bloque = ids[inicio:inicio + 500]
+                con.execute(f'DELETE FROM ventas WHERE "ID" IN ({", ".join("?" for _ in bloque)})', bloque)
+            self._incrementar_versiones(con, ids)
+            self._anotar(con, 'archivo', [(i, {'filas': [int(f) for f in grupo['_fila']]})
+                                          for i, grupo in filas.groupby('ID', sort=False)])
+        return ids
+
+    @staticmethod
+    def _escribir_particion(ruta, filas):
+        columnas = ['_fila'] + COLUMNAS_VENTA
+        esquema = ", ".join(f"{_q(c)} {t}" for c, t in ESQUEMA_VENTAS.items())
+        with closing(sqlite3.connect(ruta, timeout=30)) as con, con:
+            con.execute("PRAGMA synchronous=FULL")
+            con.execute(f"CREATE TABLE IF NOT EXISTS ventas (_fila INTEGER PRIMARY KEY, {esquema})")
+            _agregar_columnas(con)
+            con.execute('CREATE INDEX IF NOT EXISTS idx_ventas_id ON ventas ("ID")')
+            ids = list(filas['ID'].unique())
+            # Reemplaza la copia de una pasada anterior que no llegó a borrar las activas.
+            con.executemany('DELETE FROM ventas WHERE "ID" = ?', [(i,) for i in ids])
+            con.executemany(f"INSERT INTO ventas ({', '.join(_q(c) for c in columnas)}) "
+                            f"VALUES ({', '.join('?' for _ in columnas)})",
+                            [[_a_python(v) for v in fila] for fila in filas[columnas].itertuples(index=False, name=None)])
+
+    @contextmanager
+    def _descartando_archivo(self, descartar=True):
+        """Para una restauración completa: da apartar(), que mueve el archivo a un lado.
+
+        apartar() se llama ya dentro de _escribir(): con el bloqueo tomado
+        ningún otro archivar o restaurar ve el archivo a medio mover, y si
+        BEGIN IMMEDIATE vence no se movió nada. El archivo apartado se borra
+        cuando la transacción confirmó y vuelve a su lugar si falló.
+        """
+        apartado = []
+
+        def apartar():
+            if descartar and os.path.isdir(self.directorio_archivo):
+                destino = f"{self.directorio_archivo}.descartado-{int(time.time())}"
+                os.replace(self.directorio_archivo, destino)
+                apartado.append(destino)
+        try:
+            yield apartar
+        except BaseException:
+            if apartado:
+                os.replace(apartado[0], self.directorio_archivo)
+            raise
+        if apartado:
+            shutil.rmtree(apartado[0], ignore_errors=True)
+
+
+# --- BACKEND EXCEL (HEREDADO) ---
+class AlmacenExcel:
+    """Reescribe el libro completo en cada operación; solo para compatibilidad."""
+
+    LLAVES_ESTABLES = False  # la llave es la posición en el libro: borrar corre las siguientes
+    VACIOS_NULOS = True  # una celda con "" se lee como vacía
+
+    def __init__(self, ruta=ARCHIVO_DB):
+        self.ruta = ruta
+        self._local = threading.local()
+        self._separar_ids()
+
+    def _separar_ids(self):
+        nuevos = separar_ids_repetidos(self.cargar())
+        if not nuevos.empty:
+            with self._escribir():
+                df = self.cargar()
+                nuevos = separar_ids_repetidos(df)
+                df.loc[nuevos.index, 'ID'] = nuevos
+                df.to_excel(self.ruta, index=False)
+
+    def siguiente_id(self, prefijo):
+        return self.reservar_ids(prefijo, 1)[0]
+
+    def reservar_ids(self, prefijo, cantidad):
+        """Consecutivos guardados en un archivo JSON junto al libro, bajo bloqueo."""
+        ruta = f"{self.ruta}.secuencia"
+        with bloqueo_archivo(ruta):
+            try:
+                with open(ruta, encoding='utf-8') as f:
+                    secuencias = json.load(f)
+            except (FileNotFoundError, ValueError):
+                secuencias = {}
+            if prefijo not in secuencias:
+                df = self.cargar()
+                secuencias[prefijo] = max((_numero_id(i, prefijo) for i in df.get('ID', [])
+                                           if str(i).startswith(f"{prefijo}-")), default=0)
+            primero = secuencias[prefijo] + 1
+            secuencias[prefijo] += cantidad
+            temporal = f"{ruta}.{os.getpid()}.tmp"
+            with open(temporal, 'w', encoding='utf-8') as f:
+                json.dump(secuencias, f)
+            os.replace(temporal, ruta)
+        return [formatear_id(prefijo, numero) for numero in range(primero, primero + cantidad)]
+
+    @contextmanager
+    def _escribir(self, versiones=None):
+        # El archivo completo es la unidad de bloqueo y de versión.
+        with bloqueo_archivo(self.ruta):
+            antes = self.version()
+            # La versión (mtime, tamaño) puede volver de la cola como lista.
+            if any(v is not None and tuple(v) != antes for v in (versiones or {}).values()):
+                raise ConflictoVersion(next(iter(versiones)))
+            yield
+            self._local.transicion = (antes, self.version())
+
+    def versiones_ventas(self, ids):
+        version = self.version()
+        return {str(i): version for i in ids}
+
+    def ultima_transicion(self):
+        return getattr(self._local, 'transicion', (None, None))
+
+    def version(self):
+        """Sin contador propio: la versión es la fecha de modificación y el tamaño."""
+        try:
+            info = os.stat(self.ruta)
+        except FileNotFoundError:
+            return None
+        return (info.st_mtime_ns, info.st_size)
+
+    def cargar(self):
+        if not os.path.exists(self.ruta):
+            return pd.DataFrame()
+        try:
+            df = pd.read_excel(self.ruta, dtype=DTYPES_TEXTO)
+        except Exception:
+            return pd.DataFrame()
+        if 'Tela Sugerida (mts)' not in df.columns:
+            return pd.DataFrame()
+        return df
+
+    def insertar(self, filas):
+        with self._escribir():
+            df = self.cargar()
+            inicio = len(df)
+            df_final = pd.concat([df, pd.DataFrame(filas)], ignore_index=True)
+            df_final.to_excel(self.ruta, index=False)
+        return list(range(inicio, len(df_final)))
+
+    def actualizar(self, df_filas, versiones=None, evento=None):
+        # Sin diario de movimientos: evento se ignora.
+        with self._escribir(versiones):
+            df = self.cargar()
+            columnas = [c for c in df_filas.columns if c in df.columns]
+            # Las columnas leídas del libro no tienen los tipos de memoria (p.ej. fechas en una columna str).
+            df = df.astype({c: object for c in columnas})
+            df.loc[df_filas.index, columnas] = df_filas[columnas].astype(object)
+            df.to_excel(self.ruta, index=False)
+
+    def eliminar(self, id_venta, version=None):
+        with self._escribir({id_venta: version}):
+            df = self.cargar()
+            if not df.empty:
+                df[df['ID'] != str(id_venta)].to_excel(self.ruta, index=False)
+
+    def reemplazar(self, df):
+        with self._escribir():
+            df.to_excel(self.ruta, index=False)
+
+    def restaurar(self, bloques, modo='reemplazar'):
+        # El libro se reescribe completo de todos modos: los bloques se juntan en memoria.
+        with self._escribir():
+            df = self.cargar()
+            nuevo = pd.concat(list(bloques), ignore_index=True)
+            omitidas = 0
+            if df.empty or modo == 'reemplazar':
+                df = nuevo
+            elif modo == 'actualizar':
+                df = pd.concat([df[~df['ID'].isin(nuevo['ID'])], nuevo], ignore_index=True)
+            else:  # 'agregar'
+                repetidas = nuevo['ID'].isin(df['ID'])
+                omitidas = int(repetidas.sum())
+                df = pd.concat([df, nuevo[~repetidas]], ignore_index=True)
+            nuevos = separar_ids_repetidos(df)
+            df.loc[nuevos.index, 'ID'] = nuevos
+            df.to_excel(self.ruta, index=False)
+        return {'insertadas': len(nuevo) - omitidas, 'omitidas': omitidas, 'ventas': nuevo['ID'].nunique()}
+
+
+_almacen = None
+
+
+def obtener_almacen():
+    global _almacen
+    if _almacen is None:
+        _almacen = AlmacenExcel() if BACKEND == 'excel' else AlmacenSQLite()
+    return _almacen
+
+
+# --- CACHÉ COMPARTIDA ---
+# Un único DataFrame por proceso, compartido por todas las sesiones de
+# Streamlit y reconstruido solo cuando cambia la versión de los datos.
+_cache_lock = threading.Lock()
+_cache = {'version': None, 'df': None}
+# Ventas archivadas ya tipadas, por firma de los archivos de partición: una
+# escritura de las activas no obliga a releerlas.
+_cache_archivo = {'firma': None, 'df': None}
+# Activas + archivo (cargar_datos(historial=True)); se arma solo si alguien lo pide.
+_cache_historial = {'activas': None, 'archivo': None, 'df': None}
+# Versión de la caché que ya está en el espejo (ver actualizar_espejo).
+_espejo = {'version': None}
+
+
+_suscriptores = []
+
+
+def invalidar_cache():
+    with _cache_lock:
+        _cache['version'] = None
+        _cache['df'] = None
+        _cache_historial.update(activas=None, archivo=None, df=None)
+        _cache_archivo.update(firma=None, df=None)
+        _espejo['version'] = None
+
+
+def suscribir(funcion):
+    """Registra funcion(evento, df_anterior, df_nuevo, filas) para los cambios de la caché.
+
+    Eventos aplicados sobre la caché vigente (permiten mantener índices y
+    agregados derivados de forma incremental):
+      'insertar'   filas son las filas anexadas al final.
+      'actualizar' filas son las filas modificadas, ya con sus valores nuevos
+                   (los anteriores están en df_anterior.loc[filas.index]).
+      'eliminar'   filas son las filas quitadas (tomadas de df_anterior).
+    'recargar' indica que la caché se reconstruyó completa (filas es None).
+    """
+    _suscriptores.append(funcion)
+
+
+def _notificar(evento, df_anterior, df_nuevo, filas=None):
+    for funcion in _suscriptores:
+        funcion(evento, df_anterior, df_nuevo, filas)
+
+
+def _parchear_cache(evento, transicion, aplicar):
+    """Aplica a la caché una escritura propia sin recargar la base.
+
+    Solo si la caché estaba justo en la versión previa a la escritura
+    (transicion = (antes, después)); si otro proceso escribió entre medio, o
+    el cambio no se puede aplicar, la caché se descarta y la próxima lectura
+    recarga. aplicar(df) devuelve (df_nuevo, filas) sin modificar df, que
+    otras sesiones pueden estar leyendo.
+    """
+    antes, despues = transicion
+    with _cache_lock:
+        df_anterior = _cache['df']
+        cambio = None
+        if df_anterior is not None and _cache['version'] == antes:
+            try:
+                cambio = aplicar(df_anterior)
+            except (TypeError, ValueError, KeyError):
+                pass  # p.ej. un valor que no cabe en el tipo de la columna
+        if cambio is None:
+            _cache['version'] = None
+            _cache['df'] = None
+            return
+        df_nuevo, filas = cambio
+        _cache['version'] = despues
+        _cache['df'] = df_nuevo
+        _notificar(evento, df_anterior, df_nuevo, filas)
+
+
+def _con_categorias(serie, valores):
+    """serie categórica con las categorías que traen valores y aún no tiene."""
+    faltan = pd.Index(valores.dropna().unique()).difference(serie.cat.categories)
+    return serie.cat.add_categories(faltan) if len(faltan) else serie
+
+
+def _anexar_filas(df, nuevas, llaves):
+    nuevas = nuevas.set_axis(llaves)
+    if df.empty:
+        return nuevas, nuevas
+    df = df.copy(deep=False)
+    for columna in [c for c in nuevas.columns if isinstance(df[c].dtype, pd.CategoricalDtype)]:
+        # Mismas categorías en las dos partes, o concat devolvería object.
+        df[columna] = _con_categorias(df[columna], nuevas[columna])
+        nuevas[columna] = pd.Categorical(nuevas[columna].astype(object), categories=df[columna].cat.categories)
+    return pd.concat([df, nuevas]), nuevas
+
+
+def _reemplazar_filas(df, df_filas):
+    # Solo se copian las columnas modificadas; las demás se comparten con df.
+    df_nuevo = df.copy(deep=False)
+    for columna in [c for c in df_filas.columns if c in df.columns]:
+        serie = df[columna].copy()
+        valores = df_filas[columna]
+        if isinstance(serie.dtype, pd.CategoricalDtype):
+            serie = _con_categorias(serie, valores)
+            valores = valores.astype(object)
+        serie.loc[df_filas.index] = valores
+        df_nuevo[columna] = serie
+    return df_nuevo, df_nuevo.loc[df_filas.index]
+
+
+def _quitar_venta(df, id_venta):
+    quitar = (df['ID'].astype(str) == str(id_venta)).to_numpy()
+    return df[~quitar], df[quitar]
+
+
+# Las mismas operaciones sobre una copia, para mostrar escrituras encoladas
+# que todavía no se aplicaron (ver cola_escritura.cargar_datos).
+def con_filas_nuevas(df, filas_venta):
+    """df con las filas de una venta sin guardar al final, con llaves provisionales después de la última."""
+    nuevas = aplicar_tipos(_normalizar_columnas(pd.DataFrame(filas_venta))[COLUMNAS_VENTA])
+    inicio = int(df.index.max()) + 1 if len(df) else 0
+    return _anexar_filas(df, nuevas, pd.RangeIndex(inicio, inicio + len(nuevas)))[0]
+
+
+def con_filas_cambiadas(df, df_filas):
+    """df con df_filas (índice = llave de fila) en lugar de las suyas; las llaves que no están se ignoran."""
+    df_filas = df_filas[df_filas.index.isin(df.index)]
+    return _reemplazar_filas(df, aplicar_tipos(df_filas))[0]
+
+
+def sin_venta(df, id_venta):
+    return _quitar_venta(df, id_venta)[0]
+
+
+# --- ESPEJO COLUMNAR (FEATHER) ---
+# Copia en formato Arrow IPC de la última versión cargada. En un arranque en
+# frío se lee con memory map en lugar de consultar/parsear la base completa.
+def _leer_espejo(version, ruta=ARCHIVO_ESPEJO):
+    """DataFrame del espejo si es de version, o None.
+
+    memory_map evita leer el archivo a un búfer intermedio, pero to_pandas
+    copia cada columna: la caché usa columnas de pandas (categóricas, numpy)
+    y no las de Arrow. Lo que ahorra el espejo es el parseo, no la copia.
+    """
+    if feather is None or not os.path.exists(ruta):
+        return None
+    try:
+        tabla = feather.read_table(ruta, memory_map=True)
+    except Exception:
+        return None
+    meta = tabla.schema.metadata or {}
+    if meta.get(b'version_datos') != str(version).encode():
+        return None
+    return tabla.to_pandas()
+
+
+def espejo_pendiente():
+    """True si la caché tiene una versión que el espejo todavía no."""
+    return _cache['df'] is not None and _cache['version'] != _espejo['version']
+
+
+def actualizar_espejo():
+    """Escribe el espejo de la caché vigente si cambió desde la última vez.
+
+    Reescribir el espejo recorre toda la tabla: lo llama el escritor de la
+    cola cuando queda ocioso, no cada escritura, y sin tomar _cache_lock
+    mientras escribe (el DataFrame de la caché no se modifica, se reemplaza).
+    """
+    with _cache_lock:
+        df, version = _cache['df'], _cache['version']
+    if df is None or version == _espejo['version']:
+        return
+    _escribir_espejo(df, version)
+    _espejo['version'] = version
+
+
+def _escribir_espejo(df, version, ruta=ARCHIVO_ESPEJO):
+    if feather is None or df.empty:
+        return
+    with span('escribir_espejo', len(df)):
+        try:
+            tabla = pa.Table.from_pandas(df, preserve_index=True)
+            meta = dict(tabla.schema.metadata or {})
+            meta[b'version_datos'] = str(version).encode()
+            tabla = tabla.replace_schema_metadata(meta)
+            temporal = f"{ruta}.{os.getpid()}.{threading.get_ident()}.tmp"
+            feather.write_feather(tabla, temporal, compression='uncompressed')
+            os.replace(temporal, ruta)
+        except Exception:
+            # Un espejo que no se puede escribir solo cuesta velocidad, no datos.
+            pass
+
+
+# --- API USADA POR LA APP ---
+def cargar_datos(historial=False):
+    """Devuelve el DataFrame compartido; quien lo modifique debe trabajar sobre una copia.
+
+    Por defecto solo las ventas activas; con historial=True también las
+    archivadas (solo lectura), al final y con sus llaves de fila originales.
+    """
+    return cargar_datos_con_version(historial)[0]
+
+
+def cargar_datos_con_version(historial=False):
+    """(DataFrame de cargar_datos, versión de los datos con que se cargó), leídos juntos."""
+    if historial:
+        activas, version = cargar_datos_con_version()
+        return cargar_historial(activas), version
+    almacen = obtener_almacen()
+    with span('cargar_datos') as medicion:
+        version = almacen.version()
+        with _cache_lock:
+            df = _cache['df']
+            medicion['fuente'] = 'cache'
+            if df is None or _cache['version'] != version:
+                df_anterior = df
+                df = _leer_espejo(version)
+                medicion['fuente'] = 'espejo'
+                if df is None:
+                    df = aplicar_tipos(_completar_columnas(almacen.cargar()))
+                    medicion['fuente'] = BACKEND  # el espejo lo escribe después actualizar_espejo
+                else:
+                    df = aplicar_tipos(_completar_columnas(df))  # espejo de un esquema anterior
+                    _espejo['version'] = version
+                _cache['version'] = version
+                _cache['df'] = df
+                _notificar('recargar', df_anterior, df)
+        medicion['filas'] = len(df)
+        return df, version
+
+
+def cargar_archivadas():
+    """Ventas archivadas con sus tipos (solo lectura, compartido); vacío sin particiones.
+
+    Se releen solo cuando cambia algún archivo de partición, no con cada
+    escritura de las activas. Una venta que esté también entre las activas
+    (caída entre los dos commits de archivar) vale la activa: quien consulte
+    aquí debe buscar primero en cargar_datos().
+    """
+    almacen = obtener_almacen()
+    if not hasattr(almacen, 'archivar'):
+        return pd.DataFrame()
+    firma = almacen.firma_archivo()
+    with _cache_lock:
+        if _cache_archivo['df'] is not None and _cache_archivo['firma'] == firma:
+            return _cache_archivo['df']
+    with span('cargar_archivo') as medicion:
+        df = almacen.cargar_archivo()
+        if not df.empty:
+            df = aplicar_tipos(_completar_columnas(df))  # el archivo puede ser de un esquema anterior
+        medicion['filas'] = len(df)
+    with _cache_lock:
+        _cache_archivo.update(firma=firma, df=df)
+    return df
+
+
+def _concatenar(activas, archivo):
+    """concat de dos partes ya tipadas sin volver a aplicar tipos: se unen las categorías."""
+    activas = activas.copy(deep=False)
+    archivo = archivo.copy(deep=False)
+    for columna in [c for c in activas.columns if isinstance(activas[c].dtype, pd.CategoricalDtype)]:
+        if not isinstance(archivo[columna].dtype, pd.CategoricalDtype):
+            continue
+        activas[columna] = _con_categorias(activas[columna], archivo[columna])
+        archivo[columna] = archivo[columna].cat.set_categories(activas[columna].cat.categories)
+    return pd.concat([activas, archivo])
+
+
+def cargar_historial(activas):
+    """Ventas activas (el DataFrame de cargar_datos()) seguidas de las archivadas."""
+    archivo = cargar_archivadas()
+    if archivo.empty:
+        return activas
+    with _cache_lock:
+        if _cache_historial['activas'] is activas and _cache_historial['archivo'] is archivo:
+            return _cache_historial['df']
+    with span('cargar_historial') as medicion:
+        if activas.empty:
+            df = archivo
+        else:
+            # Una venta a medio archivar (caída entre los dos commits) se toma de las activas.
+            # (como object: isin de texto Arrow recorre los valores en Python)
+            repetidas = archivo['ID'].astype(object).isin(activas['ID'].astype(object))
+            df = _concatenar(activas, archivo[~repetidas.to_numpy()])
+        medicion['filas'] = len(df)
+    with _cache_lock:
+        _cache_historial.update(activas=activas, archivo=archivo, df=df)
+    return df
+
+
+def _como_se_lee(almacen, df):
+    """df con los valores que devolverá la base al leerlo: lo que se parchea en la caché."""
+    return df.replace({"": None}) if almacen.VACIOS_NULOS else df
+
+
+def guardar_venta(filas_venta):
+    almacen = obtener_almacen()
+    # Los tipos se validan antes de escribir: un valor que no cabe en su columna no llega a la base.
+    nuevas = aplicar_tipos(_como_se_lee(almacen, _normalizar_columnas(pd.DataFrame(filas_venta))[COLUMNAS_VENTA]),
+                           estricto=True)
+    with span('guardar_venta', len(filas_venta)):
+        llaves = almacen.insertar(nuevas.to_dict('records'))
+    _parchear_cache('insertar', almacen.ultima_transicion(),
+                    lambda df: _anexar_filas(df, nuevas, llaves))
+    return llaves
+
+
+def actualizar_db(df_filas, versiones=None, evento=None):
+    """Persiste las filas modificadas (índice = llave de fila devuelta por cargar_datos).
+
+    Con versiones ({ID: versión}) rechaza la escritura con ConflictoVersion si
+    otra sesión modificó alguna de esas ventas. evento = (tipo, {ID: datos})
+    es lo que queda en el diario (por defecto una 'edicion').
+    """
+    if df_filas.empty:
+        return
+    almacen = obtener_almacen()
+    df_filas = aplicar_tipos(_como_se_lee(almacen, df_filas), estricto=True)
+    try:
+        with span('actualizar_db', len(df_filas)):
+            almacen.actualizar(df_filas, versiones, evento)
+    except (ConflictoVersion, VentaArchivada):
+        raise  # rechazada antes de escribir: la caché sigue valiendo
+    except Exception:
+        invalidar_cache()
+        raise
+    _parchear_cache('actualizar', almacen.ultima_transicion(),
+                    lambda df: _reemplazar_filas(df, df_filas))
+
+
+def eliminar_venta(id_venta, version=None):
+    almacen = obtener_almacen()
+    try:
+        with span('eliminar_venta'):
+            almacen.eliminar(id_venta, version)
+    except (ConflictoVersion, VentaArchivada):
+        raise
+    except Exception:
+        invalidar_cache()
+        raise
+    if not almacen.LLAVES_ESTABLES:
+        invalidar_cache()
+        return
+    _parchear_cache('eliminar', almacen.ultima_transicion(),
+                    lambda df: _quitar_venta(df, id_venta))
+
+
+def version_venta(id_venta):
+    return obtener_almacen().versiones_ventas([id_venta])[str(id_venta)]
+
+
+def versiones_ventas(ids):
+    return obtener_almacen().versiones_ventas(ids)
+
+
+def actualizar_fusionando(ids, calcular, intentos=3, evento=None):
+    """Escritura con reintento para operaciones acumulativas (pagos, tela).
+
+    calcular(df) recibe los datos frescos y devuelve las filas a escribir (o
+    una tupla cuyo primer elemento son esas filas). Si otra sesión modificó
+    alguna venta entre la lectura y la escritura se recalcula sobre los datos
+    nuevos, de modo que ningún abono se pierde. Devuelve lo que devolvió calcular.
+    """
+    for intento in range(intentos):
+        versiones = versiones_ventas(ids)  # antes de leer: un cambio intermedio da conflicto, no pérdida
+        resultado = calcular(cargar_datos())
+        filas = resultado[0] if isinstance(resultado, tuple) else resultado
+        try:
+            if not filas.empty:
+                actualizar_db(filas, versiones, evento)
+            return resultado
+        except ConflictoVersion:
+            if intento == intentos - 1:
+                raise
+
+
+def nuevo_id_venta(fecha):
+    """ID único y creciente para una venta nueva: fecha de la venta + consecutivo del día."""
+    return obtener_almacen().siguiente_id(fecha.strftime('%Y%m%d'))
+
+
+def nuevos_ids_venta(fecha, cantidad):
+    """cantidad IDs consecutivos de una vez (como nuevo_id_venta, para importaciones)."""
+    return obtener_almacen().reservar_ids(fecha.strftime('%Y%m%d'), cantidad)
+
+
+def reemplazar_db(df):
+    # Un respaldo anterior a los IDs consecutivos puede traer IDs repetidos.
+    df = df.copy()
+    nuevos = separar_ids_repetidos(df)
+    df.loc[nuevos.index, 'ID'] = nuevos
+    with span('reemplazar_db', len(df)):
+        obtener_almacen().reemplazar(df)
+    invalidar_cache()
+
+
+def archivar_liquidadas(dias=DIAS_ARCHIVO):
+    """Mueve al archivo las ventas sin saldo ni tela pendiente y sin movimientos hace dias días."""
+    almacen = obtener_almacen()
+    if not hasattr(almacen, 'archivar'):
+        return []  # el backend Excel no se particiona
+    limite = (datetime.now(ZONA_HORARIA) - timedelta(days=dias)).strftime(FORMATO_FECHA)
+    with span('archivar_liquidadas') as medicion:
+        ids = almacen.archivar(limite)
+        medicion['filas'] = len(ids)
+    if ids:
+        movidas = set(ids)
+        _parchear_cache('eliminar', almacen.ultima_transicion(),
+                        lambda df: (df[~df['ID'].isin(movidas)], df[df['ID'].isin(movidas)]))
+    return ids
+
+
+def restaurar_db(bloques, modo='reemplazar'):
+    """Aplica una restauración por bloques (ver restauracion); todo o nada."""
+    try:
+        with span('restaurar_db') as medicion:
+            resultado = obtener_almacen().restaurar(bloques, modo)
+            medicion['filas'] = resultado['insertadas']
+    finally:
+        invalidar_cache()
+    return resultado
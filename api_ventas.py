@@ -0,0 +1,369 @@
+"""API HTTP/JSON local para crear ventas, registrar pagos y tela y consultar saldos.
+
+Uso:
+    python api_ventas.py                                  # 127.0.0.1:8765
+    python api_ventas.py --host 0.0.0.0 --puerto 9000
+    python api_ventas.py --carga 5000 --hilos 16 --ruta /ventas/20250301-0001
+
+Corre junto a la app de Streamlit sobre la misma base: las ventas se arman
+con pedidos (igual que el formulario y el importador) y toda escritura pasa
+por la cola de escrituras, que junta las peticiones concurrentes en una sola
+transacción. Cada petición de escritura espera a que se aplique, así que una
+consulta posterior ya la ve. Con VENTAS_API_TOKEN se exige el encabezado
+`Authorization: Bearer <token>`.
+
+    GET  /salud
+    GET  /ventas/<ID>                 venta con sus filas (también archivadas)
+    GET  /ventas?celular=<número>     ventas de un Celular Principal
+    POST /consultas                   {"ids": [...], "celulares": [...]} en una petición
+    POST /ventas                      filas del importador: [{...}] o {"filas": [...], "colegio": ...}
+    POST /pagos                       {"ID", "Valor"} o una lista
+    POST /telas                       {"ID", "Metros"} o una lista
+
+Los errores responden {"error": ...} (y "errores" con el detalle por fila al
+crear ventas).
+"""
+import argparse
+import hmac
+import http.client
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit, unquote
+
+import numpy as np
+import pandas as pd
+
+import almacenamiento
+from almacenamiento import COLUMNAS_VENTA, FORMATO_FECHA, ConflictoVersion, VentaArchivada
+from cola_escritura import encolar
+from indices import obtener_indices
+from instrumentacion import span
+from pedidos import ZONA_HORARIA, cargar_config, estado_pago, guardar_pedidos, normalizar_filas, preparar_pedidos
+
+PUERTO = 8765
+TOKEN = os.environ.get('VENTAS_API_TOKEN')
+MAX_CUERPO = 5 * 1024 * 1024  # bytes por petición
+MAX_LOTE = 5000               # elementos por petición (filas, pagos, entregas o consultas)
+ESPERA_ESCRITURA = 30         # segundos que una petición espera a que se aplique su escritura
+
+
+class ErrorPeticion(Exception):
+    def __init__(self, estado, mensaje, **detalle):
+        super().__init__(mensaje)
+        self.estado = estado
+        self.cuerpo = {'error': mensaje, **detalle}
+
+
+# --- CONSULTAS ---
+def _valor_json(valor):
+    if valor is None or valor is pd.NA or valor is pd.NaT or valor != valor:  # valor != valor: NaN
+        return None
+    if isinstance(valor, pd.Timestamp):
+        return valor.strftime(FORMATO_FECHA)
+    return valor.item() if isinstance(valor, np.generic) else valor
+
+
+def _registros(filas):
+    """Filas de la venta como dicts listos para JSON (una sola conversión a objetos, no una por fila)."""
+    return [dict(zip(COLUMNAS_VENTA, map(_valor_json, fila)))
+            for fila in filas[COLUMNAS_VENTA].to_numpy(dtype=object).tolist()]
+
+
+def _ventas(filas):
+    """Una entrada por venta con totales y estado, en el orden de las filas."""
+    por_venta = {}
+    for registro in _registros(filas):
+        por_venta.setdefault(registro['ID'], []).append(registro)
+    ventas = []
+    for id_venta, registros in por_venta.items():
+        total = sum(r['Subtotal niño(a)'] or 0 for r in registros)
+        pagado = sum(r['Pagado (Distribuido)'] or 0 for r in registros)
+        primera = registros[0]
+        ventas.append({
+            'ID': id_venta,
+            'Cliente': primera['Cliente'],
+            'Celular Principal': primera['Celular Principal'],
+            'Fecha Venta': primera['Fecha Venta'],
+            'Total': total,
+            'Pagado': pagado,
+            'Saldo': sum(r['Saldo Pendiente (Distribuido)'] or 0 for r in registros),
+            'Estado Pago': estado_pago(total, pagado),
+            'filas': registros,
+        })
+    return ventas
+
+
+# Ventas ya serializadas (por ID) de las activas y del archivo leídos; cada memo se descarta
+# cuando cambia su DataFrame (las activas con cualquier escritura, el archivo solo al archivar).
+_cache_consultas = {'activas': None, 'ventas': {}, 'archivo': None, 'archivadas': {}}
+_cache_lock = threading.Lock()
+
+
+def _serializar(memo, indices, ids):
+    faltan = [i for i in ids if i not in memo]
+    if faltan:
+        nuevas = {venta['ID']: venta for venta in _ventas(indices.filas(*faltan))}
+        with _cache_lock:
+            memo.update(nuevas)
+
+
+def consultar(ids=(), celulares=()):
+    """{'ventas': {ID: venta o None}, 'celulares': {celular: [ventas]}} en una sola lectura.
+
+    Primero las ventas activas; el archivo solo se consulta por los IDs que no
+    están activos (y por celular, para las ventas archivadas de ese número).
+    """
+    activas = almacenamiento.cargar_datos()
+    archivo = almacenamiento.cargar_archivadas()
+    with _cache_lock:
+        if _cache_consultas['activas'] is not activas:
+            _cache_consultas.update(activas=activas, ventas={})
+        if _cache_consultas['archivo'] is not archivo:
+            _cache_consultas.update(archivo=archivo, archivadas={})
+        memo, memo_archivo = _cache_consultas['ventas'], _cache_consultas['archivadas']
+    indices = obtener_indices(activas)
+    ids = [str(i).strip() for i in ids]
+    celulares = [str(c).strip() for c in celulares]
+    por_celular = {c: indices.ids_celular(c) for c in celulares}
+    activos = [i for i in dict.fromkeys(ids + [i for lista in por_celular.values() for i in lista]) if i in indices]
+    _serializar(memo, indices, activos)
+    archivados = []
+    if not archivo.empty and (celulares or len(activos) < len(ids)):
+        indices_archivo = obtener_indices(archivo)
+        for celular, lista in por_celular.items():
+            lista += [i for i in indices_archivo.ids_celular(celular) if i not in indices]
+        archivados = [i for i in dict.fromkeys(ids + [i for lista in por_celular.values() for i in lista])
+                      if i not in indices and i in indices_archivo]
+        _serializar(memo_archivo, indices_archivo, archivados)
+
+    def venta(id_venta):
+        return memo.get(id_venta) or memo_archivo.get(id_venta)
+    return {'ventas': {i: venta(i) for i in ids},
+            'celulares': {c: [venta(i) for i in lista] for c, lista in por_celular.items()}}
+
+
+# --- ESCRITURAS ---
+def _lista(cuerpo, clave=None):
+    """Lista de objetos de la petición (un objeto solo también vale)."""
+    if clave and isinstance(cuerpo, dict) and clave in cuerpo:
+        cuerpo = cuerpo[clave]
+    elementos = [cuerpo] if isinstance(cuerpo, dict) else cuerpo
+    if not isinstance(elementos, list) or not all(isinstance(e, dict) for e in elementos):
+        raise ErrorPeticion(400, "Se esperaba un objeto JSON o una lista de objetos.")
+    if not elementos:
+        raise ErrorPeticion(400, "La petición no trae elementos.")
+    if len(elementos) > MAX_LOTE:
+        raise ErrorPeticion(413, f"Máximo {MAX_LOTE} elementos por petición.")
+    return elementos
+
+
+def _esperar(ticket):
+    if not ticket.esperar(ESPERA_ESCRITURA):
+        raise ErrorPeticion(503, "La escritura sigue en cola; consulte más tarde.")
+    if isinstance(ticket.error, (ConflictoVersion, VentaArchivada)):
+        raise ErrorPeticion(409, str(ticket.error))
+    if ticket.error is not None:
+        raise ticket.error
+    return ticket.aviso
+
+
+def crear_ventas(cuerpo):
+    filas = _lista(cuerpo, 'filas')
+    colegio = cuerpo.get('colegio') if isinstance(cuerpo, dict) else None
+    # Fila N = elemento N de la lista (desde 1), como en los errores del importador.
+    pedidos, errores = preparar_pedidos(normalizar_filas(pd.DataFrame(filas), primera_fila=1),
+                                        cargar_config(), colegio)
+    if errores:
+        raise ErrorPeticion(400, f"{len(errores)} errores; no se guardó nada.", errores=errores)
+    ids = guardar_pedidos(pedidos, descripcion=f"{len(pedidos)} ventas desde la API")
+    return 201, {'ids': ids}
+
+
+def _movimientos(cuerpo, campo):
+    """Pagos o entregas validados, con la fecha de ahora."""
+    fecha = datetime.now(ZONA_HORARIA).strftime(FORMATO_FECHA)
+    movimientos, errores = [], []
+    for numero, elemento in enumerate(_lista(cuerpo), start=1):
+        id_venta = str(elemento.get('ID') or "").strip()
+        valor = elemento.get(campo)
+        if not id_venta:
+            errores.append(f"Elemento {numero}: falta ID")
+        elif isinstance(valor, bool) or not isinstance(valor, (int, float)) or not valor > 0:
+            errores.append(f"Elemento {numero}: '{campo}' debe ser un número mayor que cero")
+        else:
+            movimientos.append({'ID': id_venta, campo: valor, 'Fecha': fecha})
+    if errores:
+        raise ErrorPeticion(400, f"{len(errores)} errores; no se registró nada.", errores=errores)
+    return movimientos
+
+
+def registrar_pagos(cuerpo):
+    pagos = _movimientos(cuerpo, 'Valor')
+    aviso = _esperar(encolar('pagos', pagos, f"{len(pagos)} pagos desde la API"))
+    return 200, {'registrados': len(pagos), 'aviso': aviso}
+
+
+def registrar_telas(cuerpo):
+    entregas = _movimientos(cuerpo, 'Metros')
+    aviso = _esperar(encolar('telas', entregas, f"{len(entregas)} entregas de tela desde la API"))
+    return 200, {'registrados': len(entregas), 'aviso': aviso}
+
+
+# --- SERVIDOR ---
+class ManejadorVentas(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # conexiones persistentes
+    disable_nagle_algorithm = True  # encabezados y cuerpo salen en escrituras separadas
+    server_version = "VentasAPI/1.0"
+
+    def log_message(self, formato, *args):
+        pass  # cada petición queda como span en instrumentacion
+
+    def _responder(self, estado, cuerpo):
+        datos = json.dumps(cuerpo, ensure_ascii=False, default=str).encode('utf-8')
+        self.send_response(estado)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(datos)))
+        self.end_headers()
+        self.wfile.write(datos)
+
+    def _cuerpo(self):
+        largo = int(self.headers.get('Content-Length') or 0)
+        if largo > MAX_CUERPO:
+            self.close_connection = True  # el cuerpo no se lee
+            raise ErrorPeticion(413, f"El cuerpo supera {MAX_CUERPO} bytes.")
+        try:
+            return json.loads(self.rfile.read(largo) or b'null')
+        except (UnicodeDecodeError, json.JSONDecodeError):
+            raise ErrorPeticion(400, "El cuerpo no es JSON válido.")
+
+    def _autorizado(self):
+        if not TOKEN:
+            return True
+        return hmac.compare_digest(self.headers.get('Authorization', ''), f"Bearer {TOKEN}")
+
+    def _atender(self, metodo):
+        ruta = urlsplit(self.path)
+        partes = [unquote(p) for p in ruta.path.strip('/').split('/')]
+        with span(f"api_{metodo.lower()}_{partes[0] or 'raiz'}"):
+            try:
+                if not self._autorizado():
+                    raise ErrorPeticion(401, "Token inválido o ausente.")
+                self._responder(*self._despachar(metodo, partes, parse_qs(ruta.query)))
+            except ErrorPeticion as e:
+                self._responder(e.estado, e.cuerpo)
+            except Exception as e:
+                self._responder(500, {'error': f"{type(e).__name__}: {e}"})
+
+    def _despachar(self, metodo, partes, parametros):
+        if metodo == 'GET' and partes == ['salud']:
+            return 200, {'estado': "ok"}
+        if metodo == 'GET' and len(partes) == 2 and partes[0] == 'ventas':
+            venta = consultar(ids=[partes[1]])['ventas'][partes[1].strip()]
+            if venta is None:
+                raise ErrorPeticion(404, f"No existe la venta {partes[1]}.")
+            return 200, venta
+        if metodo == 'GET' and partes == ['ventas']:
+            celular = parametros.get('celular', [""])[0].strip()
+            if not celular:
+                raise ErrorPeticion(400, "Indique ?celular=<Celular Principal>.")
+            return 200, {'ventas': consultar(celulares=[celular])['celulares'][celular]}
+        if metodo == 'POST' and partes == ['consultas']:
+            cuerpo = self._cuerpo()
+            if not isinstance(cuerpo, dict):
+                raise ErrorPeticion(400, 'Se esperaba {"ids": [...], "celulares": [...]}.')
+            ids, celulares = cuerpo.get('ids') or [], cuerpo.get('celulares') or []
+            if len(ids) + len(celulares) > MAX_LOTE:
+                raise ErrorPeticion(413, f"Máximo {MAX_LOTE} consultas por petición.")
+            return 200, consultar(ids, celulares)
+        escrituras = {'ventas': crear_ventas, 'pagos': registrar_pagos, 'telas': registrar_telas}
+        if metodo == 'POST' and len(partes) == 1 and partes[0] in escrituras:
+            return escrituras[partes[0]](self._cuerpo())
+        raise ErrorPeticion(404, f"No existe {metodo} /{'/'.join(partes)}.")
+
+    def do_GET(self):
+        self._atender('GET')
+
+    def do_POST(self):
+        self._atender('POST')
+
+
+class ServidorVentas(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128  # el valor por defecto (5) rechaza conexiones en ráfagas de clientes
+
+
+def servir(host='127.0.0.1', puerto=PUERTO):
+    servidor = ServidorVentas((host, puerto), ManejadorVentas)
+    almacenamiento.cargar_datos()  # calienta las cachés antes de la primera consulta
+    almacenamiento.cargar_archivadas()
+    print(f"API de ventas en http://{host}:{puerto} (Ctrl+C para detener)")
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        servidor.server_close()
+
+
+# --- PRUEBA DE CARGA ---
+def prueba_carga(host, puerto, ruta, peticiones, hilos, cuerpo=None):
+    """Lanza peticiones a ruta desde hilos con conexión persistente; devuelve p50/p95 y req/s."""
+    local = threading.local()
+    datos = json.dumps(cuerpo).encode('utf-8') if cuerpo is not None else None
+    encabezados = {'Content-Type': 'application/json'}
+    if TOKEN:
+        encabezados['Authorization'] = f"Bearer {TOKEN}"
+
+    def una(_):
+        if getattr(local, 'con', None) is None:
+            local.con = http.client.HTTPConnection(host, puerto, timeout=ESPERA_ESCRITURA)
+        inicio = time.perf_counter()
+        try:
+            local.con.request('POST' if datos is not None else 'GET', ruta, body=datos, headers=encabezados)
+            respuesta = local.con.getresponse()
+            respuesta.read()
+            estado = respuesta.status
+        except (OSError, http.client.HTTPException):
+            local.con.close()
+            local.con, estado = None, 0
+        return (time.perf_counter() - inicio) * 1000, estado
+
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(hilos) as pool:
+        resultados = list(pool.map(una, range(peticiones)))
+    segundos = time.perf_counter() - inicio
+    ms = np.array([r[0] for r in resultados])
+    estados = pd.Series([r[1] for r in resultados]).value_counts().to_dict()
+    return {'peticiones': peticiones, 'req/s': round(peticiones / segundos, 1),
+            'p50 (ms)': round(float(np.percentile(ms, 50)), 2),
+            'p95 (ms)': round(float(np.percentile(ms, 95)), 2), 'estados': estados}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="API HTTP/JSON local de ventas.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--puerto', type=int, default=PUERTO)
+    parser.add_argument('--carga', type=int, metavar='PETICIONES',
+                        help="En vez de servir, prueba la carga de un servidor ya corriendo")
+    parser.add_argument('--hilos', type=int, default=16, help="Clientes concurrentes de la prueba de carga")
+    parser.add_argument('--ruta', default='/salud', help="Ruta que pide la prueba de carga")
+    parser.add_argument('--cuerpo', help="JSON a enviar por POST en la prueba de carga")
+    args = parser.parse_args(argv)
+
+    if args.carga:
+        cuerpo = json.loads(args.cuerpo) if args.cuerpo else None
+        resultado = prueba_carga(args.host, args.puerto, args.ruta, args.carga, args.hilos, cuerpo)
+        print(json.dumps(resultado, ensure_ascii=False))
+        return 0 if set(resultado['estados']) <= {200, 201} else 1
+    servir(args.host, args.puerto)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
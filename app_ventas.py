@@ -1,19 +1,59 @@
 import streamlit as st
 import pandas as pd
-import os
+import numpy as np
 from datetime import datetime
+import functools
 import time
-import pytz 
-import math
-import json
+import uuid
+from almacenamiento import (
+    version_venta, versiones_ventas, nuevo_id_venta
+)
+import cola_escritura
+from cola_escritura import encolar, encolar_actualizacion, esperar_escrituras
+from busqueda import buscar
+from indices import obtener_indices
+from exportacion import exportar_excel, exportar_lista_corte
+from restauracion import previsualizar, restaurar, RespaldoInvalido, MODOS as MODOS_RESTAURACION
+from instrumentacion import span, iniciar_rerun, cerrar_rerun, rerun_en_curso, resumen_ventana
+from calculos import (
+    redondear_tela, calcular_tela, recalcular_lineas, repreciar_ventas,
+    filas_pendientes, filas_saldo_pendiente, filas_tela_pendiente
+)
+from pedidos import (
+    TALLAS, ZONA_HORARIA, cargar_config, guardar_config, historial_precios, config_de_filas,
+    item_nino, item_nina, estado_pago as calcular_estado_pago, validar_venta, filas_venta
+)
+from agregados import resumen_post_venta, obtener_lista_corte, PASO_MEDIDA
+from diario import movimientos
 
 # --- CONFIGURACIÓN DE ZONA HORARIA ---
-timezone_co = pytz.timezone('America/Bogota')
+timezone_co = ZONA_HORARIA
 
 # --- CONFIGURACIÓN DE LA PÁGINA ---
 st.set_page_config(page_title="Gestión de Ventas Uniformes", layout="wide")
-ARCHIVO_DB = 'base_datos_ventas.xlsx'
-ARCHIVO_CONFIG = 'config_precios.json'
+
+# --- INSTRUMENTACIÓN ---
+# Cada rerun agrupa sus spans (carga, guardado, filtros, render...) para el panel de tiempos.
+if 'id_sesion' not in st.session_state:
+    st.session_state.id_sesion = uuid.uuid4().hex
+iniciar_rerun(st.session_state.id_sesion)
+
+
+def fragmento(funcion):
+    """st.fragment cuyo rerun propio (solo el fragmento) se registra aparte.
+
+    Dentro de un rerun completo los spans van al de la página; si st.rerun()
+    corta el fragmento, el próximo iniciar_rerun lo cierra como incompleto.
+    """
+    @functools.wraps(funcion)
+    def envoltura(*args, **kwargs):
+        if rerun_en_curso():
+            return funcion(*args, **kwargs)
+        iniciar_rerun(st.session_state.id_sesion, fragmento=funcion.__name__)
+        resultado = funcion(*args, **kwargs)
+        cerrar_rerun(st.session_state.id_sesion)
+        return resultado
+    return st.fragment(envoltura)
 
 # --- ESTILOS CSS ---
 st.markdown("""
@@ -28,62 +68,6 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-# --- FUNCIONES DE BASE DE DATOS ---
-def cargar_datos():
-    if os.path.exists(ARCHIVO_DB):
-        try:
-            df = pd.read_excel(ARCHIVO_DB, dtype={'ID': str, 'Celular Principal': str, 'Celular Adicional': str})
-            if 'Tela Sugerida (mts)' not in df.columns:
-                return pd.DataFrame()
-            return df
-        except:
-            return pd.DataFrame()
-    else:
-        return pd.DataFrame()
-
-def guardar_venta(filas_venta):
-    df = cargar_datos()
-    df_nuevo = pd.DataFrame(filas_venta)
-    df_final = pd.concat([df, df_nuevo], ignore_index=True)
-    df_final.to_excel(ARCHIVO_DB, index=False)
-
-def actualizar_db(df):
-    df.to_excel(ARCHIVO_DB, index=False)
-
-# --- FUNCIONES DE CONFIGURACIÓN (PRECIOS) ---
-def cargar_config():
-    defaults = {
-        "precios_nino": {
-            "4": 44000, "6": 44000, "8": 44000, "10": 44000, "12": 44000, "14": 44000,
-            "16": 46000, "S": 46000, "M": 46000,
-            "L": 48000, "XL": 48000
-        },
-        "precios_nina": {
-            "4": 38000, "6": 38000, "8": 38000,
-            "10": 40000, "12": 40000, "14": 40000, "16": 40000,
-            "S": 43000, "M": 43000,
-            "L": 46000, "XL": 46000
-        },
-        "precio_pantalon": 35000,
-        "ultima_actualizacion": "Valores Iniciales"
-    }
-    
-    if os.path.exists(ARCHIVO_CONFIG):
-        try:
-            with open(ARCHIVO_CONFIG, 'r') as f:
-                return json.load(f)
-        except:
-            return defaults
-    return defaults
-
-def guardar_config(nuevo_config):
-    with open(ARCHIVO_CONFIG, 'w') as f:
-        json.dump(nuevo_config, f)
-
-# --- FUNCIONES DE CÁLCULO ---
-def redondear_tela(metros_reales):
-    return math.ceil(metros_reales * 10) / 10
-
 # --- INICIALIZACIÓN DE ESTADO ---
 if 'carrito_ninos' not in st.session_state:
     st.session_state.carrito_ninos = []
@@ -98,229 +82,310 @@ if 'num_forms_ninas' not in st.session_state:
 if 'confirmar_eliminar' not in st.session_state:
     st.session_state.confirmar_eliminar = False
 
+# Versión de cada venta tal como se mostró en el último rerun (concurrencia optimista)
+if 'versiones_vistas' not in st.session_state:
+    st.session_state.versiones_vistas = {}
+
+# --- ESCRITURAS EN SEGUNDO PLANO ---
+# Las escrituras se encolan y la app sigue sin esperar; el resultado de cada
+# una se informa con un toast en cuanto se aplica (este rerun o uno siguiente)
+# y mientras tanto cargar_datos la muestra encima de los datos guardados.
+ESPERA_AVISOS = 0.2  # segundos, en total, para avisar en este rerun lo recién encolado
+if 'escrituras' not in st.session_state:
+    st.session_state.escrituras = []
+if 'avisos' not in st.session_state:
+    st.session_state.avisos = []
+
+def cargar_datos(historial=False):
+    return cola_escritura.cargar_datos(historial, st.session_state.escrituras)
+
+def encolar_escritura(tipo, datos, descripcion):
+    st.session_state.escrituras.append(encolar(tipo, datos, descripcion))
+
+def encolar_edicion(df_filas, versiones, descripcion):
+    st.session_state.escrituras.append(encolar_actualizacion(df_filas, versiones, descripcion))
+
+for aviso in st.session_state.avisos:
+    st.toast(aviso)
+st.session_state.avisos = []
+escrituras_pendientes = []
+limite_avisos = time.monotonic() + ESPERA_AVISOS
+for ticket in st.session_state.escrituras:
+    if not ticket.esperar(timeout=max(limite_avisos - time.monotonic(), 0)):
+        escrituras_pendientes.append(ticket)
+    elif ticket.error is not None:
+        st.error(f"⚠️ {ticket.descripcion}: {ticket.error}")
+    else:
+        st.toast(f"✅ {ticket.descripcion}")
+        if ticket.aviso:
+            st.warning(ticket.aviso)
+st.session_state.escrituras = escrituras_pendientes
+
 # Cargar configuración
-config_actual = cargar_config()
+with span('cargar_config'):
+    config_actual = cargar_config()
 precios_camisas_nino = config_actual["precios_nino"]
 precios_camisas_nina = config_actual["precios_nina"]
 costo_pantalon = config_actual["precio_pantalon"]
+tallas = TALLAS
+
+def descargar_excel():
+    # Corre en otro hilo al hacer clic: primero se aplica lo que esta sesión encoló.
+    esperar_escrituras(timeout=30)
+    return exportar_excel()
+
+def descargar_lista_corte(colegio):
+    esperar_escrituras(timeout=30)
+    return exportar_lista_corte(colegio)
 
 # --- BARRA LATERAL ---
-st.sidebar.header("⚙️ Configuración")
+# Fragmento: sus botones y el formulario de precios se re-ejecutan solos; un
+# cambio de precios o una restauración pide un rerun completo (st.rerun()).
+@fragmento
+def barra_lateral():
+    st.header("⚙️ Configuración")
 
-# SECCIÓN DE RESPALDO
-st.sidebar.markdown("### 📥 Respaldo y Restauración")
+    # SECCIÓN DE RESPALDO
+    st.markdown("### 📥 Respaldo y Restauración")
 
-# 1. Descargar
-if os.path.exists(ARCHIVO_DB):
-    with open(ARCHIVO_DB, "rb") as f:
-        bytes_data = f.read()
-    
+    # 1. Descargar (el Excel se arma al hacer clic y se reutiliza mientras los datos no cambien)
     ahora_bq = datetime.now(timezone_co)
-    hora_generacion = ahora_bq.strftime("%Y-%m-%d %I:%M %p")
-    
-    st.sidebar.download_button(
+    st.download_button(
         label="Descargar Excel",
-        data=bytes_data,
+        data=descargar_excel,
         file_name=f"Ventas_Uniformes_{ahora_bq.strftime('%Y-%m-%d')}.xlsx",
-        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        on_click="ignore"
     )
-    st.sidebar.caption(f"📅 Datos al: {hora_generacion}")
-else:
-    st.sidebar.warning("Base de datos vacía.")
+    st.caption("Hojas: Ventas, Producción por Talla, Cartera y Lista de Corte.")
 
-st.sidebar.markdown("---")
-
-# 2. Subir (Restaurar)
-st.sidebar.markdown("#### 🔄 Restaurar Base de Datos")
-archivo_subido = st.sidebar.file_uploader("Subir Excel para restaurar", type=["xlsx"])
+    st.markdown("---")
 
-if archivo_subido is not None:
-    if st.sidebar.button("⚠️ Confirmar Restauración"):
-        try:
-            df_restore = pd.read_excel(archivo_subido)
-            if 'ID' in df_restore.columns:
-                df_restore.to_excel(ARCHIVO_DB, index=False)
-                st.sidebar.success("¡Restauración exitosa! Reiniciando...")
-                time.sleep(2)
-                st.rerun()
+    # 2. Subir (Restaurar)
+    st.markdown("#### 🔄 Restaurar Base de Datos")
+    archivo_subido = st.file_uploader("Subir Excel para restaurar", type=["xlsx"])
+
+    if archivo_subido is not None:
+        modo_restauracion = st.radio("Modo de restauración", list(MODOS_RESTAURACION),
+                                     format_func=MODOS_RESTAURACION.get, key="modo_restauracion")
+        # Primero se valida el archivo completo (sin escribir nada) y se muestra el resumen.
+        if st.button("🔍 Validar archivo"):
+            esperar_escrituras()
+            try:
+                st.session_state.vista_restauracion = (archivo_subido.file_id, previsualizar(archivo_subido))
+            except Exception as e:
+                st.session_state.pop('vista_restauracion', None)
+                st.error(f"No se pudo leer el archivo: {e}")
+
+        vista = st.session_state.get('vista_restauracion')
+        if vista and vista[0] == archivo_subido.file_id:
+            resumen_rest = vista[1]
+            for aviso in resumen_rest['avisos']:
+                st.warning(aviso)
+            if resumen_rest['n_errores']:
+                st.error(f"{resumen_rest['n_errores']} errores; no se puede restaurar:\n\n"
+                         + "\n\n".join(resumen_rest['errores']))
             else:
-                st.sidebar.error("El archivo no tiene el formato correcto (falta columna ID).")
-        except Exception as e:
-            st.sidebar.error(f"Error al restaurar: {e}")
-
-st.sidebar.markdown("---")
-st.sidebar.header("💰 Gestión de Precios")
+                st.info(f"**{resumen_rest['filas']} filas** | {resumen_rest['ventas']} ventas "
+                        f"({resumen_rest['nuevas']} nuevas, {resumen_rest['existentes']} ya existen)\n\n"
+                        f"Total: ${resumen_rest['total']:,.0f} | Pagado: ${resumen_rest['pagado']:,.0f} | "
+                        f"Saldo: ${resumen_rest['saldo']:,.0f}\n\n"
+                        f"Suma de verificación: `{resumen_rest['checksum'][:16]}`")
+                if modo_restauracion == 'reemplazar':
+                    st.caption(f"Se borrarán las {resumen_rest['filas_actuales']} filas actuales.")
+                if st.button("⚠️ Confirmar Restauración"):
+                    esperar_escrituras()  # lo encolado antes de restaurar no debe caer encima
+                    try:
+                        resultado = restaurar(archivo_subido, modo_restauracion, resumen_rest['checksum'])
+                    except RespaldoInvalido as e:
+                        st.session_state.pop('vista_restauracion', None)
+                        st.error(f"No se restauró nada: {e}")
+                    except Exception as e:
+                        st.error(f"Error al restaurar (la base no cambió): {e}")
+                    else:
+                        del st.session_state.vista_restauracion
+                        st.session_state.avisos.append(
+                            f"¡Restauración exitosa! {resultado['insertadas']} filas cargadas"
+                            + (f", {resultado['omitidas']} omitidas (ID existente)." if resultado['omitidas'] else "."))
+                        st.rerun()
 
-st.sidebar.info(f"📅 Act: {config_actual.get('ultima_actualizacion', 'N/A')}")
+    st.markdown("---")
+    st.header("💰 Gestión de Precios")
 
-with st.sidebar.form("form_precios"):
-    tallas = ["4", "6", "8", "10", "12", "14", "16", "S", "M", "L", "XL"]
+    st.info(f"📅 Act: {config_actual.get('ultima_actualizacion', 'N/A')} (versión {config_actual['version']})")
 
-    st.markdown("#### 👦 Camisas NIÑO")
-    input_precios_nino = {}
-    for talla in tallas:
-        val_default = config_actual["precios_nino"].get(talla, 0)
-        input_precios_nino[talla] = st.number_input(f"Costo Niño Talla {talla}", value=int(val_default), step=1000, format="%d", key=f"p_nino_{talla}")
+    with st.form("form_precios"):
+        st.markdown("#### 👦 Camisas NIÑO")
+        input_precios_nino = {}
+        for talla in tallas:
+            val_default = config_actual["precios_nino"].get(talla, 0)
+            input_precios_nino[talla] = st.number_input(f"Costo Niño Talla {talla}", value=int(val_default), step=1000, format="%d", key=f"p_nino_{talla}")
 
-    st.markdown("#### 👖 Pantalón NIÑO")
-    val_pant = config_actual.get("precio_pantalon", 35000)
-    input_pantalon = st.number_input("Costo Pantalón", value=int(val_pant), step=1000, format="%d")
+        st.markdown("#### 👖 Pantalón NIÑO")
+        val_pant = config_actual.get("precio_pantalon", 35000)
+        input_pantalon = st.number_input("Costo Pantalón", value=int(val_pant), step=1000, format="%d")
 
-    st.markdown("---")
-    st.markdown("#### 👧 Camisas NIÑA")
-    input_precios_nina = {}
-    for talla in tallas:
-        val_default = config_actual["precios_nina"].get(talla, 0)
-        input_precios_nina[talla] = st.number_input(f"Costo Niña Talla {talla}", value=int(val_default), step=1000, format="%d", key=f"p_nina_{talla}")
+        st.markdown("---")
+        st.markdown("#### 👧 Camisas NIÑA")
+        input_precios_nina = {}
+        for talla in tallas:
+            val_default = config_actual["precios_nina"].get(talla, 0)
+            input_precios_nina[talla] = st.number_input(f"Costo Niña Talla {talla}", value=int(val_default), step=1000, format="%d", key=f"p_nina_{talla}")
     
-    submitted = st.form_submit_button("💾 CONFIRMAR CAMBIOS")
+        submitted = st.form_submit_button("💾 CONFIRMAR CAMBIOS")
     
-    if submitted:
-        ahora_bq = datetime.now(timezone_co)
-        fecha_act = ahora_bq.strftime("%Y-%m-%d %I:%M %p")
+        if submitted:
+            ahora_bq = datetime.now(timezone_co)
+            fecha_act = ahora_bq.strftime("%Y-%m-%d %I:%M %p")
         
-        nuevo_conf = {
-            "precios_nino": input_precios_nino,
-            "precios_nina": input_precios_nina,
-            "precio_pantalon": input_pantalon,
-            "ultima_actualizacion": fecha_act
-        }
-        guardar_config(nuevo_conf)
-        st.success("✅ Precios actualizados!")
-        time.sleep(1)
-        st.rerun()
-
+            nuevo_conf = {
+                "precios_nino": input_precios_nino,
+                "precios_nina": input_precios_nina,
+                "precio_pantalon": input_pantalon,
+                "ultima_actualizacion": fecha_act
+            }
+            guardado = guardar_config(nuevo_conf)
+            st.session_state.avisos.append(f"✅ Precios actualizados! (versión {guardado['version']})")
+            st.rerun()
 
-# --- INTERFAZ PRINCIPAL ---
-st.title("👕 Sistema de Ventas - Uniformes NCP")
+    with st.expander("🕘 Historial de precios"):
+        st.caption("Cada venta guarda la versión de la lista con que se calculó; al editarla se usa esa misma lista.")
+        st.dataframe(pd.DataFrame([
+            {"Versión": version, "Actualización": conf.get("ultima_actualizacion", ""),
+             "Pantalón": conf.get("precio_pantalon"),
+             **{f"Niño {t}": conf["precios_nino"].get(t) for t in tallas},
+             **{f"Niña {t}": conf["precios_nina"].get(t) for t in tallas}}
+            for version, conf in reversed(historial_precios().items())
+        ]), hide_index=True)
+
+    # RE-PRECIO MASIVO DE VENTAS EXISTENTES
+    with st.expander("🔁 Aplicar precios a ventas existentes"):
+        st.caption("Recalcula con la lista de precios vigente el valor y el saldo de las ventas seleccionadas.")
+        # Formulario: las ventas se cargan al pedir la vista previa, no cada vez que se dibuja la barra.
+        with st.form("form_repreciar"):
+            solo_pendientes = st.checkbox("Solo ventas sin 'Pago Total'", value=True)
+            colegio_repreciar = st.text_input("Colegio (vacío = todos)", key="colegio_repreciar").strip()
+            ver_cambios = st.form_submit_button("👁️ Ver cambios")
+
+        if ver_cambios:
+            df_precios = cargar_datos()
+            mascara = pd.Series(True, index=df_precios.index)
+            if not df_precios.empty:
+                if solo_pendientes:
+                    mascara &= df_precios['Estado Pago'] != "Pago Total"
+                if colegio_repreciar:
+                    mascara &= df_precios['Colegio'].astype(str).str.casefold() == colegio_repreciar.casefold()
+            # Versiones leídas antes de recalcular: si alguna venta cambia antes de aplicar, se rechaza.
+            versiones_repreciado = versiones_ventas(df_precios.loc[mascara, 'ID'].unique()) if not df_precios.empty else {}
+            df_precios = cargar_datos()
+            mascara = mascara.reindex(df_precios.index, fill_value=False)
+            st.session_state.repreciado = repreciar_ventas(df_precios, config_actual, mascara) + (versiones_repreciado,)
+
+        if 'repreciado' in st.session_state:
+            filas_repreciadas, resumen_repreciado, versiones_repreciado = st.session_state.repreciado
+            if resumen_repreciado.empty:
+                st.info("Ninguna venta cambia con los precios actuales.")
+            else:
+                st.write(f"**{len(resumen_repreciado)} ventas** | Diferencia total: ${resumen_repreciado['Diferencia'].sum():,.0f}")
+                st.dataframe(resumen_repreciado, hide_index=True)
+                if st.button("✅ Aplicar nuevos precios"):
+                    # Si alguna venta cambió desde la vista previa se rechaza todo y se avisa.
+                    encolar_edicion(filas_repreciadas, {i: versiones_repreciado.get(str(i)) for i in resumen_repreciado['ID']},
+                                    f"Nuevos precios en {len(resumen_repreciado)} ventas")
+                    del st.session_state.repreciado
+                    st.rerun()
 
-menu = st.radio("Seleccione una opción:", ["Nueva Venta", "Buscar / Editar Ventas"])
+with st.sidebar:
+    barra_lateral()
 
-# ==========================================
-# SECCIÓN 1: NUEVA VENTA
-# ==========================================
-if menu == "Nueva Venta":
-    st.subheader("Datos del Cliente")
-    col1, col2 = st.columns(2)
-    with col1:
-        nombre_cliente = st.text_input("Nombre Cliente (Obligatorio)")
-        celular_principal = st.text_input("Celular Principal (Obligatorio)")
-        celular_adicional = st.text_input("Celular Adicional (Opcional)")
-        
-    with col2:
-        descripcion = st.text_area("Descripción")
-        colegio = st.text_input("Colegio", value="NCP") 
 
-    st.markdown("---")
-    
-    col_main_nino, col_main_nina = st.columns(2)
-    
-    with col_main_nino:
-        st.markdown("### 👦 Niño")
-        
-        for i in range(st.session_state.num_forms_ninos):
-            num_nino = i + 1
-            with st.expander(f"Detalles Niño {num_nino}", expanded=True):
-                nombre_alumno_m = st.text_input(f"Nombre Alumno", key=f"nom_nino_{i}")
+# --- FORMULARIOS DE NIÑO / NIÑA ---
+# Cada formulario es un fragmento: escribir en uno solo re-ejecuta sus propios
+# widgets. Confirmar un pedido cambia el carrito y pide un rerun completo.
+@fragmento
+def formulario_nino(i):
+    num_nino = i + 1
+    with st.expander(f"Detalles Niño {num_nino}", expanded=True):
+        nombre_alumno_m = st.text_input(f"Nombre Alumno", key=f"nom_nino_{i}")
                 
-                cant_camisa_m = st.number_input("Cant. Camisa", min_value=0, value=0, key=f"cant_cam_nino_{i}")
-                talla_camisa_m = "4" 
-                if cant_camisa_m > 0:
-                    talla_camisa_m = st.selectbox("Talla Camisa", tallas, key=f"talla_nino_{i}")
-                    costo_actual = precios_camisas_nino.get(talla_camisa_m, 0)
-                    st.caption(f"Precio Unitario: ${costo_actual:,.0f}")
+        cant_camisa_m = st.number_input("Cant. Camisa", min_value=0, value=0, key=f"cant_cam_nino_{i}")
+        talla_camisa_m = "4" 
+        if cant_camisa_m > 0:
+            talla_camisa_m = st.selectbox("Talla Camisa", tallas, key=f"talla_nino_{i}")
+            costo_actual = precios_camisas_nino.get(talla_camisa_m, 0)
+            st.caption(f"Precio Unitario: ${costo_actual:,.0f}")
                 
-                st.markdown("---")
+        st.markdown("---")
                 
-                cant_pantalon = st.number_input("Cant. Pantalón", min_value=0, value=0, key=f"cant_pant_nino_{i}")
+        cant_pantalon = st.number_input("Cant. Pantalón", min_value=0, value=0, key=f"cant_pant_nino_{i}")
                 
-                cintura, cadera, pierna, largo_cm = 0, 0, 0, 0
-                if cant_pantalon > 0:
-                    st.caption("Medidas Pantalón (cm):")
-                    cintura = st.number_input("Cintura (cm)", min_value=0, step=1, format="%d", key=f"cint_nino_{i}")
-                    cadera = st.number_input("Cadera (cm)", min_value=0, step=1, format="%d", key=f"cad_nino_{i}")
-                    pierna = st.number_input("Pierna (cm)", min_value=0, step=1, format="%d", key=f"pier_nino_{i}")
+        cintura, cadera, pierna, largo_cm = 0, 0, 0, 0
+        if cant_pantalon > 0:
+            st.caption("Medidas Pantalón (cm):")
+            cintura = st.number_input("Cintura (cm)", min_value=0, step=1, format="%d", key=f"cint_nino_{i}")
+            cadera = st.number_input("Cadera (cm)", min_value=0, step=1, format="%d", key=f"cad_nino_{i}")
+            pierna = st.number_input("Pierna (cm)", min_value=0, step=1, format="%d", key=f"pier_nino_{i}")
                     
-                    largo_cm = st.number_input("Largo Pantalón (cm)", min_value=0, step=1, format="%d", key=f"largo_nino_{i}")
+            largo_cm = st.number_input("Largo Pantalón (cm)", min_value=0, step=1, format="%d", key=f"largo_nino_{i}")
 
-                es_actualizacion = i < len(st.session_state.carrito_ninos)
-                texto_boton = "🔄 Actualizar pedido" if es_actualizacion else "✅ Confirmar pedido"
+        es_actualizacion = i < len(st.session_state.carrito_ninos)
+        texto_boton = "🔄 Actualizar pedido" if es_actualizacion else "✅ Confirmar pedido"
                 
-                if st.button(texto_boton, key=f"btn_nino_{i}"):
-                    precio_camisa = precios_camisas_nino.get(talla_camisa_m, 0) if cant_camisa_m > 0 else 0
-                    subtotal = (cant_camisa_m * precio_camisa) + (cant_pantalon * costo_pantalon)
-                    
-                    # CÁLCULO DE TELA SUGERIDA (SIEMPRE SE CALCULA)
-                    consumo_tela_item = ((largo_cm / 100.0) + 0.20) * cant_pantalon if cant_pantalon > 0 else 0
+        if st.button(texto_boton, key=f"btn_nino_{i}"):
+            # CÁLCULO DE PRECIO Y TELA SUGERIDA (SIEMPRE SE CALCULA)
+            item_data = {"ID_Temp": i, **item_nino(num_nino, nombre_alumno_m, cant_camisa_m, talla_camisa_m,
+                                                   cant_pantalon, cintura, cadera, pierna, largo_cm, config_actual)}
                     
-                    item_data = {
-                        "ID_Temp": i, 
-                        "Tipo_Visual": f"Niño {num_nino}",
-                        "Nombre Alumno": nombre_alumno_m,
-                        "Camisas": cant_camisa_m,
-                        "Talla Camisa": talla_camisa_m if cant_camisa_m > 0 else "N/A",
-                        "Pantalones": cant_pantalon,
-                        "Medidas Cin": cintura if cant_pantalon > 0 else 0,
-                        "Medidas Cad": cadera if cant_pantalon > 0 else 0,
-                        "Medidas Pier": pierna if cant_pantalon > 0 else 0,
-                        "Largo Pantalon": largo_cm if cant_pantalon > 0 else 0, 
-                        "Consumo Tela Calc": consumo_tela_item,
-                        "Subtotal": subtotal
-                    }
-                    
-                    if es_actualizacion:
-                        st.session_state.carrito_ninos[i] = item_data
-                        st.success(f"Niño {num_nino} actualizado.")
-                    else:
-                        st.session_state.carrito_ninos.append(item_data)
-                        st.success(f"Niño {num_nino} confirmado.")
-
-        if st.button("➕ Adicionar otro Niño"):
-            st.session_state.num_forms_ninos += 1
+            if es_actualizacion:
+                st.session_state.carrito_ninos[i] = item_data
+                st.session_state.avisos.append(f"Niño {num_nino} actualizado.")
+            else:
+                st.session_state.carrito_ninos.append(item_data)
+                st.session_state.avisos.append(f"Niño {num_nino} confirmado.")
+            # El resumen del pedido está fuera del fragmento
             st.rerun()
 
-    with col_main_nina:
-        st.markdown("### 👧 Niña")
-        
-        for i in range(st.session_state.num_forms_ninas):
-            num_nina = i + 1
-            with st.expander(f"Detalles Niña {num_nina}", expanded=True):
-                nombre_alumno_f = st.text_input(f"Nombre Alumna", key=f"nom_nina_{i}")
+@fragmento
+def formulario_nina(i):
+    num_nina = i + 1
+    with st.expander(f"Detalles Niña {num_nina}", expanded=True):
+        nombre_alumno_f = st.text_input(f"Nombre Alumna", key=f"nom_nina_{i}")
                 
-                cant_camisa_f = st.number_input("Cant. Camisa", min_value=0, value=0, key=f"cant_cam_nina_{i}")
-                talla_camisa_f = "4"
-                if cant_camisa_f > 0:
-                    talla_camisa_f = st.selectbox("Talla Camisa", tallas, key=f"talla_nina_{i}")
-                    costo_actual = precios_camisas_nina.get(talla_camisa_f, 0)
-                    st.caption(f"Precio Unitario: ${costo_actual:,.0f}")
+        cant_camisa_f = st.number_input("Cant. Camisa", min_value=0, value=0, key=f"cant_cam_nina_{i}")
+        talla_camisa_f = "4"
+        if cant_camisa_f > 0:
+            talla_camisa_f = st.selectbox("Talla Camisa", tallas, key=f"talla_nina_{i}")
+            costo_actual = precios_camisas_nina.get(talla_camisa_f, 0)
+            st.caption(f"Precio Unitario: ${costo_actual:,.0f}")
                 
-                es_actualizacion_f = i < len(st.session_state.carrito_ninas)
-                texto_boton_f = "🔄 Actualizar pedido" if es_actualizacion_f else "✅ Confirmar pedido"
+        es_actualizacion_f = i < len(st.session_state.carrito_ninas)
+        texto_boton_f = "🔄 Actualizar pedido" if es_actualizacion_f else "✅ Confirmar pedido"
 
-                if st.button(texto_boton_f, key=f"btn_nina_{i}"):
-                    precio_camisa = precios_camisas_nina.get(talla_camisa_f, 0) if cant_camisa_f > 0 else 0
-                    subtotal = (cant_camisa_f * precio_camisa)
+        if st.button(texto_boton_f, key=f"btn_nina_{i}"):
+            item_data = {"ID_Temp": i, **item_nina(num_nina, nombre_alumno_f, cant_camisa_f, talla_camisa_f,
+                                                   config_actual)}
                     
-                    item_data = {
-                        "ID_Temp": i,
-                        "Tipo_Visual": f"Niña {num_nina}",
-                        "Nombre Alumno": nombre_alumno_f,
-                        "Camisas": cant_camisa_f,
-                        "Talla Camisa": talla_camisa_f if cant_camisa_f > 0 else "N/A",
-                        "Subtotal": subtotal
-                    }
-                    
-                    if es_actualizacion_f:
-                        st.session_state.carrito_ninas[i] = item_data
-                        st.success(f"Niña {num_nina} actualizada.")
-                    else:
-                        st.session_state.carrito_ninas.append(item_data)
-                        st.success(f"Niña {num_nina} confirmada.")
-
-        if st.button("➕ Adicionar otra Niña"):
-            st.session_state.num_forms_ninas += 1
+            if es_actualizacion_f:
+                st.session_state.carrito_ninas[i] = item_data
+                st.session_state.avisos.append(f"Niña {num_nina} actualizada.")
+            else:
+                st.session_state.carrito_ninas.append(item_data)
+                st.session_state.avisos.append(f"Niña {num_nina} confirmada.")
+            # El resumen del pedido está fuera del fragmento
             st.rerun()
 
+
+# --- RESUMEN Y CIERRE DE LA VENTA ---
+# Fragmento: tela, tipo y valor de pago se re-ejecutan solos. Los datos del
+# cliente se leen de session_state, que siempre tiene el último valor.
+@fragmento
+def resumen_venta():
+    nombre_cliente = st.session_state.nombre_cliente
+    celular_principal = st.session_state.celular_principal
+    celular_adicional = st.session_state.celular_adicional
+    descripcion = st.session_state.descripcion
+    colegio = st.session_state.colegio
+
     st.markdown("---")
     
     consumo_tela_bruto = sum(n.get('Consumo Tela Calc', 0) for n in st.session_state.carrito_ninos)
@@ -377,134 +442,110 @@ if menu == "Nueva Venta":
     with col_pay2:
         tipo_pago = st.selectbox("Tipo de Pago", ["-Seleccionar-", "Efectivo", "Transferencia"])
 
-    estado_pago = "Pendiente"
-    if valor_recibido == 0:
-        estado_pago = "Pendiente"
-    elif valor_recibido > 0:
-        if valor_recibido < gran_total:
-            estado_pago = "Abono"
-            st.warning(f"⚠️ Restan: ${gran_total - valor_recibido:,.0f}")
-        elif valor_recibido == gran_total:
-            estado_pago = "Pago Total"
-            st.success("✅ PAGO TOTAL")
-        else:
-            st.error("Error: Valor recibido mayor al total")
+    estado_pago = calcular_estado_pago(gran_total, valor_recibido)
+    if estado_pago == "Abono":
+        st.warning(f"⚠️ Restan: ${gran_total - valor_recibido:,.0f}")
+    elif estado_pago == "Pago Total":
+        st.success("✅ PAGO TOTAL")
+    elif valor_recibido > gran_total:
+        st.error("Error: Valor recibido mayor al total")
     
     if st.button("💾 CERRAR VENTA Y GUARDAR"):
-        errores = []
-        if not nombre_cliente: errores.append("Falta Nombre Cliente")
-        if not celular_principal: errores.append("Falta Celular Principal")
-        if gran_total == 0: errores.append("El pedido está vacío")
-        if valor_recibido > 0 and tipo_pago == "-Seleccionar-":
-            errores.append("Seleccione un Tipo de Pago válido")
+        errores = validar_venta(nombre_cliente, celular_principal, gran_total, valor_recibido, tipo_pago)
 
         if errores:
             for e in errores: st.error(f"⚠️ {e}")
         else:
             ahora_bq = datetime.now(timezone_co)
             fecha_hoy = ahora_bq.strftime("%Y-%m-%d %H:%M")
-            id_venta = ahora_bq.strftime("%Y%m%d%H%M%S")
-            
-            fecha_abono = fecha_hoy if (estado_pago == "Abono") else ""
-            fecha_total = fecha_hoy if (estado_pago == "Pago Total") else ""
-            
-            # Lógica Global Entrega Tela
-            entrega_tela_str = entrega_tela_global if entrega_tela_global == "Si" else "No"
+            id_venta = nuevo_id_venta(ahora_bq)
             
-            saldo_pagado_por_asignar = valor_recibido
-            metros_tela_por_asignar = metros_tela_global if entrega_tela_global == "Si" else 0
+            cliente = {
+                "Cliente": nombre_cliente, "Celular Principal": celular_principal,
+                "Celular Adicional": celular_adicional, "Colegio": colegio, "Descripción": descripcion,
+            }
+            filas_a_guardar = filas_venta(id_venta, fecha_hoy, cliente,
+                                          st.session_state.carrito_ninos, st.session_state.carrito_ninas,
+                                          valor_recibido, tipo_pago, entrega_tela_global, metros_tela_global)
             
-            todos_items = []
-            # Identificamos si es niño o niña
-            for n in st.session_state.carrito_ninos: n['EsNino'] = True; todos_items.append(n)
-            for n in st.session_state.carrito_ninas: n['EsNino'] = False; todos_items.append(n)
-            
-            filas_a_guardar = []
-            fecha_entrega_tela_log = fecha_hoy if entrega_tela_global == "Si" else ""
-            
-            for index, item in enumerate(todos_items):
-                subtotal_item = item['Subtotal']
-                
-                if saldo_pagado_por_asignar >= subtotal_item:
-                    pago_asignado = subtotal_item
-                else:
-                    pago_asignado = saldo_pagado_por_asignar
-                
-                saldo_pagado_por_asignar -= pago_asignado
-                if saldo_pagado_por_asignar < 0: saldo_pagado_por_asignar = 0
-
-                saldo_pendiente_item = subtotal_item - pago_asignado
-                
-                metros_asignados = 0
-                
-                # REQUERIMIENTO: Si es Niña, Entrega Tela siempre es "No Aplica"
-                if item['EsNino'] == False:
-                    estado_entrega_tela_fila = "No Aplica"
-                elif item.get("Pantalones", 0) > 0:
-                    estado_entrega_tela_fila = entrega_tela_str
-                    # Asignación de tela cascada solo si es niño con pantalones
-                    if metros_tela_por_asignar > 0:
-                        metros_asignados = metros_tela_por_asignar
-                        metros_tela_por_asignar = 0 
-                else:
-                    # Niño sin pantalones (raro pero posible)
-                    estado_entrega_tela_fila = "No Aplica"
-                
-                fila = {
-                    "ID": id_venta,
-                    "Fecha Venta": fecha_hoy,
-                    "Cliente": nombre_cliente,
-                    "Celular Principal": str(celular_principal).strip(),
-                    "Celular Adicional": str(celular_adicional).strip() if celular_adicional else "",
-                    "Colegio": colegio,
-                    "Descripción": descripcion,
-                    "Tipo Detalle": item["Tipo_Visual"],
-                    "Nombre Alumno": item["Nombre Alumno"],
-                    "Camisas": item["Camisas"],
-                    "Talla Camisa": item["Talla Camisa"],
-                    "Pantalones": item.get("Pantalones", 0),
-                    
-                    "Largo Pant (cm)": item.get("Largo Pantalon", 0),
-                    "Medidas Cin (cm)": item.get("Medidas Cin", 0),
-                    "Medidas Cad (cm)": item.get("Medidas Cad", 0),
-                    "Medidas Pier (cm)": item.get("Medidas Pier", 0),
-                    
-                    "Tela Sugerida (mts)": round(item.get("Consumo Tela Calc", 0), 2),
-                    
-                    "Subtotal niño(a)": subtotal_item,
-                    "Pagado (Distribuido)": int(pago_asignado),
-                    "Saldo Pendiente (Distribuido)": int(saldo_pendiente_item),
-                    "Estado Pago": estado_pago,
-                    "Medio Pago": tipo_pago if pago_asignado > 0 else "",
-                    "Fecha Abono": fecha_abono if pago_asignado > 0 else "",
-                    "Fecha Total Pago": fecha_total,
-                    
-                    "Entrega Tela": estado_entrega_tela_fila,
-                    "Metros Tela (mts)": round(metros_asignados, 2),
-                    "Fecha Entrega Tela": fecha_entrega_tela_log if metros_asignados > 0 else "",
-                    "Fecha Entrega Nueva Tela": ""
-                }
-                filas_a_guardar.append(fila)
-            
-            if saldo_pagado_por_asignar > 0 and filas_a_guardar:
-                filas_a_guardar[-1]["Pagado (Distribuido)"] += int(saldo_pagado_por_asignar)
-
-            guardar_venta(filas_a_guardar)
+            encolar_escritura('insertar', filas_a_guardar, f"Venta {id_venta} guardada exitosamente.")
             
             st.session_state.carrito_ninos = []
             st.session_state.carrito_ninas = []
             st.session_state.num_forms_ninos = 1
             st.session_state.num_forms_ninas = 1
             st.balloons()
-            st.success("Venta guardada exitosamente.")
-            time.sleep(2)
             st.rerun()
 
+
+# --- HISTORIAL DE MOVIMIENTOS ---
+def mostrar_movimientos(id_venta):
+    with st.expander("📜 Historial de movimientos"):
+        try:
+            historial = movimientos(id_venta)
+        except RuntimeError as e:  # backend Excel: sin diario
+            st.caption(str(e))
+            return
+        if historial.empty:
+            st.caption("Sin movimientos registrados.")
+        else:
+            st.dataframe(historial, hide_index=True)
+
+
+# --- INTERFAZ PRINCIPAL ---
+st.title("👕 Sistema de Ventas - Uniformes NCP")
+
+menu = st.radio("Seleccione una opción:", ["Nueva Venta", "Buscar / Editar Ventas", "Producción (Lista de Corte)"])
+
+# ==========================================
+# SECCIÓN 1: NUEVA VENTA
+# ==========================================
+if menu == "Nueva Venta":
+    st.subheader("Datos del Cliente")
+    col1, col2 = st.columns(2)
+    with col1:
+        st.text_input("Nombre Cliente (Obligatorio)", key="nombre_cliente")
+        st.text_input("Celular Principal (Obligatorio)", key="celular_principal")
+        st.text_input("Celular Adicional (Opcional)", key="celular_adicional")
+        
+    with col2:
+        st.text_area("Descripción", key="descripcion")
+        st.text_input("Colegio", value="NCP", key="colegio")
+
+    st.markdown("---")
+    
+    col_main_nino, col_main_nina = st.columns(2)
+    
+    with col_main_nino:
+        st.markdown("### 👦 Niño")
+        
+        for i in range(st.session_state.num_forms_ninos):
+            formulario_nino(i)
+
+        if st.button("➕ Adicionar otro Niño"):
+            st.session_state.num_forms_ninos += 1
+            st.rerun()
+
+    with col_main_nina:
+        st.markdown("### 👧 Niña")
+        
+        for i in range(st.session_state.num_forms_ninas):
+            formulario_nina(i)
+
+        if st.button("➕ Adicionar otra Niña"):
+            st.session_state.num_forms_ninas += 1
+            st.rerun()
+
+    resumen_venta()
+
 # ==========================================
 # SECCIÓN 2: BUSCAR / EDITAR / DATOS POST-VENTA
 # ==========================================
 elif menu == "Buscar / Editar Ventas":
-    df = cargar_datos()
+    # Por defecto solo las ventas activas; las liquidadas hace más de un mes están en el archivo.
+    incluir_archivadas = st.checkbox("🗄️ Incluir ventas archivadas (solo lectura)", key="incluir_archivadas")
+    df = cargar_datos(historial=incluir_archivadas)
+    indices_activos = obtener_indices(cargar_datos()) if incluir_archivadas else None
     
     st.header("📊 Datos Post-Venta")
     
@@ -514,21 +555,16 @@ elif menu == "Buscar / Editar Ventas":
         with col_dash_filter:
             talla_filter = st.selectbox("Filtrar conteo por Talla:", ["Todas"] + tallas)
         
-        if talla_filter == "Todas":
-            df_counts = df
-        else:
-            df_counts = df[df['Talla Camisa'].astype(str) == talla_filter]
-
-        total_camisas_nino = df_counts[df_counts['Tipo Detalle'].astype(str).str.contains("Niño", na=False)]['Camisas'].sum()
-        total_camisas_nina = df_counts[df_counts['Tipo Detalle'].astype(str).str.contains("Niña", na=False)]['Camisas'].sum()
-        total_pantalones = df_counts['Pantalones'].sum()
+        resumen = resumen_post_venta(df, None if talla_filter == "Todas" else talla_filter)
+        total_camisas_nino = resumen['camisas_nino']
+        total_camisas_nina = resumen['camisas_nina']
+        total_pantalones = resumen['pantalones']
 
-        total_ventas_dinero = df_counts['Subtotal niño(a)'].sum()
-        total_pendiente_dinero = df_counts['Saldo Pendiente (Distribuido)'].sum()
+        total_ventas_dinero = resumen['venta_total']
+        total_pendiente_dinero = resumen['pendiente']
         
-        total_tela_sugerida = df_counts['Tela Sugerida (mts)'].sum()
-        total_tela_entregada = df_counts['Metros Tela (mts)'].sum()
-        balance_tela = total_tela_entregada - total_tela_sugerida
+        total_tela_sugerida = resumen['tela_sugerida']
+        balance_tela = resumen['balance_tela']
 
         st.markdown("---")
         
@@ -578,30 +614,16 @@ elif menu == "Buscar / Editar Ventas":
             else:
                 valor_busqueda = st.text_input(f"Escriba dato para {criterio}...")
 
-        df_filtrado = df.copy()
-        if "SALDO pendiente" in criterio:
-            ids_con_saldo = df.groupby('ID')['Saldo Pendiente (Distribuido)'].sum()
-            ids_con_saldo = ids_con_saldo[ids_con_saldo > 0].index
-            df_filtrado = df[df['ID'].isin(ids_con_saldo)]
-        elif "TELA pendiente" in criterio:
-            df_filtrado = df[(df['Entrega Tela'] == 'No') & (df['Pantalones'] > 0)]
-        elif valor_busqueda:
-            if criterio == "Cliente":
-                df_filtrado = df[df['Cliente'].astype(str).str.contains(valor_busqueda, case=False, na=False)]
-            elif "Celular" in criterio:
-                df_filtrado = df[df[criterio].astype(str).str.contains(valor_busqueda, case=False, na=False)]
-            elif criterio == "Nombre Alumno":
-                df_filtrado = df[df['Nombre Alumno'].astype(str).str.contains(valor_busqueda, case=False, na=False)]
-            else:
-                df_filtrado = df[df[criterio].astype(str).str.contains(valor_busqueda, case=False, na=False)]
+        with span('filtrar', len(df)):
+            df_filtrado = df
+            if "SALDO pendiente" in criterio:
+                df_filtrado = df[filas_saldo_pendiente(df)]
+            elif "TELA pendiente" in criterio:
+                df_filtrado = df[filas_tela_pendiente(df)]
+            elif valor_busqueda:
+                # Índice de trigramas (ignora tildes y mayúsculas), mantenido entre reruns
+                df_filtrado = df.iloc[buscar(df, criterio, valor_busqueda)]
         
-        def color_rows(row):
-            if row['Saldo Pendiente (Distribuido)'] > 0:
-                return ['background-color: rgba(255, 0, 0, 0.2)'] * len(row)
-            elif row['Entrega Tela'] == 'No' and row['Pantalones'] > 0:
-                return ['background-color: rgba(255, 0, 0, 0.2)'] * len(row)
-            return ['background-color: rgba(0, 128, 0, 0.2)'] * len(row)
-
         format_dict = {
             "Tela Sugerida (mts)": "{:.2f}",
             "Metros Tela (mts)": "{:.2f}",
@@ -610,24 +632,90 @@ elif menu == "Buscar / Editar Ventas":
             "Saldo Pendiente (Distribuido)": "${:,.0f}"
         }
         
-        st.dataframe(df_filtrado.style.format(format_dict, na_rep="-").apply(color_rows, axis=1))
+        # --- RESULTADOS PAGINADOS ---
+        # Se ordena y pagina en el servidor; solo la página visible se estiliza y se envía.
+        col_pag1, col_pag2, col_pag3, col_pag4 = st.columns(4)
+        with col_pag1:
+            tam_pagina = st.selectbox("Filas por página", [25, 50, 100, 250], index=1)
+        with col_pag2:
+            col_orden = st.selectbox("Ordenar por", ["(Orden de registro)"] + df_filtrado.columns.tolist())
+        with col_pag3:
+            descendente = st.checkbox("Descendente", value=False)
+        total_paginas = max(1, -(-len(df_filtrado) // tam_pagina))
+        if st.session_state.get('pagina_resultados', 1) > total_paginas:
+            st.session_state.pagina_resultados = total_paginas  # el filtro redujo el número de páginas
+        with col_pag4:
+            pagina = st.number_input(f"Página (de {total_paginas})", min_value=1, max_value=total_paginas, step=1, key="pagina_resultados")
+
+        if col_orden == "(Orden de registro)":
+            orden = np.arange(len(df_filtrado))
+            if descendente:
+                orden = orden[::-1]
+        else:
+            valores_orden = df_filtrado[col_orden].reset_index(drop=True)
+            try:
+                orden = valores_orden.sort_values(ascending=not descendente, kind='stable', na_position='last').index.to_numpy()
+            except TypeError:
+                orden = valores_orden.astype(str).sort_values(ascending=not descendente, kind='stable').index.to_numpy()
+
+        inicio = (pagina - 1) * tam_pagina
+        df_pagina = df_filtrado.iloc[orden[inicio:inicio + tam_pagina]]
+        pendientes_pagina = filas_pendientes(df_pagina)
+
+        def color_rows(pagina_df):
+            # Rojo: saldo o tela pendiente. Verde: al día. Calculado por columnas, no fila a fila.
+            colores = np.where(pendientes_pagina, 'background-color: rgba(255, 0, 0, 0.2)', 'background-color: rgba(0, 128, 0, 0.2)')
+            return pd.DataFrame(np.repeat(colores[:, None], pagina_df.shape[1], axis=1),
+                                index=pagina_df.index, columns=pagina_df.columns)
+
+        with span('render_tabla', len(df_pagina)):
+            st.dataframe(df_pagina.style.format(format_dict, na_rep="-").apply(color_rows, axis=None))
+        st.caption(f"Mostrando {len(df_pagina)} de {len(df_filtrado)} registros.")
+
+        # --- PAGOS EN LOTE ---
+        with st.expander("📥 Registrar pagos en lote (p.ej. transferencias del día)"):
+            st.caption("Un renglón por pago: ID de venta y valor. Se aplican todos en cascada con una sola escritura.")
+            pagos_lote = st.data_editor(
+                pd.DataFrame({'ID': pd.Series(dtype=str), 'Valor': pd.Series(dtype='int64')}),
+                num_rows="dynamic", key="pagos_lote"
+            )
+            if st.button("Registrar pagos en lote"):
+                pagos_lote = pagos_lote.dropna()
+                pagos_lote = pagos_lote[pagos_lote['Valor'] > 0]
+                if pagos_lote.empty:
+                    st.error("No hay pagos válidos para registrar.")
+                else:
+                    ahora_bq = datetime.now(timezone_co)
+                    pagos_lote['Fecha'] = ahora_bq.strftime("%Y-%m-%d %H:%M")
+                    encolar_escritura('pagos', pagos_lote.to_dict('records'), f"{len(pagos_lote)} pagos en lote registrados")
+                    st.rerun()
 
         st.markdown("---")
         st.subheader("Gestión Post-Venta (Individual)")
         
-        lista_clientes = df['Cliente'].unique().tolist()
+        # Cliente -> IDs e ID -> filas salen de los índices mantenidos con la caché, sin recorrer df.
+        indices = obtener_indices(df)
+        lista_clientes = indices.clientes()
         col_sel1, col_sel2 = st.columns(2)
         cliente_sel = col_sel1.selectbox("Seleccione Cliente:", options=[""] + lista_clientes)
         
         if cliente_sel:
-            ids_disponibles = df[df['Cliente'] == cliente_sel]['ID'].unique().tolist()
+            ids_disponibles = indices.ids_cliente(cliente_sel)
         else:
-            ids_disponibles = df['ID'].unique().tolist()
+            ids_disponibles = indices.ids()
             
         id_editar = col_sel2.selectbox("Seleccione ID Venta:", options=[""] + ids_disponibles)
         
-        if id_editar:
-            filas_venta = df[df['ID'] == id_editar]
+        if id_editar and indices_activos is not None and id_editar not in indices_activos:
+            st.info(f"🗄️ Venta {id_editar} archivada (liquidada): solo lectura.")
+            st.dataframe(indices.filas(id_editar).style.format(format_dict, na_rep="-"))
+            mostrar_movimientos(id_editar)
+        elif id_editar:
+            filas_editar = indices.filas(id_editar)
+            version_actual = version_venta(id_editar)
+            version_vista = st.session_state.versiones_vistas.get(id_editar, version_actual)
+            st.session_state.versiones_vistas[id_editar] = version_actual
+            mostrar_movimientos(id_editar)
             
             # --- SECCIÓN DE EDICIÓN ---
             st.markdown("#### 🛠️ Modificar Venta")
@@ -636,71 +724,26 @@ elif menu == "Buscar / Editar Ventas":
             cols_edit = ['Nombre Alumno', 'Camisas', 'Talla Camisa', 'Pantalones', 
                          'Largo Pant (cm)', 'Medidas Cin (cm)', 'Medidas Cad (cm)', 'Medidas Pier (cm)']
             
-            edited_df = st.data_editor(filas_venta[cols_edit], num_rows="fixed")
+            edited_df = st.data_editor(filas_editar[cols_edit], num_rows="fixed")
             
             if st.button("💾 Guardar Cambios en Registros"):
-                indices_editados = filas_venta.index
-                
-                for idx in indices_editados:
-                    row_data = edited_df.loc[idx]
-                    
-                    talla = row_data['Talla Camisa']
-                    qty_cam = row_data['Camisas']
-                    qty_pant = row_data['Pantalones']
-                    
-                    tipo_detalle = df.at[idx, 'Tipo Detalle']
-                    if "Niña" in str(tipo_detalle):
-                         precio_c = precios_camisas_nina.get(str(talla), 30000)
-                    else:
-                         precio_c = precios_camisas_nino.get(str(talla), 30000)
-                    
-                    nuevo_subtotal = (qty_cam * precio_c) + (qty_pant * costo_pantalon)
-                    
-                    largo_cm = row_data['Largo Pant (cm)']
-                    consumo_tela = 0.0
-                    if qty_pant > 0:
-                        consumo_tela = ((largo_cm / 100.0) + 0.20) * qty_pant
-                    
-                    df.at[idx, 'Nombre Alumno'] = row_data['Nombre Alumno']
-                    df.at[idx, 'Camisas'] = qty_cam
-                    df.at[idx, 'Talla Camisa'] = talla
-                    df.at[idx, 'Pantalones'] = qty_pant
-                    df.at[idx, 'Largo Pant (cm)'] = largo_cm
-                    df.at[idx, 'Medidas Cin (cm)'] = row_data['Medidas Cin (cm)']
-                    df.at[idx, 'Medidas Cad (cm)'] = row_data['Medidas Cad (cm)']
-                    df.at[idx, 'Medidas Pier (cm)'] = row_data['Medidas Pier (cm)']
-                    
-                    df.at[idx, 'Subtotal niño(a)'] = nuevo_subtotal
-                    df.at[idx, 'Tela Sugerida (mts)'] = round(consumo_tela, 2)
-                    
-                    pagado_actual = df.at[idx, 'Pagado (Distribuido)']
-                    nuevo_saldo = nuevo_subtotal - pagado_actual
-                    if nuevo_saldo < 0: nuevo_saldo = 0 
-                    df.at[idx, 'Saldo Pendiente (Distribuido)'] = int(nuevo_saldo)
-                    
-                    # Actualizar "No Aplica" si pantalones bajaron a 0 O si es Niña (reafirmar lógica)
-                    if "Niña" in str(tipo_detalle):
-                         df.at[idx, 'Entrega Tela'] = "No Aplica"
-                    elif qty_pant == 0:
-                        df.at[idx, 'Entrega Tela'] = "No Aplica"
-                    else:
-                         current_val = df.at[idx, 'Entrega Tela']
-                         if current_val == "No Aplica":
-                             df.at[idx, 'Entrega Tela'] = "No" 
-
-                actualizar_db(df)
-                st.success("Registros actualizados y recalculados.")
-                time.sleep(1.5)
+                # Recalcula todas las filas editadas de una vez (precio, tela, saldo y estado de tela)
+                lineas = filas_editar.copy()
+                lineas[cols_edit] = edited_df[cols_edit]
+                # Con la lista con que se vendió, no la vigente (para eso está 'Aplicar precios a ventas existentes').
+                lineas = recalcular_lineas(lineas, config_de_filas(lineas))
+
+                # Si otra sesión modificó la venta se rechaza y se avisa en el siguiente rerun.
+                encolar_edicion(lineas, {id_editar: version_vista}, f"Venta {id_editar}: registros actualizados y recalculados")
                 st.rerun()
 
             st.markdown("---")
             
             # --- SECCIÓN PAGOS Y TELA ---
-            filas_venta_actual = df[df['ID'] == id_editar]
-            total_venta_real = filas_venta_actual['Subtotal niño(a)'].sum()
-            pagado_real = filas_venta_actual['Pagado (Distribuido)'].sum()
-            saldo_real = filas_venta_actual['Saldo Pendiente (Distribuido)'].sum()
-            metros_entregados_real = filas_venta_actual['Metros Tela (mts)'].sum()
+            total_venta_real = filas_editar['Subtotal niño(a)'].sum()
+            pagado_real = filas_editar['Pagado (Distribuido)'].sum()
+            saldo_real = filas_editar['Saldo Pendiente (Distribuido)'].sum()
+            metros_entregados_real = filas_editar['Metros Tela (mts)'].sum()
 
             st.info(f"Resumen Financiero: Total: ${total_venta_real:,.0f} | Pagado: ${pagado_real:,.0f} | **Saldo Pendiente: ${saldo_real:,.0f}**")
 
@@ -719,42 +762,18 @@ elif menu == "Buscar / Editar Ventas":
                             ahora_bq = datetime.now(timezone_co)
                             fecha_ahora = ahora_bq.strftime("%Y-%m-%d %H:%M")
                             
-                            abono_restante = abono_extra
-                            indices = df[df['ID'] == id_editar].index
-                            
-                            for idx in indices:
-                                if abono_restante <= 0: break
-                                saldo_fila = df.at[idx, 'Saldo Pendiente (Distribuido)']
-                                if saldo_fila > 0:
-                                    monto_a_cubrir = min(saldo_fila, abono_restante)
-                                    df.at[idx, 'Pagado (Distribuido)'] += monto_a_cubrir
-                                    df.at[idx, 'Saldo Pendiente (Distribuido)'] -= monto_a_cubrir
-                                    abono_restante -= monto_a_cubrir
-                                    if df.at[idx, 'Pagado (Distribuido)'] == monto_a_cubrir:
-                                         df.at[idx, 'Fecha Abono'] = fecha_ahora
-                            
-                            nuevo_saldo_total = df.loc[df['ID'] == id_editar, 'Saldo Pendiente (Distribuido)'].sum()
-                            estado_nuevo = "Pago Total" if nuevo_saldo_total <= 0 else "Abono"
-                            df.loc[df['ID'] == id_editar, 'Estado Pago'] = estado_nuevo
-                            if estado_nuevo == "Pago Total":
-                                df.loc[df['ID'] == id_editar, 'Fecha Total Pago'] = fecha_ahora
-                                
-                            actualizar_db(df)
-                            st.success("Pago registrado.")
-                            time.sleep(1.5); st.rerun()
+                            # Un abono se suma sobre los datos más recientes (reintenta si otro cajero escribió)
+                            pago = [{'ID': id_editar, 'Valor': abono_extra, 'Fecha': fecha_ahora}]
+                            encolar_escritura('pagos', pago, f"Pago de ${abono_extra:,.0f} registrado.")
+                            st.rerun()
                 else:
                     st.success("PAZ Y SALVO")
 
             with col_post2:
                 st.markdown("#### 🧵 Gestión de Tela")
                 
-                req_total = 0
-                for index, row in filas_venta_actual.iterrows():
-                    if row['Pantalones'] > 0:
-                        largo_cm = row.get('Largo Pant (cm)', 0)
-                        qty = row.get('Pantalones', 0)
-                        consumo = ((largo_cm / 100.0) + 0.20) * qty
-                        req_total += consumo
+                consumo_filas = calcular_tela(filas_editar['Largo Pant (cm)'], filas_editar['Pantalones'])
+                req_total = consumo_filas.sum()
                 
                 req_sugerido = redondear_tela(req_total)
                 pendiente_tela = req_sugerido - metros_entregados_real
@@ -770,12 +789,9 @@ elif menu == "Buscar / Editar Ventas":
                 
                 # LISTADO DETALLADO POR NIÑO
                 st.markdown("**Detalle por Niño:**")
-                for index, row in filas_venta_actual.iterrows():
-                    if row['Pantalones'] > 0:
-                        largo_cm = row.get('Largo Pant (cm)', 0)
-                        qty = row.get('Pantalones', 0)
-                        consumo = ((largo_cm / 100.0) + 0.20) * qty
-                        st.write(f"• {row['Tipo Detalle']} | {row['Nombre Alumno']}: **{consumo:.2f} mts**")
+                for tipo, nombre, consumo in zip(filas_editar['Tipo Detalle'], filas_editar['Nombre Alumno'], consumo_filas):
+                    if consumo > 0:
+                        st.write(f"• {tipo} | {nombre}: **{consumo:.2f} mts**")
 
                 st.markdown("---")
                 nuevos_metros = st.number_input("Adicionar tela entregada (mts):", min_value=0.0, step=0.1, format="%.2f")
@@ -785,49 +801,9 @@ elif menu == "Buscar / Editar Ventas":
                         ahora_bq = datetime.now(timezone_co)
                         fecha_ahora = ahora_bq.strftime("%Y-%m-%d %H:%M")
                         
-                        metros_por_asignar = nuevos_metros
-                        indices_pant = df[(df['ID'] == id_editar) & (df['Pantalones'] > 0)].index
-                        
-                        actualizado_algo = False
-                        
-                        for idx in indices_pant:
-                            if metros_por_asignar <= 0:
-                                break
-                                
-                            largo_fila_cm = df.at[idx, 'Largo Pant (cm)']
-                            qty_fila = df.at[idx, 'Pantalones']
-                            consumo_fila_calc = ((largo_fila_cm / 100.0) + 0.20) * qty_fila
-                            consumo_fila_aprox = redondear_tela(consumo_fila_calc) 
-                            
-                            tiene_asignado = df.at[idx, 'Metros Tela (mts)']
-                            falta_fila = consumo_fila_aprox - tiene_asignado
-                            
-                            if falta_fila > 0:
-                                aporte = min(falta_fila, metros_por_asignar)
-                                df.at[idx, 'Metros Tela (mts)'] += aporte
-                                metros_por_asignar -= aporte
-                                actualizado_algo = True
-                                
-                                log_prev = str(df.at[idx, 'Fecha Entrega Nueva Tela'])
-                                if log_prev == "nan": log_prev = ""
-                                nuevo_log = f"{log_prev} | {fecha_ahora} (+{aporte:.2f}mts)".strip(" | ")
-                                df.at[idx, 'Fecha Entrega Nueva Tela'] = nuevo_log
-
-                        if metros_por_asignar > 0 and len(indices_pant) > 0:
-                             idx_sobrante = indices_pant[0]
-                             df.at[idx_sobrante, 'Metros Tela (mts)'] += metros_por_asignar
-                             actualizado_algo = True
-                             
-                             log_prev = str(df.at[idx_sobrante, 'Fecha Entrega Nueva Tela'])
-                             if log_prev == "nan": log_prev = ""
-                             nuevo_log = f"{log_prev} | {fecha_ahora} (+{metros_por_asignar:.2f}mts)".strip(" | ")
-                             df.at[idx_sobrante, 'Fecha Entrega Nueva Tela'] = nuevo_log
-
-                        if actualizado_algo:
-                            df.loc[df['ID'] == id_editar, 'Entrega Tela'] = "Si"
-                            actualizar_db(df)
-                            st.success("Tela distribuida correctamente.")
-                            time.sleep(1.5); st.rerun()
+                        entrega = [{'ID': id_editar, 'Metros': nuevos_metros, 'Fecha': fecha_ahora}]
+                        encolar_escritura('telas', entrega, "Tela distribuida correctamente.")
+                        st.rerun()
 
             # --- SECCIÓN DE ELIMINACIÓN AL FINAL ---
             st.markdown("---")
@@ -842,18 +818,64 @@ elif menu == "Buscar / Editar Ventas":
                 col_conf_si, col_conf_no = st.columns(2)
                 
                 if col_conf_si.button("SÍ, Eliminar definitivamente"):
-                    try:
-                        df = df[df['ID'] != id_editar]
-                        actualizar_db(df)
-                        st.session_state.confirmar_eliminar = False
-                        st.success("Venta eliminada correctamente.")
-                        time.sleep(1.5)
-                        st.rerun()
-                    except Exception as e:
-                        st.error(f"Error al eliminar: {e}")
+                    encolar_escritura('eliminar', {'id': id_editar, 'version': version_vista},
+                                      f"Venta {id_editar} eliminada correctamente.")
+                    st.session_state.confirmar_eliminar = False
+                    st.rerun()
                 
                 if col_conf_no.button("NO, Cancelar"):
                     st.session_state.confirmar_eliminar = False
                     st.rerun()
     else:
-        st.warning("No hay registros.")
\ No newline at end of file
+        st.warning("No hay registros.")
+
+# ==========================================
+# SECCIÓN 3: PRODUCCIÓN (LISTA DE CORTE)
+# ==========================================
+elif menu == "Producción (Lista de Corte)":
+    # Solo ventas abiertas (con saldo o tela pendiente); ver agregados.ListaCorte.
+    corte = obtener_lista_corte(cargar_datos())
+    st.header("✂️ Lista de Corte")
+
+    col_colegio, _ = st.columns([1, 3])
+    with col_colegio:
+        colegio_corte = st.selectbox("Colegio:", ["Todos"] + corte.colegios(), key="colegio_corte")
+    colegio_corte = None if colegio_corte == "Todos" else colegio_corte
+
+    col_c1, col_c2 = st.columns(2)
+    with col_c1:
+        st.subheader("Camisas por Talla")
+        st.dataframe(corte.camisas(colegio_corte), hide_index=True)
+    with col_c2:
+        st.subheader("Pantalones por Medida")
+        st.dataframe(corte.pantalones(colegio_corte), hide_index=True)
+        st.caption(f"Rangos de {PASO_MEDIDA} cm de largo y de cintura.")
+
+    tela_corte = corte.tela(colegio_corte)
+    st.subheader("Tela")
+    col_t1, col_t2, col_t3 = st.columns(3)
+    with col_t1:
+        st.markdown(f"<div class='metric-card'><div class='metric-title'>Tela Sugerida</div><div class='metric-value'>{tela_corte['sugerida']:,.2f} m</div></div>", unsafe_allow_html=True)
+    with col_t2:
+        st.markdown(f"<div class='metric-card'><div class='metric-title'>Tela Entregada</div><div class='metric-value'>{tela_corte['entregada']:,.2f} m</div></div>", unsafe_allow_html=True)
+    with col_t3:
+        color_tela = "#d9534f" if tela_corte['pendiente'] > 0 else "#5cb85c"
+        st.markdown(f"<div class='metric-card'><div class='metric-title'>Tela por Entregar</div><div class='metric-value' style='color:{color_tela}'>{tela_corte['pendiente']:,.2f} m</div></div>", unsafe_allow_html=True)
+
+    st.download_button(
+        label="Descargar Lista de Corte",
+        data=lambda: descargar_lista_corte(colegio_corte),
+        file_name=f"Lista_Corte_{datetime.now(timezone_co).strftime('%Y-%m-%d')}.xlsx",
+        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        on_click="ignore"
+    )
+
+# --- PANEL DE TIEMPOS (DEBUG) ---
+rerun_actual = cerrar_rerun(st.session_state.id_sesion)
+if st.sidebar.checkbox("⏱️ Panel de tiempos (debug)", key="panel_tiempos") and rerun_actual:
+    with st.sidebar.expander("Tiempos", expanded=True):
+        st.caption(f"Este rerun: {rerun_actual['total_ms']:,.0f} ms")
+        st.dataframe(pd.DataFrame(rerun_actual['spans']).reindex(columns=['span', 'padre', 'ms', 'filas', 'bytes', 'fuente']),
+                     hide_index=True)
+        st.caption("p50 / p95 por span (últimas mediciones del servidor)")
+        st.dataframe(resumen_ventana(), hide_index=True)
\ No newline at end of file
@@ -0,0 +1,405 @@
+"""Benchmark sin interfaz de las rutas críticas de la app, con ventas sintéticas.
+
+Uso:
+    python benchmark.py                               # 1k, 10k, 100k y 1M filas
+    python benchmark.py --filas 1000 10000 --repeticiones 10 --salida bench.json
+    python benchmark.py --filas 10000 --comparar bench_anterior.json
+
+Cada tamaño corre en un directorio temporal propio (SQLite, espejo Feather),
+así que la base real no se toca. El resultado es un JSON con percentiles de
+latencia (ms) y el pico de memoria (tracemalloc) de cada operación; con
+--comparar se marca como regresión toda operación cuyo p50 empeore más que
+--umbral respecto al archivo anterior (código de salida 1).
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+import agregados
+import almacenamiento
+import busqueda
+import indices
+from almacenamiento import (
+    cargar_datos, guardar_venta, actualizar_db, reemplazar_db, invalidar_cache,
+    version_venta, actualizar_fusionando, nuevo_id_venta
+)
+from calculos import (
+    recalcular_lineas, asignar_cascada, estado_pago_ventas, redondear_tela_vec,
+    aplicar_pagos, aplicar_telas, filas_saldo_pendiente,
+    filas_tela_pendiente
+)
+
+FILAS_DEFECTO = [1_000, 10_000, 100_000, 1_000_000]
+
+# Misma forma que config_precios.json (valores iniciales de la app).
+CONFIG_SINTETICA = {
+    "precios_nino": {"4": 44000, "6": 44000, "8": 44000, "10": 44000, "12": 44000, "14": 44000,
+                     "16": 46000, "S": 46000, "M": 46000, "L": 48000, "XL": 48000},
+    "precios_nina": {"4": 38000, "6": 38000, "8": 38000, "10": 40000, "12": 40000, "14": 40000,
+                     "16": 40000, "S": 43000, "M": 43000, "L": 46000, "XL": 46000},
+    "precio_pantalon": 35000,
+}
+TALLAS = list(CONFIG_SINTETICA["precios_nino"])
+NOMBRES = ["María", "José", "Luis", "Ana", "Carlos", "Sofía", "Andrés", "Valentina", "Juan", "Camila",
+           "Jorge", "Daniela", "Pedro", "Isabella", "Miguel", "Lucía", "Óscar", "Paula", "Héctor", "Mariana"]
+APELLIDOS = ["Gómez", "Rodríguez", "Martínez", "López", "García", "Pérez", "Sánchez", "Ramírez", "Torres",
+             "Díaz", "Muñoz", "Rojas", "Vargas", "Jiménez", "Castro", "Ortiz", "Peña", "Moreno", "Suárez", "Núñez"]
+COLEGIOS = ["NCP", "San José", "La Salle", "Santa María", "Liceo Central", "El Rosario",
+            "Los Andes", "Nueva Granada", "San Bartolomé", "Gimnasio del Norte"]
+MEDIOS_PAGO = ["Efectivo", "Transferencia"]
+
+
+# --- DATOS SINTÉTICOS ---
+def generar_ventas(n_filas, semilla=0):
+    """DataFrame con n_filas líneas de venta realistas (varios niños/niñas por ID, pagos y tela)."""
+    rng = np.random.default_rng(semilla)
+    hijos = rng.choice([1, 2, 3, 4], size=n_filas, p=[0.45, 0.33, 0.15, 0.07])
+    hijos = hijos[:np.searchsorted(np.cumsum(hijos), n_filas) + 1]
+    venta = np.repeat(np.arange(len(hijos)), hijos)[:n_filas]
+    n_ventas = int(venta[-1]) + 1
+
+    # Fecha y consecutivo del día (IDs AAAAMMDD-NNNN en orden de registro)
+    dias = rng.integers(0, 365, n_ventas)
+    segundos = rng.integers(7 * 3600, 19 * 3600, n_ventas)
+    orden = np.lexsort((segundos, dias))
+    dias, segundos = dias[orden], segundos[orden]
+    fechas = pd.Timestamp("2025-01-01") + pd.to_timedelta(dias, unit="D") + pd.to_timedelta(segundos, unit="s")
+    numero = np.arange(n_ventas) - np.searchsorted(dias, dias) + 1
+    ids = (fechas.strftime("%Y%m%d") + "-" + pd.Index(numero.astype(str)).str.zfill(almacenamiento.DIGITOS_SECUENCIA))
+    fecha_venta = fechas.strftime("%Y-%m-%d %H:%M")
+
+    # Clientes que vuelven a comprar; nombres con tildes para ejercitar la búsqueda
+    n_clientes = max(int(n_ventas * 0.8), 1)
+    cliente = rng.integers(0, n_clientes, n_ventas)
+    nombres = np.array(NOMBRES, dtype=object)
+    apellidos = np.array(APELLIDOS, dtype=object)
+    k = len(NOMBRES)
+    nombre_cliente = (nombres[cliente % k] + " " + apellidos[(cliente // k) % k] + " "
+                      + apellidos[(cliente // (k * k)) % k] + " " + (cliente // (k ** 3)).astype(str))
+    celular = (3_000_000_000 + (cliente.astype(np.int64) * 7919) % 999_999_999).astype(str)
+    celular_adicional = np.where(rng.random(n_ventas) < 0.3,
+                                 (3_100_000_000 + cliente.astype(np.int64) * 104729 % 899_999_999).astype(str), "")
+    colegio = np.array(COLEGIOS, dtype=object)[cliente % len(COLEGIOS)]
+
+    nina = rng.random(n_filas) < 0.5
+    sexo = np.where(nina, "Niña", "Niño")
+    numero_hijo = pd.DataFrame({'v': venta, 's': sexo}).groupby(['v', 's']).cumcount().to_numpy() + 1
+    pantalones = np.where(nina, 0, rng.integers(0, 3, n_filas))
+    largo = np.where(pantalones > 0, rng.integers(55, 105, n_filas), 0)
+
+    df = pd.DataFrame({
+        "ID": ids.to_numpy()[venta],
+        "Fecha Venta": fecha_venta.to_numpy()[venta],
+        "Cliente": nombre_cliente[venta],
+        "Celular Principal": celular[venta],
+        "Celular Adicional": celular_adicional[venta],
+        "Colegio": colegio[venta],
+        "Descripción": "",
+        "Tipo Detalle": pd.Series(sexo) + " " + pd.Series(numero_hijo).astype(str),
+        "Nombre Alumno": nombres[rng.integers(0, k, n_filas)] + " " + nombre_cliente[venta].astype(str),
+        "Camisas": rng.integers(1, 4, n_filas),
+        "Talla Camisa": np.array(TALLAS, dtype=object)[rng.integers(0, len(TALLAS), n_filas)],
+        "Pantalones": pantalones,
+        "Largo Pant (cm)": largo.astype(float),
+        "Medidas Cin (cm)": np.where(pantalones > 0, rng.integers(50, 80, n_filas), 0).astype(float),
+        "Medidas Cad (cm)": np.where(pantalones > 0, rng.integers(60, 95, n_filas), 0).astype(float),
+        "Medidas Pier (cm)": np.where(pantalones > 0, rng.integers(30, 55, n_filas), 0).astype(float),
+        "Pagado (Distribuido)": 0,
+        "Entrega Tela": "No",
+    })
+    df = recalcular_lineas(df, CONFIG_SINTETICA)
+
+    # Pagos: 20% sin abono, 40% abono parcial, 40% pago total
+    subtotal_venta = np.bincount(venta, weights=df['Subtotal niño(a)'].to_numpy(), minlength=n_ventas)
+    fraccion = rng.choice([0.0, 0.5, 1.0], size=n_ventas, p=[0.2, 0.4, 0.4])
+    abono = pd.Series(np.round(subtotal_venta * fraccion, -3))
+    pagado, _ = asignar_cascada(df['Subtotal niño(a)'].to_numpy(), abono, venta)
+    df['Pagado (Distribuido)'] = pagado.astype(np.int64)
+    df['Saldo Pendiente (Distribuido)'] = (df['Subtotal niño(a)'] - df['Pagado (Distribuido)']).astype(np.int64)
+    df['Estado Pago'] = estado_pago_ventas(venta, df['Pagado (Distribuido)'], df['Saldo Pendiente (Distribuido)']).to_numpy()
+    df['Medio Pago'] = np.where(pagado > 0, np.array(MEDIOS_PAGO, dtype=object)[rng.integers(0, 2, n_filas)], "")
+    df['Fecha Abono'] = np.where(pagado > 0, df['Fecha Venta'], "")
+    df['Fecha Total Pago'] = np.where(df['Estado Pago'] == "Pago Total", df['Fecha Venta'], "")
+
+    # Tela: la mitad de las ventas con pantalones ya la recibió, algunas en dos entregas
+    con_pantalon = df['Entrega Tela'] == "No"
+    entregada = con_pantalon.to_numpy() & (rng.random(n_ventas) < 0.5)[venta]
+    metros = redondear_tela_vec(df['Tela Sugerida (mts)'])
+    df['Metros Tela (mts)'] = np.where(entregada, metros, 0.0)
+    df['Entrega Tela'] = np.where(entregada, "Si", df['Entrega Tela'])
+    df['Fecha Entrega Tela'] = np.where(entregada, df['Fecha Venta'], "")
+    segunda = entregada & (rng.random(n_filas) < 0.2)
+    df['Fecha Entrega Nueva Tela'] = np.where(segunda, df['Fecha Venta'] + " (+0.50mts)", "")
+    df['Metros Tela (mts)'] += np.where(segunda, 0.5, 0.0)
+    return df[almacenamiento.COLUMNAS_VENTA]
+
+
+def _venta_nueva(rng, ahora):
+    """Filas de una venta de dos niños como las arma 'CERRAR VENTA Y GUARDAR'."""
+    id_venta = nuevo_id_venta(ahora)
+    fecha = ahora.strftime("%Y-%m-%d %H:%M")
+    lineas = pd.DataFrame({
+        "ID": id_venta, "Fecha Venta": fecha, "Cliente": "Cliente Benchmark",
+        "Celular Principal": "3000000000", "Celular Adicional": "", "Colegio": "NCP", "Descripción": "",
+        "Tipo Detalle": ["Niño 1", "Niña 1"], "Nombre Alumno": ["Alumno Uno", "Alumna Dos"],
+        "Camisas": rng.integers(1, 4, 2), "Talla Camisa": ["10", "12"], "Pantalones": [1, 0],
+        "Largo Pant (cm)": [80.0, 0.0], "Medidas Cin (cm)": [60.0, 0.0], "Medidas Cad (cm)": [70.0, 0.0],
+        "Medidas Pier (cm)": [40.0, 0.0], "Pagado (Distribuido)": 0, "Entrega Tela": "No",
+    })
+    lineas = recalcular_lineas(lineas, CONFIG_SINTETICA)
+    lineas['Estado Pago'] = "Pendiente"
+    return lineas.to_dict('records')
+
+
+# --- MEDICIÓN ---
+def medir(funcion, repeticiones, preparar=None):
+    """Latencias (ms) en percentiles y pico de memoria (MB) de funcion().
+
+    preparar() corre antes de cada repetición y no se cronometra. La memoria
+    se mide en una corrida extra bajo tracemalloc para no distorsionar los tiempos.
+    """
+    tiempos = []
+    for _ in range(repeticiones):
+        if preparar is not None:
+            preparar()
+        inicio = time.perf_counter()
+        funcion()
+        tiempos.append((time.perf_counter() - inicio) * 1000)
+    if preparar is not None:
+        preparar()
+    tracemalloc.start()
+    try:
+        funcion()
+        _, pico = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    tiempos = np.array(tiempos)
+    return {
+        'n': repeticiones,
+        'p50_ms': round(float(np.percentile(tiempos, 50)), 3),
+        'p95_ms': round(float(np.percentile(tiempos, 95)), 3),
+        'p99_ms': round(float(np.percentile(tiempos, 99)), 3),
+        'media_ms': round(float(tiempos.mean()), 3),
+        'min_ms': round(float(tiempos.min()), 3),
+        'max_ms': round(float(tiempos.max()), 3),
+        'pico_memoria_mb': round(pico / 2 ** 20, 3),
+    }
+
+
+def _rss_max_mb():
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (2 ** 20 if sys.platform == 'darwin' else 2 ** 10), 1)
+
+
+def _borrar_espejo():
+    invalidar_cache()
+    if os.path.exists(almacenamiento.ARCHIVO_ESPEJO):
+        os.remove(almacenamiento.ARCHIVO_ESPEJO)
+
+
+def _preparar_espejo():
+    """Espejo de la versión actual, como lo deja el escritor ocioso, y caché vacía."""
+    cargar_datos()
+    almacenamiento.actualizar_espejo()
+    invalidar_cache()
+
+
+def ejecutar(n_filas, repeticiones=20, backend='sqlite', semilla=0, aviso=print):
+    """Corre todas las operaciones sobre n_filas sintéticas; devuelve la lista de resultados."""
+    rng = np.random.default_rng(semilla + 1)
+    pocas = max(3, repeticiones // 4)  # operaciones en frío o que escriben todo
+    resultados = []
+
+    def registrar(operacion, funcion, veces=repeticiones, preparar=None):
+        resultado = medir(funcion, veces, preparar)
+        resultados.append({'filas': n_filas, 'operacion': operacion, **resultado})
+        aviso(f"  {operacion:<34} p50 {resultado['p50_ms']:>10.2f} ms   p95 {resultado['p95_ms']:>10.2f} ms"
+              f"   pico {resultado['pico_memoria_mb']:>8.1f} MB")
+
+    df_sintetico = generar_ventas(n_filas, semilla)
+    directorio_original = os.getcwd()
+    backend_original = almacenamiento.BACKEND
+    with tempfile.TemporaryDirectory(prefix='bench_ventas_') as directorio:
+        os.chdir(directorio)
+        almacenamiento.BACKEND = backend
+        almacenamiento._almacen = None
+        invalidar_cache()
+        try:
+            registrar('reemplazar_db', lambda: reemplazar_db(df_sintetico), veces=1)
+
+            # Lectura: sin caché ni espejo, desde el espejo Feather y desde la caché caliente
+            registrar('cargar_datos_frio', cargar_datos, veces=pocas, preparar=_borrar_espejo)
+            registrar('cargar_datos_espejo', cargar_datos, veces=pocas, preparar=_preparar_espejo)
+            registrar('cargar_datos_cache', cargar_datos)
+
+            ahora = datetime(2026, 1, 15, 10, 30)
+            registrar('guardar_venta', lambda: guardar_venta(_venta_nueva(rng, ahora)), preparar=cargar_datos)
+
+            df = cargar_datos()
+            ids = df['ID'].drop_duplicates().to_numpy()
+
+            def editar_venta():
+                id_venta = ids[rng.integers(len(ids))]
+                lineas = indices.obtener_indices(cargar_datos()).filas(id_venta).copy()
+                lineas['Camisas'] = rng.integers(1, 4, len(lineas))
+                actualizar_db(recalcular_lineas(lineas, CONFIG_SINTETICA), {id_venta: version_venta(id_venta)})
+            registrar('actualizar_db', editar_venta)
+
+            def registrar_pago():
+                id_venta = ids[rng.integers(len(ids))]
+                pago = [{'ID': id_venta, 'Valor': 10000, 'Fecha': "2026-01-15 10:30"}]
+                actualizar_fusionando([id_venta], lambda datos: aplicar_pagos(datos, pago))
+            registrar('registrar_pago', registrar_pago)
+
+            # Tablero Datos Post-Venta y búsquedas sobre la caché caliente
+            df = cargar_datos()
+            registrar('agregados_construir', lambda: agregados.obtener_agregados(df),
+                      veces=pocas, preparar=lambda: setattr(agregados, '_agregados', None))
+            registrar('agregados_resumen', lambda: agregados.resumen_post_venta(df))
+            registrar('agregados_resumen_talla', lambda: agregados.resumen_post_venta(df, "M"))
+            # Lista de corte (Producción): construir una vez, luego leer las tablas
+            registrar('lista_corte_construir', lambda: agregados.obtener_lista_corte(df),
+                      veces=pocas, preparar=lambda: setattr(agregados, '_lista_corte', None))
+
+            def lista_corte():
+                corte = agregados.obtener_lista_corte(df)
+                return corte.camisas(), corte.pantalones(), corte.tela()
+            registrar('lista_corte', lista_corte)
+            # Selectores de Gestión Post-Venta: Cliente -> IDs -> filas de la venta
+            registrar('indices_construir', lambda: indices.obtener_indices(df),
+                      veces=pocas, preparar=lambda: indices._indices.clear())
+            clientes = indices.obtener_indices(df).clientes()
+
+            def seleccionar_venta():
+                indice = indices.obtener_indices(df)
+                ids_cliente = indice.ids_cliente(clientes[rng.integers(len(clientes))])
+                return indice.filas(ids_cliente[0])
+            registrar('seleccionar_venta', seleccionar_venta)
+            registrar('seleccionar_venta_escaneo', lambda: df[df['ID'] == ids[rng.integers(len(ids))]])
+            registrar('busqueda_saldo_pendiente', lambda: df[filas_saldo_pendiente(df)])
+            registrar('busqueda_tela_pendiente', lambda: df[filas_tela_pendiente(df)])
+            for columna in busqueda.COLUMNAS_BUSQUEDA:
+                valores = df[columna].astype(str)
+                valores = valores[valores.str.len() >= 4].to_numpy()
+                if not len(valores):
+                    continue
+
+                def consulta():
+                    valor = valores[rng.integers(len(valores))]
+                    inicio = rng.integers(0, len(valor) - 3)
+                    return valor[inicio:inicio + 4]
+
+                nombre = columna.lower().replace(' ', '_')
+                registrar(f'busqueda_{nombre}_primera', lambda: df.iloc[busqueda.buscar(df, columna, consulta())],
+                          veces=pocas, preparar=lambda: setattr(busqueda, '_indice', None))
+                registrar(f'busqueda_{nombre}', lambda: df.iloc[busqueda.buscar(df, columna, consulta())])
+
+            # Cascadas (solo cálculo, sin escribir)
+            def movimientos(cantidad, columna, valor):
+                return [{'ID': i, columna: valor, 'Fecha': "2026-01-15 10:30"}
+                        for i in ids[rng.integers(0, len(ids), cantidad)]]
+            registrar('cascada_pago', lambda: aplicar_pagos(df, movimientos(1, 'Valor', 20000)))
+            registrar('cascada_pago_lote_100', lambda: aplicar_pagos(df, movimientos(100, 'Valor', 20000)))
+            registrar('cascada_tela', lambda: aplicar_telas(df, movimientos(1, 'Metros', 1.5)))
+            registrar('cascada_tela_lote_100', lambda: aplicar_telas(df, movimientos(100, 'Metros', 1.5)))
+        finally:
+            almacenamiento.BACKEND = backend_original
+            almacenamiento._almacen = None
+            invalidar_cache()
+            busqueda._indice = None
+            agregados._agregados = None
+            agregados._lista_corte = None
+            indices._indices.clear()
+            os.chdir(directorio_original)
+    return resultados
+
+
+def _commit_actual():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _version(modulo):
+    try:
+        return __import__(modulo).__version__
+    except ImportError:
+        return None
+
+
+def comparar(actual, anterior, umbral):
+    """Operaciones cuyo p50 empeoró más que umbral (1.2 = 20% más lento)."""
+    previos = {(r['filas'], r['operacion']): r for r in anterior['resultados']}
+    regresiones = []
+    for r in actual['resultados']:
+        previo = previos.get((r['filas'], r['operacion']))
+        if previo is None or previo['p50_ms'] <= 0:
+            continue
+        razon = r['p50_ms'] / previo['p50_ms']
+        marca = "  REGRESIÓN" if razon > umbral else ""
+        print(f"{r['filas']:>9} {r['operacion']:<34} {previo['p50_ms']:>10.2f} -> {r['p50_ms']:>10.2f} ms"
+              f"  x{razon:.2f}{marca}")
+        if marca:
+            regresiones.append(r)
+    return regresiones
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark de carga, guardado, búsqueda, tablero y cascadas.")
+    parser.add_argument('--filas', type=int, nargs='+', default=FILAS_DEFECTO)
+    parser.add_argument('--repeticiones', type=int, default=20)
+    parser.add_argument('--backend', choices=['sqlite', 'excel'], default='sqlite')
+    parser.add_argument('--semilla', type=int, default=0)
+    parser.add_argument('--salida', default=f"benchmark_{datetime.now():%Y%m%d_%H%M%S}.json")
+    parser.add_argument('--comparar', help="JSON de una corrida anterior")
+    parser.add_argument('--umbral', type=float, default=1.2)
+    args = parser.parse_args(argv)
+
+    informe = {
+        'fecha': datetime.now().isoformat(timespec='seconds'),
+        'commit': _commit_actual(),
+        'python': platform.python_version(),
+        'plataforma': platform.platform(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'pyarrow': _version('pyarrow'),
+        'backend': args.backend,
+        'repeticiones': args.repeticiones,
+        'semilla': args.semilla,
+        'resultados': [],
+    }
+    for n_filas in args.filas:
+        print(f"{n_filas:,} filas ({args.backend})")
+        informe['resultados'] += ejecutar(n_filas, args.repeticiones, args.backend, args.semilla)
+    informe['rss_max_mb'] = _rss_max_mb()
+
+    with open(args.salida, 'w', encoding='utf-8') as f:
+        json.dump(informe, f, ensure_ascii=False, indent=2)
+    print(f"Resultados en {args.salida}")
+
+    if args.comparar:
+        with open(args.comparar, encoding='utf-8') as f:
+            anterior = json.load(f)
+        if comparar(informe, anterior, args.umbral):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
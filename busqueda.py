@@ -0,0 +1,322 @@
+"""Índice de trigramas para las búsquedas de "Buscar / Editar Ventas".
+
+Cada columna buscable se indexa sobre sus valores distintos (normalizados sin
+tildes ni mayúsculas): muchos registros comparten el mismo Cliente o Colegio,
+así que el índice crece con los valores únicos y no con las filas. El índice
+se mantiene junto con la caché de almacenamiento: cuando guardar_venta anexa
+filas solo se indexan las nuevas, y un pago, una edición o un borrado solo
+recodifica o quita las filas de esa venta. Cada valor lleva la cuenta de sus
+filas; el que llega a cero sale del índice.
+"""
+import re
+import threading
+import unicodedata
+from array import array
+from itertools import chain
+
+import numpy as np
+import pandas as pd
+
+import almacenamiento
+from instrumentacion import medido
+
+COLUMNAS_BUSQUEDA = ['Cliente', 'Celular Principal', 'Celular Adicional', 'Colegio', 'Nombre Alumno']
+
+
+_CARGA_MASIVA = 1000  # a partir de cuántos valores nuevos se indexa en bloque con numpy
+# Valores sin filas que se toleran (y al menos esta fracción de los indexados) antes de
+# volver a indexar la columna desde cero.
+_MUERTOS_MINIMO = 1000
+_MUERTOS_FRACCION = 0.5
+
+try:
+    import pyarrow  # noqa: F401
+    _DTYPE_TEXTO = 'string[pyarrow]'
+except ImportError:
+    _DTYPE_TEXTO = object
+
+
+_MARCAS = re.compile('[\u0300-\u036f]')  # tildes y diéresis tras descomponer (NFKD)
+
+
+def normalizar(texto):
+    """Minúsculas y sin tildes: 'José Peña' -> 'jose pena'."""
+    if texto is None or (not isinstance(texto, str) and pd.isna(texto)):
+        return ""
+    texto = str(texto)
+    if not texto.isascii():
+        texto = _MARCAS.sub('', unicodedata.normalize('NFKD', texto))
+    return texto.casefold().strip()
+
+
+def normalizar_serie(serie):
+    """Versión vectorizada de normalizar para una Series de valores."""
+    textos = serie.astype(object).where(serie.notna(), "").astype(_DTYPE_TEXTO)
+    return (textos.str.normalize('NFKD').str.replace(_MARCAS.pattern, '', regex=True)
+            .str.casefold().str.strip())
+
+
+def _trigramas(texto):
+    return {texto[i:i + 3] for i in range(len(texto) - 2)}
+
+
+def _contiene(ordenado, valores):
+    """Máscara de valores presentes en el arreglo ordenado (búsqueda binaria)."""
+    pos = np.searchsorted(ordenado, valores)
+    pos[pos == len(ordenado)] = 0
+    return ordenado[pos] == valores
+
+
+class _IndiceColumna:
+    def __init__(self):
+        self.ids = {}              # texto normalizado -> id de valor
+        self.textos = []           # id de valor -> texto normalizado
+        self._base = None          # trigramas de la carga inicial (CSR)
+        self.gramas = {}           # trigrama -> np.ndarray de ids de valor (creciente)
+        self._gramas_nuevos = {}   # trigrama -> ids agregados aún sin consolidar
+        self.codigos = array('i')  # posición de fila -> id de valor
+        self._codigos_np = None
+        self._serie = None         # textos como Series para consultas cortas
+        self.conteos = np.zeros(0, dtype=np.int64)  # id de valor -> filas con ese valor
+        self.muertos = 0           # valores que se quedaron sin filas
+
+    def _codificar(self, valores):
+        """Id de valor de cada valor crudo; los textos nuevos se agregan al índice."""
+        # Normaliza cada valor crudo distinto una sola vez.
+        codigos, unicos = pd.factorize(pd.Series(valores, dtype=object), use_na_sentinel=False)
+        nuevos = []
+        ids_unicos = np.empty(len(unicos), dtype=np.int32)
+        if len(unicos) >= _CARGA_MASIVA:
+            normalizados = normalizar_serie(pd.Series(unicos, dtype=object)).tolist()
+        else:
+            normalizados = [normalizar(v) for v in unicos]
+        for k, texto in enumerate(normalizados):
+            id_valor = self.ids.get(texto)
+            if id_valor is None:
+                id_valor = self.ids[texto] = len(self.textos)
+                self.textos.append(texto)
+                nuevos.append(id_valor)
+            ids_unicos[k] = id_valor
+        if len(nuevos) >= _CARGA_MASIVA and self._base is None and not self.gramas:
+            self._indexar_bloque(nuevos)
+        else:
+            for id_valor in nuevos:
+                for grama in _trigramas(self.textos[id_valor]):
+                    self._gramas_nuevos.setdefault(grama, []).append(id_valor)
+        if nuevos:
+            self._serie = None
+            if len(self.conteos) < len(self.textos):
+                self.conteos = np.concatenate([self.conteos, np.zeros(len(self.textos) - len(self.conteos),
+                                                                      dtype=np.int64)])
+        ids_filas = ids_unicos[codigos]
+        np.add.at(self.conteos, ids_filas, 1)
+        return ids_filas
+
+    def _descontar(self, ids_filas):
+        np.subtract.at(self.conteos, ids_filas, 1)
+        unicos = np.unique(ids_filas)
+        for id_valor in unicos[self.conteos[unicos] == 0].tolist():
+            # Sigue en las listas de trigramas, pero sin filas nunca aparece en un resultado.
+            del self.ids[self.textos[id_valor]]
+            self.muertos += 1
+
+    def agregar(self, valores):
+        self.codigos.extend(self._codificar(valores).tolist())
+        self._codigos_np = None
+
+    def reemplazar(self, posiciones, valores):
+        """Valores nuevos de filas existentes (edición, pago, tela)."""
+        codigos = self._array_codigos()
+        nuevos = self._codificar(valores)
+        self._descontar(codigos[posiciones])
+        for posicion, id_valor in zip(posiciones.tolist(), nuevos.tolist()):
+            self.codigos[posicion] = id_valor
+        self._codigos_np = None
+
+    def quitar(self, posiciones):
+        """Filas borradas o archivadas: las siguientes corren su posición."""
+        codigos = self._array_codigos()
+        self._descontar(codigos[posiciones])
+        conservar = np.ones(len(codigos), dtype=bool)
+        conservar[posiciones] = False
+        self.codigos = array('i', codigos[conservar].tobytes())
+        self._codigos_np = None
+
+    def desgastado(self):
+        return self.muertos > max(_MUERTOS_MINIMO, _MUERTOS_FRACCION * len(self.textos))
+
+    def _indexar_bloque(self, nuevos):
+        """Carga inicial: listas de trigramas en formato CSR (un solo arreglo ordenado)."""
+        por_valor = [_trigramas(self.textos[i]) for i in nuevos]
+        gramas = list(chain.from_iterable(por_valor))
+        if not gramas:
+            return
+        codigos, unicos = pd.factorize(pd.Series(gramas, dtype=object))
+        conteos = np.fromiter(map(len, por_valor), dtype=np.int64, count=len(por_valor))
+        duenos = np.repeat(np.array(nuevos, dtype=np.int32), conteos)
+        orden = np.lexsort((duenos, codigos))
+        limites = np.searchsorted(codigos[orden], np.arange(len(unicos) + 1))
+        self._base = (dict(zip(unicos, range(len(unicos)))), limites, duenos[orden])
+
+    def _postings(self, grama):
+        ids = self.gramas.get(grama)
+        if ids is None and self._base is not None:
+            posiciones, limites, base = self._base
+            k = posiciones.get(grama)
+            if k is not None:
+                ids = base[limites[k]:limites[k + 1]]
+        pendientes = self._gramas_nuevos.pop(grama, None)
+        if pendientes is not None:
+            nuevos = np.array(pendientes, dtype=np.int32)
+            ids = nuevos if ids is None else np.concatenate([ids, nuevos])
+            self.gramas[grama] = ids
+        return ids
+
+    def _array_codigos(self):
+        if self._codigos_np is None:
+            self._codigos_np = np.array(self.codigos, dtype=np.int32)
+        return self._codigos_np
+
+    def _ids_consulta_corta(self, consulta):
+        # Menos de tres caracteres: barrido vectorizado sobre los valores distintos.
+        if self._serie is None:
+            self._serie = pd.Series(self.textos, dtype=_DTYPE_TEXTO)
+        return np.flatnonzero(self._serie.str.contains(consulta, regex=False).to_numpy(dtype=bool))
+
+    def _ids_consulta(self, consulta):
+        listas = []
+        for grama in _trigramas(consulta):
+            ids = self._postings(grama)
+            if ids is None:
+                return ()
+            listas.append(ids)
+        listas.sort(key=len)
+        candidatos = listas[0]
+        for ids in listas[1:]:
+            if len(candidatos) <= 64:
+                break
+            candidatos = candidatos[_contiene(ids, candidatos)]
+        textos = self.textos
+        if len(listas) == 1 and len(consulta) == 3:
+            return candidatos
+        return [i for i in candidatos.tolist() if consulta in textos[i]]
+
+    def buscar(self, consulta):
+        if len(consulta) < 3:
+            ids = self._ids_consulta_corta(consulta)
+        else:
+            ids = self._ids_consulta(consulta)
+        if not len(ids):
+            return np.empty(0, dtype=np.int64)
+        marcados = np.zeros(len(self.textos), dtype=bool)
+        marcados[ids] = True
+        return np.flatnonzero(marcados[self._array_codigos()])
+
+
+class IndiceTrigramas:
+    """Índice de subcadenas sobre COLUMNAS_BUSQUEDA; devuelve posiciones de fila (iloc).
+
+    Cada columna se indexa la primera vez que se busca en ella.
+    """
+
+    def __init__(self, df, columnas=COLUMNAS_BUSQUEDA):
+        self.columnas = [c for c in columnas if c in df.columns]
+        self._indices = {}
+        self.n_filas = len(df)
+        self.origen = df
+
+    def agregar(self, df_nuevas, df_origen):
+        """Indexa filas anexadas al final de df_origen (que pasa a ser el origen)."""
+        for columna, indice in self._indices.items():
+            indice.agregar(df_nuevas[columna].tolist())
+        self.n_filas += len(df_nuevas)
+        self.origen = df_origen
+
+    def actualizar(self, filas, df_origen):
+        """Recodifica las filas modificadas (mismas posiciones en df_origen)."""
+        posiciones = _posiciones(self.origen.index, filas.index)
+        for columna, indice in self._indices.items():
+            if columna in filas.columns:
+                indice.reemplazar(posiciones, filas[columna].tolist())
+        self._descartar_desgastados()
+        self.origen = df_origen
+
+    def quitar(self, filas, df_origen):
+        """Quita las filas borradas; df_origen conserva el orden de las demás."""
+        posiciones = _posiciones(self.origen.index, filas.index)
+        for indice in self._indices.values():
+            indice.quitar(posiciones)
+        self._descartar_desgastados()
+        self.n_filas -= len(filas)
+        self.origen = df_origen
+
+    def _descartar_desgastados(self):
+        # Con demasiados valores muertos la columna se vuelve a indexar la próxima vez que se busque.
+        for columna in [c for c, indice in self._indices.items() if indice.desgastado()]:
+            del self._indices[columna]
+
+    def _indice_columna(self, columna):
+        indice = self._indices.get(columna)
+        if indice is None:
+            indice = self._indices[columna] = _IndiceColumna()
+            indice.agregar(self.origen[columna].tolist())
+        return indice
+
+    def buscar(self, columna, consulta):
+        consulta = normalizar(consulta)
+        if columna not in self.columnas:
+            return np.empty(0, dtype=np.int64)
+        if not consulta:
+            return np.arange(self.n_filas)
+        return self._indice_columna(columna).buscar(consulta)
+
+
+def _posiciones(indice, llaves):
+    """Posiciones de las llaves; con llaves únicas y crecientes (SQLite) por búsqueda binaria."""
+    valores = indice.to_numpy()
+    if valores.dtype.kind in 'iu' and (np.diff(valores) > 0).all():
+        return np.searchsorted(valores, np.asarray(llaves))
+    posiciones = indice.get_indexer(llaves)  # llaves repetidas: InvalidIndexError
+    if (posiciones < 0).any():
+        raise KeyError("fila fuera del índice")
+    return posiciones
+
+
+_indice_lock = threading.RLock()
+_indice = None
+
+
+def _al_cambiar_datos(evento, df_anterior, df_nuevo, filas):
+    global _indice
+    with _indice_lock:
+        if evento == 'recargar' or _indice is None or _indice.origen is not df_anterior:
+            _indice = None
+            return
+        try:
+            if evento == 'insertar':
+                _indice.agregar(filas, df_nuevo)
+            elif evento == 'actualizar':
+                _indice.actualizar(filas, df_nuevo)
+            else:  # 'eliminar'
+                _indice.quitar(filas, df_nuevo)
+        except (KeyError, pd.errors.InvalidIndexError):
+            _indice = None
+
+
+almacenamiento.suscribir(_al_cambiar_datos)
+
+
+def obtener_indice(df):
+    """Índice del DataFrame compartido devuelto por cargar_datos (se construye una vez)."""
+    global _indice
+    with _indice_lock:
+        if _indice is None or _indice.origen is not df:
+            _indice = IndiceTrigramas(df)
+        return _indice
+
+
+@medido('buscar')
+def buscar(df, columna, consulta):
+    """Posiciones de fila de df cuyo valor en columna contiene consulta (sin tildes ni mayúsculas)."""
+    with _indice_lock:
+        return obtener_indice(df).buscar(columna, consulta)
@@ -0,0 +1,275 @@
+"""Cálculos de precios, tela y saldos sobre líneas de venta (una fila por niño/niña).
+
+Todas las funciones trabajan por columnas: sirven igual para una línea del
+carrito, para las filas editadas de una venta o para miles de filas a la vez.
+"""
+import math
+
+import numpy as np
+import pandas as pd
+
+from instrumentacion import medido
+
+PRECIO_CAMISA_DEFECTO = 30000  # talla sin precio en la configuración
+CONSUMO_EXTRA_TELA = 0.20      # metros adicionales por pantalón
+
+
+def redondear_tela(metros_reales):
+    return math.ceil(metros_reales * 10) / 10
+
+
+def redondear_tela_vec(metros_reales):
+    """redondear_tela por columnas (hacia arriba al decímetro)."""
+    return np.ceil(np.round(np.asarray(metros_reales, dtype=float) * 10, 6)) / 10
+
+
+def calcular_tela(largo_cm, pantalones):
+    """Consumo de tela ((largo/100) + 0.20) * cantidad, 0 si no hay pantalones."""
+    largo = pd.to_numeric(pd.Series(largo_cm), errors='coerce').fillna(0).to_numpy(dtype=float)
+    cantidad = pd.to_numeric(pd.Series(pantalones), errors='coerce').fillna(0).to_numpy(dtype=float)
+    return np.where(cantidad > 0, ((largo / 100.0) + CONSUMO_EXTRA_TELA) * cantidad, 0.0)
+
+
+def es_nina(tipo_detalle):
+    return pd.Series(tipo_detalle).astype(str).str.contains("Niña", regex=False).to_numpy()
+
+
+def precio_camisas(tallas, ninas, config, defecto=PRECIO_CAMISA_DEFECTO):
+    """Precio unitario de camisa por fila según talla y tabla niño/niña de config."""
+    tallas = pd.Series(tallas).astype(str)
+    precio_nino = tallas.map(config["precios_nino"]).fillna(defecto).to_numpy(dtype=float)
+    precio_nina = tallas.map(config["precios_nina"]).fillna(defecto).to_numpy(dtype=float)
+    return np.where(ninas, precio_nina, precio_nino)
+
+
+@medido('recalcular_lineas')
+def recalcular_lineas(lineas, config):
+    """Recalcula subtotal, tela sugerida, saldo y estado de entrega de tela con la lista config.
+
+    lineas necesita 'Tipo Detalle', 'Camisas', 'Talla Camisa', 'Pantalones' y
+    'Largo Pant (cm)'; si trae 'Pagado (Distribuido)' se recalcula el saldo y
+    si trae 'Entrega Tela' se ajusta el estado. 'Versión Precios' queda con
+    la versión de config. Devuelve una copia.
+    """
+    lineas = lineas.copy()
+    ninas = es_nina(lineas['Tipo Detalle'])
+    camisas = pd.to_numeric(lineas['Camisas'], errors='coerce').fillna(0).astype(int)
+    pantalones = pd.to_numeric(lineas['Pantalones'], errors='coerce').fillna(0).astype(int)
+    precio = precio_camisas(lineas['Talla Camisa'], ninas, config)
+
+    subtotal = camisas.to_numpy() * precio + pantalones.to_numpy() * float(config["precio_pantalon"])
+    lineas['Camisas'] = camisas
+    lineas['Pantalones'] = pantalones
+    lineas['Subtotal niño(a)'] = subtotal.astype(np.int64)
+    lineas['Tela Sugerida (mts)'] = np.round(calcular_tela(lineas['Largo Pant (cm)'], pantalones), 2)
+    lineas['Versión Precios'] = config.get("version", 0)
+
+    if 'Pagado (Distribuido)' in lineas.columns:
+        pagado = pd.to_numeric(lineas['Pagado (Distribuido)'], errors='coerce').fillna(0).to_numpy()
+        lineas['Saldo Pendiente (Distribuido)'] = np.clip(subtotal - pagado, 0, None).astype(np.int64)
+
+    if 'Entrega Tela' in lineas.columns:
+        # Niña o sin pantalones: "No Aplica"; si vuelve a tener pantalones pasa a "No".
+        actual = lineas['Entrega Tela'].astype(object).to_numpy()
+        no_aplica = ninas | (pantalones.to_numpy() == 0)
+        lineas['Entrega Tela'] = np.where(no_aplica, "No Aplica",
+                                          np.where(actual == "No Aplica", "No", actual))
+    return lineas
+
+
+def estado_pago_ventas(ids, pagado, saldo):
+    """Estado de pago de cada fila según los totales de su venta (ID)."""
+    totales = pd.DataFrame({'ID': ids, 'pagado': pagado, 'saldo': saldo}).groupby('ID', sort=False).transform('sum')
+    return pd.Series(np.where(totales['saldo'] <= 0, "Pago Total",
+                              np.where(totales['pagado'] > 0, "Abono", "Pendiente")), index=totales.index)
+
+
+@medido('repreciar_ventas')
+def repreciar_ventas(df, config, mascara=None):
+    """Aplica la lista de precios config a las filas seleccionadas (simulación).
+
+    Devuelve (filas_cambiadas, resumen): filas_cambiadas trae solo las columnas
+    de dinero que cambian, listo para actualizar_db en una sola escritura;
+    resumen es la diferencia por venta para mostrar antes de confirmar.
+    """
+    seleccion = df if mascara is None else df[mascara]
+    if seleccion.empty:
+        return seleccion.iloc[:0], pd.DataFrame()
+    nuevas = recalcular_lineas(seleccion, config)
+    subtotal_antes = pd.to_numeric(seleccion['Subtotal niño(a)'], errors='coerce').fillna(0)
+    saldo_antes = pd.to_numeric(seleccion['Saldo Pendiente (Distribuido)'], errors='coerce').fillna(0)
+    cambio = (nuevas['Subtotal niño(a)'] != subtotal_antes) | (nuevas['Saldo Pendiente (Distribuido)'] != saldo_antes)
+    ids_cambiados = seleccion.loc[cambio, 'ID'].unique()
+    afectadas = seleccion['ID'].isin(ids_cambiados)
+    nuevas = nuevas[afectadas]
+    nuevas['Estado Pago'] = estado_pago_ventas(nuevas['ID'], nuevas['Pagado (Distribuido)'],
+                                               nuevas['Saldo Pendiente (Distribuido)'])
+    columnas = ['Subtotal niño(a)', 'Saldo Pendiente (Distribuido)', 'Estado Pago', 'Versión Precios']
+
+    resumen = pd.DataFrame({
+        'ID': nuevas['ID'],
+        'Cliente': nuevas['Cliente'],
+        'Total Anterior': subtotal_antes[afectadas],
+        'Total Nuevo': nuevas['Subtotal niño(a)'],
+        'Saldo Anterior': saldo_antes[afectadas],
+        'Saldo Nuevo': nuevas['Saldo Pendiente (Distribuido)'],
+    }).groupby('ID', sort=False).agg({
+        'Cliente': 'first', 'Total Anterior': 'sum', 'Total Nuevo': 'sum',
+        'Saldo Anterior': 'sum', 'Saldo Nuevo': 'sum'
+    }).reset_index()
+    resumen['Diferencia'] = resumen['Total Nuevo'] - resumen['Total Anterior']
+    return nuevas[columnas], resumen
+
+
+# --- ASIGNACIÓN EN CASCADA ---
+def asignar_cascada(capacidades, montos, grupos=None):
+    """Reparte montos llenando las capacidades en orden (cascada) con sumas acumuladas.
+
+    Sin grupos, montos es un escalar que se reparte sobre todas las filas. Con
+    grupos (p.ej. el ID de venta de cada fila), montos es un dict/Series
+    grupo -> monto y cada grupo se reparte por separado, en el orden de las filas.
+    Devuelve (asignado por fila, sobrante por grupo o escalar).
+    """
+    capacidades = np.clip(np.nan_to_num(np.asarray(capacidades, dtype=float)), 0, None)
+    if grupos is None:
+        previo = np.cumsum(capacidades) - capacidades
+        asignado = np.clip(float(montos) - previo, 0, capacidades)
+        return asignado, max(float(montos) - capacidades.sum(), 0.0)
+
+    grupos = pd.Series(np.asarray(grupos))
+    previo = pd.Series(capacidades).groupby(grupos, sort=False).cumsum().to_numpy() - capacidades
+    monto_fila = grupos.map(pd.Series(montos)).fillna(0).to_numpy(dtype=float)
+    asignado = np.clip(monto_fila - previo, 0, capacidades)
+    capacidad_grupo = pd.Series(capacidades).groupby(grupos, sort=False).sum()
+    montos = pd.Series(montos, dtype=float)
+    sobrante = (montos - capacidad_grupo.reindex(montos.index).fillna(0)).clip(lower=0)
+    return asignado, sobrante
+
+
+def distribuir_pago_inicial(subtotales, valor_recibido):
+    """Pago de una venta nueva: cubre cada línea en orden; el excedente queda en la última."""
+    asignado, sobrante = asignar_cascada(subtotales, valor_recibido)
+    if len(asignado):
+        asignado[-1] += sobrante
+    return asignado.astype(np.int64)
+
+
+def _agrupar_movimientos(movimientos, columna_monto):
+    """Une movimientos del mismo ID (cascadas sucesivas = una cascada por la suma)."""
+    movimientos = pd.DataFrame(movimientos)
+    movimientos['ID'] = movimientos['ID'].astype(str)
+    return movimientos.groupby('ID', sort=False).agg({columna_monto: 'sum', 'Fecha': 'last'})
+
+
+@medido('cascada_pagos')
+def aplicar_pagos(df, pagos):
+    """Aplica uno o muchos abonos [{'ID', 'Valor', 'Fecha'}] en una sola pasada.
+
+    Devuelve (filas_actualizadas, sobrante por ID): las filas de las ventas
+    afectadas con pagado, saldo, fechas y estado recalculados.
+    """
+    pagos = _agrupar_movimientos(pagos, 'Valor')
+    filas = df[df['ID'].astype(str).isin(pagos.index)].copy()
+    ids = filas['ID'].astype(str)
+    saldo = pd.to_numeric(filas['Saldo Pendiente (Distribuido)'], errors='coerce').fillna(0)
+    pagado = pd.to_numeric(filas['Pagado (Distribuido)'], errors='coerce').fillna(0)
+    asignado, sobrante = asignar_cascada(saldo.to_numpy(), pagos['Valor'], ids.to_numpy())
+
+    fecha = ids.map(pagos['Fecha'])
+    primer_abono = (asignado > 0) & (pagado.to_numpy() == 0)
+    filas['Pagado (Distribuido)'] = (pagado + asignado).astype(np.int64)
+    filas['Saldo Pendiente (Distribuido)'] = (saldo - asignado).astype(np.int64)
+    filas['Fecha Abono'] = filas['Fecha Abono'].astype(object).where(~primer_abono, fecha)
+
+    saldo_venta = filas['Saldo Pendiente (Distribuido)'].groupby(ids, sort=False).transform('sum')
+    filas['Estado Pago'] = np.where(saldo_venta <= 0, "Pago Total", "Abono")
+    filas['Fecha Total Pago'] = filas['Fecha Total Pago'].astype(object).where(saldo_venta > 0, fecha)
+    return filas, sobrante
+
+
+@medido('cascada_telas')
+def aplicar_telas(df, entregas, acumular_fechas=False):
+    """Reparte una o muchas entregas de tela [{'ID', 'Metros', 'Fecha'}] en una sola pasada.
+
+    Cada pantalón recibe hasta su consumo redondeado; el excedente queda en la
+    primera fila con pantalones de la venta. Fecha Entrega Nueva Tela guarda
+    solo la última entrega (el historial completo está en el diario), o con
+    acumular_fechas todas, separadas por " | ", para un backend sin diario.
+    Devuelve las filas actualizadas.
+    """
+    entregas = _agrupar_movimientos(entregas, 'Metros')
+    pantalones = pd.to_numeric(df['Pantalones'], errors='coerce').fillna(0)
+    filas = df[df['ID'].astype(str).isin(entregas.index) & (pantalones > 0)].copy()
+    if filas.empty:
+        return filas
+    ids = filas['ID'].astype(str)
+    tiene = pd.to_numeric(filas['Metros Tela (mts)'], errors='coerce').fillna(0).to_numpy()
+    requerido = redondear_tela_vec(calcular_tela(filas['Largo Pant (cm)'], filas['Pantalones']))
+    asignado, sobrante = asignar_cascada(requerido - tiene, entregas['Metros'], ids.to_numpy())
+    primera = ~ids.duplicated().to_numpy()
+    asignado = asignado + np.where(primera, ids.map(sobrante).fillna(0).to_numpy(), 0)
+
+    filas['Metros Tela (mts)'] = tiene + asignado
+    recibe = asignado > 0
+    fechas = filas['Fecha Entrega Nueva Tela'].astype(object)
+    nuevas = [f"{fecha} (+{aporte:.2f}mts)" for fecha, aporte in zip(ids[recibe].map(entregas['Fecha']), asignado[recibe])]
+    if acumular_fechas:
+        nuevas = [f"{previa} | {nueva}" if isinstance(previa, str) and previa else nueva
+                  for previa, nueva in zip(fechas[recibe], nuevas)]
+    fechas[recibe] = nuevas
+    filas['Fecha Entrega Nueva Tela'] = fechas
+    filas['Entrega Tela'] = "Si"
+    return filas
+
+
+def filas_pendientes(df):
+    """True donde la fila tiene saldo pendiente o tela por entregar (pantalones sin tela)."""
+    saldo = pd.to_numeric(df['Saldo Pendiente (Distribuido)'], errors='coerce').fillna(0)
+    pantalones = pd.to_numeric(df['Pantalones'], errors='coerce').fillna(0)
+    return ((saldo > 0) | ((df['Entrega Tela'] == 'No') & (pantalones > 0))).to_numpy()
+
+
+def filas_saldo_pendiente(df):
+    """Filas de las ventas (ID completo) cuyo saldo total es mayor que cero."""
+    saldo_venta = df.groupby('ID')['Saldo Pendiente (Distribuido)'].sum()
+    return df['ID'].isin(saldo_venta[saldo_venta > 0].index).to_numpy()
+
+
+def filas_ventas_abiertas(df):
+    """Filas de las ventas (ID completo) con saldo o con tela en "No": lo que archivar_liquidadas no archiva."""
+    if df.empty:
+        return np.zeros(0, dtype=bool)
+    saldo = pd.to_numeric(df['Saldo Pendiente (Distribuido)'], errors='coerce').fillna(0)
+    sin_tela = pd.Series((df['Entrega Tela'] == 'No').to_numpy(dtype=bool), index=df.index)
+    por_venta = dict(by=df['ID'].to_numpy(dtype=object), dropna=False, sort=False)
+    abierta = (saldo.groupby(**por_venta).transform('sum') > 0) | sin_tela.groupby(**por_venta).transform('any')
+    return abierta.to_numpy(dtype=bool)
+
+
+def filas_tela_pendiente(df):
+    """Filas con pantalones cuya tela no se ha entregado."""
+    return ((df['Entrega Tela'] == 'No') & (df['Pantalones'].fillna(0) > 0)).to_numpy()
+
+
+# --- DATOS POST-VENTA ---
+def resumen_post_venta(df, talla=None):
+    """Totales del tablero de Datos Post-Venta, opcionalmente de una sola talla.
+
+    Recorre las filas: es la referencia con que las pruebas comparan
+    agregados.AgregadosPostVenta.resumen, que es lo que lee la app.
+    """
+    if talla is not None:
+        df = df[df['Talla Camisa'].astype(str) == talla]
+    tipo = df['Tipo Detalle'].astype(str)
+    sugerida = df['Tela Sugerida (mts)'].sum()
+    entregada = df['Metros Tela (mts)'].sum()
+    return {
+        'camisas_nino': df.loc[tipo.str.contains("Niño", na=False).to_numpy(), 'Camisas'].sum(),
+        'camisas_nina': df.loc[tipo.str.contains("Niña", na=False).to_numpy(), 'Camisas'].sum(),
+        'pantalones': df['Pantalones'].sum(),
+        'venta_total': df['Subtotal niño(a)'].sum(),
+        'pendiente': df['Saldo Pendiente (Distribuido)'].sum(),
+        'tela_sugerida': sugerida,
+        'tela_entregada': entregada,
+        'balance_tela': entregada - sugerida,
+    }
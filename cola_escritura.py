@@ -0,0 +1,346 @@
+"""Cola de escrituras en segundo plano.
+
+La interfaz encola cada escritura (venta nueva, edición, pago, tela,
+eliminación) y sigue sin esperar: la entrada queda guardada en la tabla
+`cola` de SQLite (con fsync) antes de devolver el Ticket, y un hilo escritor
+la aplica. El escritor junta las ráfagas: ventas nuevas consecutivas se
+insertan en una sola transacción y pagos o entregas de tela consecutivos se
+reparten en una sola cascada. Cada entrada sale de la cola en la misma
+transacción que la aplica, así que tras una caída se retoma sin aplicar
+nada dos veces.
+
+cargar_datos de este módulo muestra encima de la caché lo que la sesión
+encoló y el escritor todavía no aplicó (read-your-writes), sin esperar a la
+cola: a lo sumo espera al grupo que el escritor está aplicando en ese momento.
+
+Con la cola ociosa el mismo hilo hace el mantenimiento: reescribe el espejo
+Feather (PAUSA_ESPEJO después de la última escritura, no en cada una),
+recupera entradas huérfanas, pasa al archivo las ventas liquidadas y toma las
+instantáneas del diario de movimientos.
+"""
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import nullcontext
+
+import pandas as pd
+
+import almacenamiento
+import diario
+from almacenamiento import YaAplicada
+from calculos import aplicar_pagos, aplicar_telas
+from instrumentacion import span
+
+VENTANA_RAFAGA = 0.01         # segundos que el escritor espera para juntar una ráfaga
+ANTIGUEDAD_HUERFANAS = 30     # entradas de otro proceso más viejas que esto se recuperan
+INTERVALO_RECUPERACION = 60  # también el del archivado de ventas liquidadas
+PAUSA_ESPEJO = 1.0            # segundos sin escrituras antes de reescribir el espejo
+COMBINABLES = {'insertar', 'pagos', 'telas'}
+
+PROCESO = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def _json_valor(valor):
+    if valor is pd.NA or valor is pd.NaT:
+        return None
+    if hasattr(valor, 'item'):
+        return valor.item()
+    if hasattr(valor, 'isoformat'):
+        return valor.isoformat()
+    raise TypeError(f"No se puede encolar {type(valor).__name__}")
+
+
+class Ticket:
+    """Acuse de una escritura encolada: seq al quedar guardada, listo al aplicarse."""
+
+    def __init__(self, tipo, descripcion):
+        self.tipo = tipo
+        self.descripcion = descripcion
+        self.seq = None
+        self.error = None
+        self.aviso = None  # p.ej. parte de un pago que no se pudo asignar
+        self.datos = None
+        self._hecho = threading.Event()
+
+    @property
+    def listo(self):
+        return self._hecho.is_set()
+
+    def esperar(self, timeout=None):
+        return self._hecho.wait(timeout)
+
+    def _terminar(self, error=None, aviso=None):
+        self.error = error
+        self.aviso = aviso
+        self._hecho.set()
+
+
+class EscritorFondo:
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._cola = deque()   # (seq, tipo, datos, ticket) en orden de llegada
+        self._encoladas = 0
+        self._aplicadas = 0
+        self._hilo = None
+        self._detener = False
+        # Tomado mientras se aplica un grupo (escritura, parche de la caché y tickets listos).
+        self.aplicando = threading.Lock()
+
+    def _arrancar(self):
+        if self._hilo is None or not self._hilo.is_alive():
+            self._hilo = threading.Thread(target=self._ciclo, name='escritor-ventas', daemon=True)
+            self._hilo.start()
+
+    def encolar(self, tipo, datos, descripcion=""):
+        ticket = Ticket(tipo, descripcion)
+        texto = json.dumps(datos, default=_json_valor, ensure_ascii=False)
+        datos = ticket.datos = json.loads(texto)  # lo mismo que verá una recuperación tras una caída
+        almacen = almacenamiento.obtener_almacen()
+        if not hasattr(almacen, 'encolar'):
+            # Backend Excel: sin cola durable; se aplica en el acto.
+            self._aplicar_grupo(tipo, [(None, datos, ticket)])
+            return ticket
+        with self._cond:
+            ticket.seq = almacen.encolar(tipo, texto, PROCESO)
+            self._cola.append((ticket.seq, tipo, datos, ticket))
+            self._encoladas += 1
+            self._arrancar()
+            self._cond.notify()
+        return ticket
+
+    def esperar(self, timeout=None):
+        """Bloquea hasta que se aplique todo lo encolado hasta este momento."""
+        with self._cond:
+            self._arrancar()  # el hilo también hace el mantenimiento, aunque no haya nada encolado
+            objetivo = self._encoladas
+            if self._aplicadas >= objetivo:
+                return True
+            return self._cond.wait_for(lambda: self._aplicadas >= objetivo, timeout)
+
+    def detener(self, timeout=None):
+        """Termina el hilo cuando no quede nada encolado; un encolar posterior lo vuelve a arrancar."""
+        with self._cond:
+            hilo = self._hilo
+            if hilo is None:
+                return True
+            self._detener = True
+            self._cond.notify_all()
+        hilo.join(timeout)
+        return not hilo.is_alive()
+
+    def _ciclo(self):
+        self._mantener()
+        while True:
+            espejo = almacenamiento.espejo_pendiente()
+            with self._cond:
+                self._cond.wait_for(lambda: self._cola or self._detener,
+                                    PAUSA_ESPEJO if espejo else INTERVALO_RECUPERACION)
+                if self._detener and not self._cola:
+                    self._detener = False
+                    self._hilo = None  # bajo _cond: el próximo _arrancar crea otro
+                    return
+                hay = bool(self._cola)
+            if not hay:
+                if espejo:
+                    almacenamiento.actualizar_espejo()
+                else:
+                    self._mantener()
+                continue
+            time.sleep(VENTANA_RAFAGA)  # deja llegar el resto de la ráfaga
+            with self._cond:
+                lote = list(self._cola)
+                self._cola.clear()
+            try:
+                for tipo, grupo in _agrupar(lote):
+                    with self.aplicando:
+                        self._aplicar_grupo(tipo, grupo)
+            finally:
+                for _, _, _, ticket in lote:
+                    if not ticket.listo:
+                        ticket._terminar(error=RuntimeError("La escritura no se pudo aplicar."))
+                with self._cond:
+                    self._aplicadas += len(lote)
+                    self._cond.notify_all()
+
+    def _mantener(self):
+        self._recuperar()
+        try:
+            almacenamiento.actualizar_espejo()
+            almacenamiento.archivar_liquidadas()
+            diario.instantanea_si_corresponde()
+        except Exception:
+            pass  # se reintenta en la próxima pasada; nada de esto es urgente
+
+    def _recuperar(self):
+        """Aplica entradas que dejó en la cola un proceso que ya no está."""
+        almacen = almacenamiento.obtener_almacen()
+        if not hasattr(almacen, 'pendientes_cola'):
+            return
+        huerfanas = [(seq, tipo, json.loads(datos), None)
+                     for seq, tipo, datos in almacen.pendientes_cola(PROCESO, ANTIGUEDAD_HUERFANAS)]
+        for tipo, grupo in _agrupar(huerfanas):
+            self._aplicar_grupo(tipo, grupo)
+
+    def _aplicar_grupo(self, tipo, grupo):
+        almacen = almacenamiento.obtener_almacen()
+        seqs = [seq for seq, _, _ in grupo if seq is not None]
+        try:
+            with span(f'cola_{tipo}', len(grupo)):
+                reclamo = almacen.reclamando(seqs) if seqs else nullcontext()
+                with reclamo:
+                    avisos = _ejecutar(tipo, [datos for _, datos, _ in grupo])
+        except YaAplicada:
+            if len(grupo) > 1:
+                for uno in grupo:  # solo algunas ya estaban aplicadas: de a una
+                    self._aplicar_grupo(tipo, [uno])
+                return
+            avisos = [None]
+        except Exception as e:
+            if len(grupo) > 1:
+                # Un grupo combinado se deshizo entero: de a una, para que solo fallen las que fallan solas.
+                for uno in grupo:
+                    self._aplicar_grupo(tipo, [uno])
+                return
+            # Una escritura rechazada (p.ej. ConflictoVersion) se informa y no se reintenta.
+            avisos = None
+            for _, _, ticket in grupo:
+                if ticket is not None:
+                    ticket._terminar(error=e)
+        if seqs:
+            almacen.quitar_de_cola(seqs)  # las que no llegaron a escribir nada
+        if avisos is not None:
+            for (_, _, ticket), aviso in zip(grupo, avisos):
+                if ticket is not None:
+                    ticket._terminar(aviso=aviso)
+
+
+def _agrupar(lote):
+    """Tramos consecutivos del mismo tipo; solo los tipos combinables se juntan."""
+    grupos = []
+    for seq, tipo, datos, ticket in lote:
+        if grupos and grupos[-1][0] == tipo and tipo in COMBINABLES:
+            grupos[-1][1].append((seq, datos, ticket))
+        else:
+            grupos.append((tipo, [(seq, datos, ticket)]))
+    return grupos
+
+
+def _por_venta(movimientos, clave, **campos):
+    """Datos del diario por ID: {ID: {clave: [{campo..., 'fecha'}]}} (un ID puede traer varios)."""
+    por_venta = {}
+    for movimiento in movimientos:
+        detalle = {nombre: valor(movimiento) for nombre, valor in campos.items()}
+        detalle['fecha'] = movimiento['Fecha']
+        por_venta.setdefault(str(movimiento['ID']), {clave: []})[clave].append(detalle)
+    return por_venta
+
+
+def _con_diario():
+    # Sin diario (backend Excel) la columna de fechas de tela es el único historial de entregas.
+    return hasattr(almacenamiento.obtener_almacen(), 'eventos')
+
+
+def _ejecutar(tipo, lista):
+    """Aplica los datos de un grupo; devuelve un aviso (o None) por entrada."""
+    if tipo == 'insertar':
+        almacenamiento.guardar_venta([fila for filas in lista for fila in filas])
+        return [None] * len(lista)
+    if tipo == 'actualizar':
+        (datos,) = lista
+        df_filas = pd.DataFrame(datos['valores'], index=datos['indice'], columns=datos['columnas'])
+        almacenamiento.actualizar_db(df_filas, datos['versiones'] or None)
+        return [None]
+    if tipo == 'eliminar':
+        (datos,) = lista
+        almacenamiento.eliminar_venta(datos['id'], datos['version'])
+        return [None]
+    if tipo == 'pagos':
+        pagos = [pago for grupo in lista for pago in grupo]
+        _, sobrante = almacenamiento.actualizar_fusionando(
+            list({str(p['ID']) for p in pagos}), lambda df: aplicar_pagos(df, pagos),
+            evento=('pago', _por_venta(pagos, 'pagos', valor=lambda p: p['Valor'])))
+        sobrante = sobrante[sobrante > 0]
+        avisos = []
+        for grupo in lista:
+            propio = sobrante[sobrante.index.isin([str(p['ID']) for p in grupo])]
+            avisos.append("Valores no asignados (ID inexistente o pago mayor al saldo): "
+                          + ", ".join(f"{i}: ${v:,.0f}" for i, v in propio.items()) if not propio.empty else None)
+        return avisos
+    if tipo == 'telas':
+        entregas = [entrega for grupo in lista for entrega in grupo]
+        acumular = not _con_diario()
+        filas = almacenamiento.actualizar_fusionando(
+            list({str(e['ID']) for e in entregas}), lambda df: aplicar_telas(df, entregas, acumular),
+            evento=('tela', _por_venta(entregas, 'entregas', metros=lambda e: e['Metros'])))
+        ids_con_tela = set(filas['ID'].astype(str))
+        return [None if any(str(e['ID']) in ids_con_tela for e in grupo)
+                else "La venta no tiene pantalones: no se registró tela." for grupo in lista]
+    raise ValueError(f"Tipo de escritura desconocido: {tipo}")
+
+
+_escritor = EscritorFondo()
+
+
+def encolar(tipo, datos, descripcion=""):
+    """Encola una escritura ('insertar', 'actualizar', 'eliminar', 'pagos', 'telas')."""
+    return _escritor.encolar(tipo, datos, descripcion)
+
+
+def encolar_actualizacion(df_filas, versiones=None, descripcion=""):
+    """actualizar_db en segundo plano (índice = llave de fila de cargar_datos)."""
+    return encolar('actualizar', {
+        'indice': [int(llave) for llave in df_filas.index],
+        'columnas': list(df_filas.columns),
+        'valores': df_filas.astype(object).values.tolist(),
+        'versiones': {str(i): v for i, v in (versiones or {}).items()},
+    }, descripcion)
+
+
+def esperar_escrituras(timeout=None):
+    return _escritor.esperar(timeout)
+
+
+def detener_escritor(timeout=None):
+    return _escritor.detener(timeout)
+
+
+def _superponer(df, tickets):
+    """df con las escrituras de tickets encima, como quedarán al aplicarse (df no se modifica)."""
+    for ticket in tickets:
+        tipo, datos = ticket.tipo, ticket.datos
+        try:
+            if tipo == 'insertar':
+                df = almacenamiento.con_filas_nuevas(df, datos)
+            elif tipo == 'actualizar':
+                df = almacenamiento.con_filas_cambiadas(
+                    df, pd.DataFrame(datos['valores'], index=datos['indice'], columns=datos['columnas']))
+            elif tipo == 'eliminar':
+                df = almacenamiento.sin_venta(df, datos['id'])
+            elif tipo == 'pagos':
+                df = almacenamiento.con_filas_cambiadas(df, aplicar_pagos(df, datos)[0])
+            elif tipo == 'telas':
+                df = almacenamiento.con_filas_cambiadas(df, aplicar_telas(df, datos, not _con_diario()))
+        except Exception:
+            continue  # la escritura va a fallar también al aplicarse; su Ticket lo informa
+    return df
+
+
+def cargar_datos(historial=False, tickets=()):
+    """almacenamiento.cargar_datos con lo de tickets que el escritor aún no aplicó encima (read-your-writes).
+
+    No espera a la cola: solo, si acaso, al grupo que se está aplicando, para
+    no ver una escritura dos veces (en la caché y encima).
+    """
+    if all(ticket.listo for ticket in tickets):
+        return almacenamiento.cargar_datos(historial)
+    with _escritor.aplicando:
+        df = almacenamiento.cargar_datos()
+        sin_aplicar = [ticket for ticket in tickets if not ticket.listo]
+    if sin_aplicar:
+        with span('superponer_escrituras', len(sin_aplicar)):
+            df = _superponer(df, sin_aplicar)
+    return almacenamiento.cargar_historial(df) if historial else df
@@ -0,0 +1,111 @@
+"""Diario de movimientos: historial y auditoría sin tocar la tabla de ventas.
+
+Cada venta, pago, entrega de tela, edición, eliminación, archivado y
+restauración queda como un evento en la tabla `eventos` de SQLite, anotado
+en la misma transacción que cambia las ventas (ver AlmacenSQLite._anotar).
+Los eventos guardan solo lo que cambió ({_fila: {columna: [antes, después]}}),
+así que el estado de las ventas en cualquier punto del diario se obtiene
+partiendo de la última instantánea anterior y aplicando los eventos que
+siguen. Las instantáneas se toman en cada restauración y, con la cola de
+escrituras ociosa, cada EVENTOS_POR_INSTANTANEA eventos; solo se conservan
+las últimas almacenamiento.INSTANTANEAS_GUARDADAS, así que los puntos
+anteriores a la más antigua ya no se pueden reconstruir.
+"""
+import pandas as pd
+
+import almacenamiento
+from almacenamiento import COLUMNAS_VENTA, aplicar_tipos
+from instrumentacion import span
+
+EVENTOS_POR_INSTANTANEA = 1000
+NOMBRES = {
+    'venta': "Venta registrada",
+    'pago': "Abono",
+    'tela': "Entrega de tela",
+    'edicion': "Edición",
+    'eliminacion': "Venta eliminada",
+    'archivo': "Archivada",
+    'restauracion': "Restauración",
+}
+
+
+def _almacen_con_diario():
+    almacen = almacenamiento.obtener_almacen()
+    if not hasattr(almacen, 'eventos'):
+        raise RuntimeError("El diario de movimientos requiere el backend SQLite.")
+    return almacen
+
+
+def _aplicar(estado, tipo, datos):
+    """Aplica un evento a estado ({_fila: {columna: valor}})."""
+    filas = datos.get('filas', {})
+    if tipo == 'venta':
+        for fila, valores in filas.items():
+            estado[int(fila)] = dict(valores)
+    elif tipo == 'eliminacion':
+        for fila in filas:
+            estado.pop(int(fila), None)
+    elif tipo in ('pago', 'tela', 'edicion'):
+        for fila, cambios in filas.items():
+            estado.setdefault(int(fila), {}).update((c, nuevo) for c, (_, nuevo) in cambios.items())
+    # 'archivo' solo cambia dónde está la venta; 'restauracion' viene con su instantánea.
+
+
+def reconstruir(hasta=None):
+    """Ventas (activas y archivadas) tal como estaban en el evento hasta (por defecto, el último).
+
+    ValueError si hasta es anterior a las instantáneas que se conservan.
+    """
+    almacen = _almacen_con_diario()
+    with span('diario_reconstruir') as medicion:
+        base = almacen.instantanea(hasta)
+        desde, estado = base if base else (0, {})
+        eventos = almacen.eventos(desde, hasta)
+        for _, _, tipo, _, datos in eventos:
+            _aplicar(estado, tipo, datos)
+        medicion['filas'] = len(eventos)
+    df = pd.DataFrame.from_dict(estado, orient='index', columns=COLUMNAS_VENTA).sort_index()
+    return aplicar_tipos(df)
+
+
+def verificar():
+    """IDs cuyas filas guardadas no coinciden con las reconstruidas desde el diario (vacío = todo cuadra)."""
+    esperado = reconstruir().astype(object)
+    actual = almacenamiento.cargar_datos(historial=True)[COLUMNAS_VENTA].astype(object)
+    llaves = esperado.index.union(actual.index)
+    esperado, actual = esperado.reindex(llaves), actual.reindex(llaves)
+    iguales = (esperado == actual) | (esperado.isna() & actual.isna())
+    distintas = ~iguales.all(axis=1)
+    return sorted(set(esperado.loc[distintas, 'ID'].dropna()) | set(actual.loc[distintas, 'ID'].dropna()))
+
+
+def _detalle(tipo, datos):
+    if tipo == 'pago':
+        return ", ".join(f"${p['valor']:,.0f} ({p['fecha']})" for p in datos.get('pagos', []))
+    if tipo == 'tela':
+        return ", ".join(f"+{e['metros']:.2f} mts ({e['fecha']})" for e in datos.get('entregas', []))
+    if tipo == 'venta':
+        total = sum(f.get('Subtotal niño(a)') or 0 for f in datos['filas'].values())
+        return f"{len(datos['filas'])} niño(s), total ${total:,.0f}"
+    if tipo == 'edicion':
+        columnas = sorted({c for cambios in datos['filas'].values() for c in cambios})
+        return "Cambió: " + ", ".join(columnas)
+    if tipo == 'restauracion':
+        return f"Modo {datos['modo']}, {datos['filas']} filas"
+    return ""
+
+
+def movimientos(id_venta):
+    """Historial de una venta, del más antiguo al más reciente."""
+    filas = [(registrado, NOMBRES.get(tipo, tipo), _detalle(tipo, datos))
+             for _, registrado, tipo, _, datos in _almacen_con_diario().eventos(id_venta=id_venta)]
+    return pd.DataFrame(filas, columns=['Registrado', 'Movimiento', 'Detalle'])
+
+
+def instantanea_si_corresponde(cada=EVENTOS_POR_INSTANTANEA):
+    """Toma una instantánea si desde la última se anotaron al menos cada eventos."""
+    almacen = almacenamiento.obtener_almacen()
+    if not hasattr(almacen, 'guardar_instantanea') or almacen.eventos_sin_instantanea() < cada:
+        return None
+    with span('diario_instantanea'):
+        return almacen.guardar_instantanea()
@@ -0,0 +1,143 @@
+"""Exportación a Excel bajo demanda.
+
+El libro se arma solo cuando alguien lo descarga, con openpyxl en modo
+write_only (cada fila va a disco al escribirse) y directo a un archivo en
+lugar de un BytesIO. Queda en disco por versión de los datos: mientras nadie
+escriba, las descargas de cualquier sesión reutilizan el mismo archivo.
+
+Hojas: Ventas (la primera, igual al respaldo que acepta la restauración),
+Producción por Talla, Cartera y la lista de corte (Corte Camisas, Corte
+Pantalones y Corte Tela). Incluye las ventas archivadas: el libro es también
+el respaldo completo; la lista de corte es solo de las ventas activas.
+"""
+import glob
+import io
+import os
+import threading
+
+import pandas as pd
+from openpyxl import Workbook
+
+import almacenamiento
+from agregados import TALLAS_ORDEN, AgregadosPostVenta, obtener_lista_corte
+from instrumentacion import span
+
+DIRECTORIO = 'exportaciones'
+FILAS_POR_BLOQUE = 5000
+
+_lock = threading.Lock()
+
+
+def _filas(df):
+    # Por bloques: la conversión a objetos Python nunca abarca la tabla completa.
+    for inicio in range(0, len(df), FILAS_POR_BLOQUE):
+        bloque = df.iloc[inicio:inicio + FILAS_POR_BLOQUE].astype(object)
+        yield from bloque.where(bloque.notna(), None).itertuples(index=False, name=None)
+
+
+def _orden_talla(tallas):
+    # 4, 6, ... 16 y luego S, M, L, XL, N/A en el orden en que aparecen en la app.
+    orden = {t: n for n, t in enumerate(TALLAS_ORDEN)}
+    return tallas.map(lambda t: orden.get(t, len(orden)))
+
+
+def produccion_por_talla(df):
+    """Camisas, pantalones y tela por tipo (Niño/Niña) y talla, con los agregados de Datos Post-Venta."""
+    # Tabla propia: df es el historial completo y obtener_agregados guarda la del tablero (activas).
+    tabla = AgregadosPostVenta(df).tabla.groupby(level=['Tipo', 'Talla Camisa']).sum()
+    tabla = tabla[(tabla['Camisas'] > 0) | (tabla['Pantalones'] > 0)].reset_index()
+    tabla['Tela Pendiente'] = (tabla['Tela Sugerida'] - tabla['Tela Entregada']).clip(lower=0).round(2)
+    tabla = tabla.sort_values(['Tipo', 'Talla Camisa'], key=lambda c: _orden_talla(c) if c.name == 'Talla Camisa' else c)
+    return tabla[['Tipo', 'Talla Camisa', 'Camisas', 'Pantalones', 'Tela Sugerida', 'Tela Entregada', 'Tela Pendiente']]
+
+
+def cartera(df):
+    """Una fila por venta con saldo pendiente, de la más antigua a la más reciente."""
+    por_venta = df.groupby('ID', sort=False).agg(**{
+        'Fecha Venta': ('Fecha Venta', 'first'),
+        'Cliente': ('Cliente', 'first'),
+        'Celular Principal': ('Celular Principal', 'first'),
+        'Colegio': ('Colegio', 'first'),
+        'Total': ('Subtotal niño(a)', 'sum'),
+        'Pagado': ('Pagado (Distribuido)', 'sum'),
+        'Saldo': ('Saldo Pendiente (Distribuido)', 'sum'),
+        'Estado Pago': ('Estado Pago', 'first'),
+    })
+    return por_venta[por_venta['Saldo'] > 0].sort_values('Fecha Venta').reset_index()
+
+
+def lista_corte(activas, colegio=None):
+    """Hojas de la lista de corte de las ventas abiertas de activas (ver agregados.ListaCorte)."""
+    corte = obtener_lista_corte(activas)
+    tela = corte.tela(colegio)
+    return {
+        'Corte Camisas': corte.camisas(colegio),
+        'Corte Pantalones': corte.pantalones(colegio),
+        'Corte Tela': pd.DataFrame([{'Tela Sugerida (mts)': tela['sugerida'], 'Tela Entregada (mts)': tela['entregada'],
+                                     'Tela Pendiente (mts)': tela['pendiente']}]),
+    }
+
+
+def _escribir_hojas(libro, hojas):
+    for titulo, datos in hojas.items():
+        hoja = libro.create_sheet(titulo)
+        hoja.append(list(datos.columns))
+        for fila in _filas(datos):
+            hoja.append(fila)
+
+
+def escribir_libro(df, ruta, activas=None):
+    libro = Workbook(write_only=True)
+    hojas = {'Ventas': df}
+    if not df.empty:
+        hojas['Producción por Talla'] = produccion_por_talla(df)
+        hojas['Cartera'] = cartera(df)
+    if activas is not None and not activas.empty:
+        hojas.update(lista_corte(activas))
+    _escribir_hojas(libro, hojas)
+    libro.save(ruta)
+
+
+def _nombre_version(version):
+    if isinstance(version, tuple):  # backend Excel: (mtime, tamaño)
+        return '-'.join(str(v) for v in version)
+    return str(version or 0)
+
+
+def ruta_exportacion():
+    """Ruta del libro de la versión actual de los datos; lo genera si no existe."""
+    with _lock:
+        # El nombre sale de la versión con que se cargaron estos datos, no de una lectura aparte.
+        activas, version = almacenamiento.cargar_datos_con_version()
+        ruta = os.path.join(DIRECTORIO, f"ventas_{_nombre_version(version)}.xlsx")
+        if os.path.exists(ruta):
+            return ruta
+        os.makedirs(DIRECTORIO, exist_ok=True)
+        df = almacenamiento.cargar_historial(activas)
+        temporal = f"{ruta}.{os.getpid()}.tmp"
+        with span('exportar_excel', len(df)):
+            escribir_libro(df, temporal, activas)
+            os.replace(temporal, ruta)
+        for anterior in glob.glob(os.path.join(DIRECTORIO, 'ventas_*.xlsx')):
+            if anterior != ruta:
+                try:
+                    os.remove(anterior)
+                except OSError:
+                    pass
+        return ruta
+
+
+def exportar_excel():
+    """Contenido del libro de la versión actual (para st.download_button)."""
+    with open(ruta_exportacion(), 'rb') as f:
+        return f.read()
+
+
+def exportar_lista_corte(colegio=None):
+    """Libro con solo la lista de corte (unas decenas de filas: se arma en memoria en cada descarga)."""
+    libro = Workbook(write_only=True)
+    with span('exportar_lista_corte'):
+        _escribir_hojas(libro, lista_corte(almacenamiento.cargar_datos(), colegio))
+        contenido = io.BytesIO()
+        libro.save(contenido)
+    return contenido.getvalue()
@@ -0,0 +1,71 @@
+"""Importación por lotes de listas de pedidos (CSV o XLSX), sin la interfaz.
+
+Uso:
+    python importar_pedidos.py lista_5A.xlsx --colegio "Colegio NCP"
+    python importar_pedidos.py pedidos.csv --validar     # solo revisa, no guarda
+
+Una fila por niño(a). Obligatorias: Cliente, Celular Principal, Tipo (Niño o
+Niña) y Nombre Alumno. Opcionales: Celular Adicional, Colegio, Descripción,
+Camisas, Talla Camisa, Pantalones, Medidas Cin/Cad/Pier (cm), Largo Pant (cm),
+Valor Recibido, Medio Pago, Entrega Tela (Si/No) y Metros Tela (mts). Las
+filas con el mismo Pedido (o, si no hay esa columna, el mismo Cliente y
+Celular Principal) forman una venta; Valor Recibido, Medio Pago, Entrega Tela
+y Metros Tela se toman de la primera fila de la venta que los trae.
+
+Precios de config_precios.json; la validación y el armado de las filas son
+los de pedidos (preparar_pedidos, filas_venta, igual que el formulario) y
+todo se guarda en una sola escritura por la cola de escrituras: o entran
+todas las ventas o ninguna. Con errores no se guarda
+nada y el código de salida es 1.
+"""
+import argparse
+import os
+import sys
+import pandas as pd
+
+from pedidos import ARCHIVO_CONFIG, cargar_config, guardar_pedidos, normalizar_filas, preparar_pedidos
+
+MAX_ERRORES = 20
+
+
+def leer(ruta, hoja=None):
+    """Filas del archivo como texto; el índice es el número de fila en el archivo."""
+    if os.path.splitext(ruta)[1].lower() == '.csv':
+        # sep=None detecta coma o punto y coma (Excel en español exporta con ';')
+        df = pd.read_csv(ruta, dtype=str, keep_default_na=False, sep=None, engine='python', encoding='utf-8-sig')
+    else:
+        df = pd.read_excel(ruta, sheet_name=hoja or 0, dtype=object)
+    return normalizar_filas(df)  # la fila 1 es el encabezado
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Importa una lista de pedidos (una fila por niño/niña).")
+    parser.add_argument('archivo', help="CSV o XLSX")
+    parser.add_argument('--hoja', help="Hoja del XLSX (por defecto la primera)")
+    parser.add_argument('--colegio', help="Colegio para las filas que no lo traen")
+    parser.add_argument('--config', default=ARCHIVO_CONFIG, help="Lista de precios")
+    parser.add_argument('--validar', action='store_true', help="Solo valida y muestra el resumen")
+    args = parser.parse_args(argv)
+
+    pedidos, errores = preparar_pedidos(leer(args.archivo, args.hoja), cargar_config(args.config), args.colegio)
+    if errores:
+        print(f"{len(errores)} errores; no se importó nada:")
+        for error in errores[:MAX_ERRORES]:
+            print(f"  {error}")
+        if len(errores) > MAX_ERRORES:
+            print(f"  ... y {len(errores) - MAX_ERRORES} más")
+        return 1
+
+    items = sum(len(p['ninos']) + len(p['ninas']) for p in pedidos)
+    total = sum(i['Subtotal'] for p in pedidos for i in p['ninos'] + p['ninas'])
+    recibido = sum(p['recibido'] for p in pedidos)
+    print(f"{len(pedidos)} ventas, {items} niños(as), total ${total:,.0f}, recibido ${recibido:,.0f}")
+    if args.validar:
+        return 0
+    ids = guardar_pedidos(pedidos, descripcion=f"{len(pedidos)} ventas importadas")
+    print(f"Guardadas: {ids[0]} a {ids[-1]}" if ids else "Nada que guardar.")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,165 @@
+"""Índices hash de las ventas para la Gestión Post-Venta y las consultas de la API.
+
+ID -> llaves de fila, Cliente -> IDs y Celular Principal -> IDs, construidos
+una vez por DataFrame de cargar_datos y mantenidos junto con la caché de
+almacenamiento: al guardar, editar o eliminar solo se tocan las filas de esas
+ventas. Elegir una venta y leer sus filas cuesta O(filas de la venta), no un
+recorrido de la tabla completa.
+
+Un IndicesVentas no cambia después de publicado: cada escritura deriva uno
+nuevo para el DataFrame nuevo (copiando los diccionarios y solo las entradas
+que toca) y lo cambia en la lista. Las sesiones y los hilos de la API que
+todavía tienen el anterior lo siguen consultando contra su propio origen.
+"""
+import threading
+
+import numpy as np
+
+import almacenamiento
+from instrumentacion import span
+
+RECIENTES = 3  # activas, historial (app) y archivo (API) pueden estar en uso a la vez
+
+
+class IndicesVentas:
+    def __init__(self, df):
+        self.origen = df
+        self.por_id = {}        # ID -> [llave de fila], en orden de aparición
+        self.por_cliente = {}   # Cliente -> {ID: filas con ese cliente}
+        self.por_celular = {}   # Celular Principal -> {ID: filas con ese celular}
+        # Con llaves repetidas (no debería pasar) se indexan posiciones y no se mantiene incrementalmente.
+        self.por_posicion = not df.index.is_unique
+        if df.empty:
+            return
+        llaves = np.arange(len(df)) if self.por_posicion else df.index.to_numpy()
+        for id_venta, posiciones in df.groupby('ID', sort=False, observed=True).indices.items():
+            self.por_id[id_venta] = llaves[posiciones].tolist()
+        for columna, indice in (('Cliente', self.por_cliente), ('Celular Principal', self.por_celular)):
+            conteos = df.groupby([columna, 'ID'], sort=False, observed=True).size()
+            for (valor, id_venta), n in zip(conteos.index, conteos.to_numpy()):
+                indice.setdefault(valor, {})[id_venta] = int(n)
+
+    # --- MANTENIMIENTO ---
+    # Como groupby al construir, las filas sin ID (o sin cliente/celular) no se indexan.
+    # _agregar y _quitar reemplazan las listas y diccionarios internos en vez de
+    # modificarlos: pueden ser compartidos con el índice del que se derivó.
+    def _agregar(self, filas):
+        for llave, id_venta, cliente, celular in zip(filas.index, filas['ID'], filas['Cliente'],
+                                                     filas['Celular Principal']):
+            if not isinstance(id_venta, str):
+                continue
+            self.por_id[id_venta] = self.por_id.get(id_venta, []) + [llave]
+            for indice, valor in ((self.por_cliente, cliente), (self.por_celular, celular)):
+                if not isinstance(valor, str):
+                    continue
+                ids = indice[valor] = dict(indice.get(valor, {}))
+                ids[id_venta] = ids.get(id_venta, 0) + 1
+
+    def _quitar(self, filas):
+        for llave, id_venta, cliente, celular in zip(filas.index, filas['ID'], filas['Cliente'],
+                                                     filas['Celular Principal']):
+            if not isinstance(id_venta, str):
+                continue
+            llaves = [otra for otra in self.por_id.get(id_venta, ()) if otra != llave]
+            if llaves:
+                self.por_id[id_venta] = llaves
+            else:
+                self.por_id.pop(id_venta, None)
+            for indice, valor in ((self.por_cliente, cliente), (self.por_celular, celular)):
+                if not isinstance(valor, str):
+                    continue
+                ids = dict(indice.get(valor, {}))
+                ids[id_venta] = ids.get(id_venta, 0) - 1
+                if ids[id_venta] <= 0:
+                    ids.pop(id_venta)
+                if ids:
+                    indice[valor] = ids
+                else:
+                    indice.pop(valor, None)
+
+    def derivar(self, evento, df_anterior, df_nuevo, filas):
+        """Índices de df_nuevo tras el evento; este queda como estaba, válido para su origen."""
+        nuevo = object.__new__(IndicesVentas)
+        nuevo.origen = df_nuevo
+        nuevo.por_posicion = self.por_posicion
+        nuevo.por_id = self.por_id
+        nuevo.por_cliente = self.por_cliente
+        nuevo.por_celular = self.por_celular
+        if evento == 'actualizar':
+            columnas = ['ID', 'Cliente', 'Celular Principal']
+            anteriores = df_anterior.loc[filas.index, columnas]
+            # Pagos, tela y ediciones de prendas no cambian las llaves: se comparten los diccionarios.
+            if (anteriores.astype(object) == filas[columnas].astype(object)).all(axis=None):
+                return nuevo
+        nuevo.por_id = dict(self.por_id)
+        nuevo.por_cliente = dict(self.por_cliente)
+        nuevo.por_celular = dict(self.por_celular)
+        if evento == 'insertar':
+            nuevo._agregar(filas)
+        elif evento == 'eliminar':
+            nuevo._quitar(filas)
+        elif evento == 'actualizar':
+            nuevo._quitar(anteriores)
+            nuevo._agregar(filas)
+        return nuevo
+
+    # --- CONSULTAS ---
+    def ids(self):
+        return list(self.por_id)
+
+    def clientes(self):
+        return list(self.por_cliente)
+
+    def ids_cliente(self, cliente):
+        return list(self.por_cliente.get(cliente, ()))
+
+    def ids_celular(self, celular):
+        return list(self.por_celular.get(celular, ()))
+
+    def __contains__(self, id_venta):
+        return id_venta in self.por_id
+
+    def posiciones(self, ids):
+        """Posiciones de fila en origen de las ventas ids (las que no existen se omiten)."""
+        llaves = [llave for id_venta in ids for llave in self.por_id.get(id_venta, ())]
+        if self.por_posicion:
+            return np.array(llaves, dtype=np.int64)
+        indice = self.origen.index
+        if indice.is_monotonic_increasing:  # llaves de SQLite: búsqueda binaria, sin tabla hash
+            return indice.searchsorted(llaves)
+        return indice.get_indexer(llaves)
+
+    def filas(self, *ids):
+        """Filas de las ventas ids, en orden de venta y de fila."""
+        return self.origen.iloc[self.posiciones(ids)]
+
+
+_lock = threading.Lock()
+_indices = []  # los RECIENTES últimos, el más reciente primero
+
+
+def _al_cambiar_datos(evento, df_anterior, df_nuevo, filas):
+    with _lock:
+        for i, indices in enumerate(_indices):
+            if indices.origen is df_anterior:
+                if evento != 'recargar' and not indices.por_posicion:
+                    _indices[i] = indices.derivar(evento, df_anterior, df_nuevo, filas)
+                else:
+                    del _indices[i]
+                return
+
+
+almacenamiento.suscribir(_al_cambiar_datos)
+
+
+def obtener_indices(df):
+    """Índices del DataFrame compartido devuelto por cargar_datos (se construyen una vez)."""
+    with _lock:
+        for indices in _indices:
+            if indices.origen is df:
+                return indices
+        with span('indices_construir', len(df)):
+            indices = IndicesVentas(df)
+        _indices.insert(0, indices)
+        del _indices[RECIENTES:]
+        return indices
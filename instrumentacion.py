@@ -0,0 +1,131 @@
+"""Mediciones de tiempo (spans) de las rutas críticas, agrupadas por rerun.
+
+Cada span registra el tiempo de pared, las filas tocadas y los bytes que el
+hilo escribió mientras estuvo abierto (Linux: wchar de /proc/thread-self/io;
+None en otros sistemas). Los spans de un rerun se escriben como una línea
+JSON en el logger 'ventas.tiempos' (a archivo con VENTAS_LOG_TIEMPOS=ruta) y
+alimentan una ventana móvil por span para resumir p50/p95.
+"""
+import functools
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+VENTANA = 500  # últimas mediciones por span que entran al resumen
+
+logger = logging.getLogger('ventas.tiempos')
+if os.environ.get('VENTAS_LOG_TIEMPOS'):
+    _manejador = logging.FileHandler(os.environ['VENTAS_LOG_TIEMPOS'], encoding='utf-8')
+    _manejador.setFormatter(logging.Formatter('%(message)s'))
+    logger.addHandler(_manejador)
+    logger.setLevel(logging.INFO)
+
+_local = threading.local()      # rerun y pila de spans del hilo del script
+_lock = threading.Lock()
+_ventana = defaultdict(lambda: deque(maxlen=VENTANA))
+_reruns = {}                    # sesión -> rerun aún abierto
+
+
+def _bytes_escritos():
+    try:
+        with open('/proc/thread-self/io', 'rb') as f:
+            for linea in f:
+                if linea.startswith(b'wchar:'):
+                    return int(linea[6:])
+    except OSError:
+        pass
+    return None
+
+
+@contextmanager
+def span(nombre, filas=None):
+    """Mide el bloque; el registro devuelto admite fijar 'filas' al final."""
+    pila = getattr(_local, 'pila', None)
+    if pila is None:
+        pila = _local.pila = []
+    registro = {'span': nombre, 'filas': filas, 'bytes': None,
+                'padre': pila[-1]['span'] if pila else None}
+    pila.append(registro)
+    bytes_antes = _bytes_escritos()
+    inicio = time.perf_counter()
+    try:
+        yield registro
+    finally:
+        registro['ms'] = round((time.perf_counter() - inicio) * 1000, 3)
+        if bytes_antes is not None and registro['bytes'] is None:
+            registro['bytes'] = _bytes_escritos() - bytes_antes
+        pila.pop()
+        with _lock:
+            _ventana[nombre].append(registro['ms'])
+        rerun = getattr(_local, 'rerun', None)
+        if rerun is not None:
+            rerun['spans'].append(registro)
+
+
+def medido(nombre):
+    """Decorador: la función completa como span; filas = filas del DataFrame recibido."""
+    def decorador(funcion):
+        @functools.wraps(funcion)
+        def envoltura(df, *args, **kwargs):
+            with span(nombre, len(df) if isinstance(df, pd.DataFrame) else None):
+                return funcion(df, *args, **kwargs)
+        return envoltura
+    return decorador
+
+
+def iniciar_rerun(sesion, **contexto):
+    """Abre el registro del rerun de una sesión.
+
+    Si el rerun anterior de la sesión no llegó a cerrar_rerun (st.rerun o
+    st.stop lo cortaron) se cierra y se escribe en este momento.
+    """
+    with _lock:
+        anterior = _reruns.pop(sesion, None)
+    if anterior is not None:
+        _escribir(anterior, completo=False)
+    rerun = {'sesion': sesion, 'inicio': time.time(), 'spans': [], **contexto}
+    rerun['_t0'] = time.perf_counter()
+    with _lock:
+        _reruns[sesion] = rerun
+    _local.rerun = rerun
+    _local.pila = []
+
+
+def rerun_en_curso():
+    """True si el hilo tiene un rerun abierto (un fragmento que corre dentro de él no abre otro)."""
+    return getattr(_local, 'rerun', None) is not None
+
+
+def cerrar_rerun(sesion):
+    """Cierra el rerun de la sesión, lo escribe en el log y lo devuelve."""
+    with _lock:
+        rerun = _reruns.pop(sesion, None)
+    _local.rerun = None
+    if rerun is not None:
+        _escribir(rerun, completo=True)
+    return rerun
+
+
+def _escribir(rerun, completo):
+    rerun['total_ms'] = round((time.perf_counter() - rerun.pop('_t0')) * 1000, 3)
+    rerun['completo'] = completo
+    if logger.isEnabledFor(logging.INFO):
+        logger.info(json.dumps(rerun, ensure_ascii=False, default=str))
+
+
+def resumen_ventana():
+    """p50/p95 por span sobre las últimas VENTANA mediciones del proceso."""
+    with _lock:
+        datos = {nombre: np.array(ms) for nombre, ms in _ventana.items() if ms}
+    return pd.DataFrame([
+        {'Span': nombre, 'N': len(ms), 'p50 (ms)': round(float(np.percentile(ms, 50)), 2),
+         'p95 (ms)': round(float(np.percentile(ms, 95)), 2), 'Máx (ms)': round(float(ms.max()), 2)}
+        for nombre, ms in sorted(datos.items())
+    ], columns=['Span', 'N', 'p50 (ms)', 'p95 (ms)', 'Máx (ms)'])
@@ -0,0 +1,415 @@
+"""Reglas de la venta sin interfaz: precios, pedido por niño(a) y filas a guardar.
+
+La app de Streamlit, el importador por lotes (importar_pedidos) y la API
+HTTP (api_ventas) arman las ventas con estas funciones y las guardan por la
+misma cola de escrituras. Nada de aquí importa streamlit.
+"""
+import json
+import os
+import threading
+from datetime import datetime
+
+import pandas as pd
+
+from almacenamiento import ZONA_HORARIA, bloqueo_archivo, nuevos_ids_venta
+from calculos import distribuir_pago_inicial, recalcular_lineas
+from cola_escritura import encolar
+
+ARCHIVO_CONFIG = 'config_precios.json'
+TALLAS = ["4", "6", "8", "10", "12", "14", "16", "S", "M", "L", "XL"]
+MEDIOS_PAGO = ["Efectivo", "Transferencia"]
+MEDIDAS = {  # clave del carrito -> columna de la venta
+    "Medidas Cin": "Medidas Cin (cm)",
+    "Medidas Cad": "Medidas Cad (cm)",
+    "Medidas Pier": "Medidas Pier (cm)",
+    "Largo Pantalon": "Largo Pant (cm)",
+}
+
+
+# --- CONFIGURACIÓN DE PRECIOS ---
+# La lista vigente está en ARCHIVO_CONFIG y cada versión guardada queda en
+# <archivo>_historial.json ({versión: lista}). Cada fila de venta guarda en
+# 'Versión Precios' la lista con que se calculó. Ambos archivos se escriben
+# con reemplazo atómico y se leen una vez por proceso: la caché se invalida
+# cuando cambia el archivo (os.replace le da uno nuevo), sin volver a parsearlo.
+def config_defecto():
+    return {
+        "precios_nino": {
+            "4": 44000, "6": 44000, "8": 44000, "10": 44000, "12": 44000, "14": 44000,
+            "16": 46000, "S": 46000, "M": 46000,
+            "L": 48000, "XL": 48000
+        },
+        "precios_nina": {
+            "4": 38000, "6": 38000, "8": 38000,
+            "10": 40000, "12": 40000, "14": 40000, "16": 40000,
+            "S": 43000, "M": 43000,
+            "L": 46000, "XL": 46000
+        },
+        "precio_pantalon": 35000,
+        "ultima_actualizacion": "Valores Iniciales",
+        "version": 0,
+    }
+
+
+_cache_json = {}  # ruta -> (firma del archivo, contenido)
+_cache_json_lock = threading.Lock()
+
+
+def _firma(ruta):
+    try:
+        info = os.stat(ruta)
+    except OSError:
+        return None
+    return (info.st_ino, info.st_mtime_ns, info.st_size)
+
+
+def _leer_json(ruta):
+    """Contenido de ruta (None si no existe o no se puede leer), parseado una vez por versión del archivo."""
+    firma = _firma(ruta)
+    with _cache_json_lock:
+        guardado = _cache_json.get(ruta)
+        if guardado is not None and guardado[0] == firma:
+            return guardado[1]
+    if firma is None:
+        return None
+    try:
+        with open(ruta, 'r', encoding='utf-8') as f:
+            contenido = json.load(f)
+    except (OSError, ValueError):
+        return guardado[1] if guardado is not None else None
+    with _cache_json_lock:
+        _cache_json[ruta] = (firma, contenido)
+    return contenido
+
+
+def _escribir_json(ruta, contenido):
+    """Escritura atómica: un lector ve el archivo anterior o el nuevo, nunca uno a medias."""
+    temporal = f"{ruta}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temporal, 'w', encoding='utf-8') as f:
+        json.dump(contenido, f, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporal, ruta)
+
+
+def ruta_historial(ruta=ARCHIVO_CONFIG):
+    return f"{os.path.splitext(ruta)[0]}_historial.json"
+
+
+def cargar_config(ruta=ARCHIVO_CONFIG):
+    """Lista de precios vigente (compartida: no modificarla)."""
+    config = _leer_json(ruta)
+    if not isinstance(config, dict):
+        return config_defecto()
+    config.setdefault("version", 0)  # archivo anterior al historial de precios
+    return config
+
+
+def historial_precios(ruta=ARCHIVO_CONFIG):
+    """{versión: lista de precios} de todas las listas guardadas, incluida la vigente."""
+    historial = {int(v): c for v, c in (_leer_json(ruta_historial(ruta)) or {}).items()}
+    vigente = cargar_config(ruta)
+    historial.setdefault(vigente["version"], vigente)
+    return dict(sorted(historial.items()))
+
+
+def config_version(version, ruta=ARCHIVO_CONFIG):
+    """Lista de precios de esa versión; la vigente si no hay versión o no está en el historial."""
+    if version is None or pd.isna(version):
+        return cargar_config(ruta)
+    return historial_precios(ruta).get(int(version)) or cargar_config(ruta)
+
+
+def config_de_filas(filas, ruta=ARCHIVO_CONFIG):
+    """Lista con que se calcularon las filas (la más reciente si traen varias)."""
+    versiones = filas['Versión Precios'].dropna() if 'Versión Precios' in filas.columns else ()
+    return config_version(max(versiones) if len(versiones) else None, ruta)
+
+
+def guardar_config(nuevo_config, ruta=ARCHIVO_CONFIG):
+    """Guarda nuevo_config como una versión nueva de la lista vigente y la devuelve con su número."""
+    with bloqueo_archivo(ruta):
+        archivo_historial = ruta_historial(ruta)
+        historial = dict(_leer_json(archivo_historial) or {})
+        anterior = cargar_config(ruta)
+        historial.setdefault(str(anterior["version"]), anterior)
+        version = max(int(v) for v in historial) + 1
+        nuevo = {**nuevo_config, "version": version}
+        historial[str(version)] = nuevo
+        # Primero el historial: si algo falla entre las dos escrituras la versión ya está registrada.
+        _escribir_json(archivo_historial, historial)
+        _escribir_json(ruta, nuevo)
+    return nuevo
+
+
+# --- PEDIDO POR NIÑO(A) ---
+def items_pedido(lineas, config):
+    """Ítems del carrito para las líneas dadas, con precio y tela de config.
+
+    lineas trae 'Tipo Detalle' ("Niño 1", "Niña 2"...), 'Nombre Alumno',
+    'Camisas', 'Talla Camisa', 'Pantalones' y las columnas de medidas; se
+    calculan todas juntas, así que sirve para una línea o para una lista completa.
+    """
+    lineas = lineas.copy()
+    for columna in MEDIDAS.values():
+        if columna not in lineas.columns:
+            lineas[columna] = 0
+    calculadas = recalcular_lineas(lineas, config)
+    items = []
+    for linea in calculadas.to_dict('records'):
+        con_pantalon = linea['Pantalones'] > 0
+        item = {
+            "Tipo_Visual": linea['Tipo Detalle'],
+            "Nombre Alumno": linea['Nombre Alumno'],
+            "Camisas": linea['Camisas'],
+            "Talla Camisa": linea['Talla Camisa'] if linea['Camisas'] > 0 else "N/A",
+            "Subtotal": int(linea['Subtotal niño(a)']),
+            "Versión Precios": linea['Versión Precios'],
+        }
+        if linea['Tipo Detalle'].startswith("Niño"):
+            item["Pantalones"] = linea['Pantalones']
+            item.update({clave: linea[columna] if con_pantalon else 0 for clave, columna in MEDIDAS.items()})
+            item["Consumo Tela Calc"] = float(linea['Tela Sugerida (mts)'])
+        items.append(item)
+    return items
+
+
+def item_nino(numero, nombre, camisas, talla, pantalones, cintura, cadera, pierna, largo, config):
+    (item,) = items_pedido(pd.DataFrame([{
+        "Tipo Detalle": f"Niño {numero}", "Nombre Alumno": nombre, "Camisas": camisas, "Talla Camisa": talla,
+        "Pantalones": pantalones, "Medidas Cin (cm)": cintura, "Medidas Cad (cm)": cadera,
+        "Medidas Pier (cm)": pierna, "Largo Pant (cm)": largo,
+    }]), config)
+    return item
+
+
+def item_nina(numero, nombre, camisas, talla, config):
+    (item,) = items_pedido(pd.DataFrame([{
+        "Tipo Detalle": f"Niña {numero}", "Nombre Alumno": nombre, "Camisas": camisas, "Talla Camisa": talla,
+        "Pantalones": 0,
+    }]), config)
+    return item
+
+
+# --- CIERRE DE LA VENTA ---
+def estado_pago(total, recibido):
+    if recibido <= 0:
+        return "Pendiente"
+    if recibido < total:
+        return "Abono"
+    if recibido == total:
+        return "Pago Total"
+    return "Pendiente"  # mayor al total: el formulario lo advierte pero guarda
+
+
+def validar_venta(cliente, celular, total, recibido, medio_pago):
+    """Lista de errores que impiden guardar la venta (vacía si se puede guardar)."""
+    errores = []
+    if not cliente: errores.append("Falta Nombre Cliente")
+    if not celular: errores.append("Falta Celular Principal")
+    if total == 0: errores.append("El pedido está vacío")
+    if recibido > 0 and medio_pago not in MEDIOS_PAGO:
+        errores.append("Seleccione un Tipo de Pago válido")
+    return errores
+
+
+def filas_venta(id_venta, fecha, cliente, ninos, ninas, recibido=0, medio_pago="",
+                entrega_tela="No", metros_tela=0.0):
+    """Filas a guardar (una por niño/niña) de una venta con los ítems del carrito.
+
+    cliente: {'Cliente', 'Celular Principal', 'Celular Adicional', 'Colegio',
+    'Descripción'}. El pago se reparte en cascada (el excedente queda en la
+    última línea) y la tela entregada va al primer niño con pantalones.
+    """
+    items = [(item, True) for item in ninos] + [(item, False) for item in ninas]
+    total = sum(item['Subtotal'] for item, _ in items)
+    estado = estado_pago(total, recibido)
+    fecha_abono = fecha if estado == "Abono" else ""
+    fecha_total = fecha if estado == "Pago Total" else ""
+    metros_por_asignar = metros_tela if entrega_tela == "Si" else 0
+    celular_adicional = cliente.get('Celular Adicional')
+
+    filas = []
+    pagos_asignados = distribuir_pago_inicial([item['Subtotal'] for item, _ in items], recibido)
+    for (item, es_nino), pago_asignado in zip(items, pagos_asignados):
+        metros_asignados = 0
+        # Niña o niño sin pantalones: "No Aplica"
+        if es_nino and item.get("Pantalones", 0) > 0:
+            estado_tela = "Si" if entrega_tela == "Si" else "No"
+            if metros_por_asignar > 0:
+                metros_asignados = metros_por_asignar
+                metros_por_asignar = 0
+        else:
+            estado_tela = "No Aplica"
+
+        filas.append({
+            "ID": id_venta,
+            "Fecha Venta": fecha,
+            "Cliente": cliente.get('Cliente'),
+            "Celular Principal": str(cliente.get('Celular Principal')).strip(),
+            "Celular Adicional": str(celular_adicional).strip() if celular_adicional else "",
+            "Colegio": cliente.get('Colegio'),
+            "Descripción": cliente.get('Descripción'),
+            "Tipo Detalle": item["Tipo_Visual"],
+            "Nombre Alumno": item["Nombre Alumno"],
+            "Camisas": item["Camisas"],
+            "Talla Camisa": item["Talla Camisa"],
+            "Pantalones": item.get("Pantalones", 0),
+
+            "Largo Pant (cm)": item.get("Largo Pantalon", 0),
+            "Medidas Cin (cm)": item.get("Medidas Cin", 0),
+            "Medidas Cad (cm)": item.get("Medidas Cad", 0),
+            "Medidas Pier (cm)": item.get("Medidas Pier", 0),
+
+            "Tela Sugerida (mts)": round(item.get("Consumo Tela Calc", 0), 2),
+
+            "Subtotal niño(a)": item['Subtotal'],
+            "Pagado (Distribuido)": int(pago_asignado),
+            "Saldo Pendiente (Distribuido)": int(max(item['Subtotal'] - pago_asignado, 0)),
+            "Estado Pago": estado,
+            "Medio Pago": medio_pago if pago_asignado > 0 else "",
+            "Fecha Abono": fecha_abono if pago_asignado > 0 else "",
+            "Fecha Total Pago": fecha_total,
+
+            "Entrega Tela": estado_tela,
+            "Metros Tela (mts)": round(metros_asignados, 2),
+            "Fecha Entrega Tela": fecha if metros_asignados > 0 else "",
+            "Fecha Entrega Nueva Tela": "",
+            "Versión Precios": item.get("Versión Precios"),
+        })
+    return filas
+
+
+# --- PEDIDOS EN LOTE (importar_pedidos, api_ventas) ---
+OBLIGATORIAS = ['Cliente', 'Celular Principal', 'Tipo', 'Nombre Alumno']
+ENTEROS = ['Camisas', 'Pantalones', 'Medidas Cin (cm)', 'Medidas Cad (cm)', 'Medidas Pier (cm)',
+           'Largo Pant (cm)', 'Valor Recibido']
+
+
+def _texto(valor):
+    if valor is None or (isinstance(valor, float) and pd.isna(valor)):
+        return ""
+    if isinstance(valor, float) and valor.is_integer():
+        valor = int(valor)  # celulares y tallas guardados como número
+    return str(valor).strip()
+
+
+def _tipo(valor):
+    valor = valor.lower().replace('ñ', 'n')
+    if valor.startswith('nino'):
+        return "Niño"
+    if valor.startswith('nina'):
+        return "Niña"
+    return None
+
+
+def _primeros(df, grupos, columna):
+    """Primer valor no vacío de columna en cada venta ("" si ninguna fila lo trae)."""
+    valores = df[columna].astype(object)
+    return valores.where((valores != "") & (valores != 0)).groupby(grupos).first().fillna("")
+
+
+def normalizar_filas(df, primera_fila=2):
+    """Filas de un pedido en lote como texto; el índice pasa a ser el número de fila."""
+    df = df.copy()
+    df.columns = [str(c).strip() for c in df.columns]
+    df = df.map(_texto)
+    df.index = range(primera_fila, primera_fila + len(df))
+    return df[(df != "").any(axis=1)]
+
+
+def preparar_pedidos(df, config, colegio=None):
+    """(pedidos, errores) a partir de filas normalizadas; con errores los pedidos no sirven.
+
+    Una fila por niño(a) (ver importar_pedidos para las columnas). Cada pedido
+    es un dict con los argumentos de filas_venta (menos ID y fecha) y las
+    filas que lo forman.
+    """
+    faltan = [c for c in OBLIGATORIAS if c not in df.columns]
+    if faltan:
+        return [], [f"Faltan columnas obligatorias: {', '.join(faltan)}"]
+    df = df.copy()
+    for columna in ENTEROS + ['Metros Tela (mts)', 'Celular Adicional', 'Colegio', 'Descripción',
+                         'Talla Camisa', 'Medio Pago', 'Entrega Tela']:
+        if columna not in df.columns:
+            df[columna] = ""
+    if colegio:
+        df['Colegio'] = df['Colegio'].where(df['Colegio'] != "", colegio)
+
+    errores = []
+    for columna in ENTEROS + ['Metros Tela (mts)']:
+        numeros = pd.to_numeric(df[columna].where(df[columna] != ""), errors='coerce')
+        malos = numeros.isna() & (df[columna] != "") | (numeros < 0)
+        if columna in ENTEROS:
+            malos |= numeros.notna() & (numeros % 1 != 0)
+        errores += [f"Fila {fila}: '{columna}' = {df.at[fila, columna]!r} no es válido" for fila in df.index[malos]]
+        df[columna] = numeros.fillna(0)
+
+    df['Tipo'] = df['Tipo'].map(_tipo).fillna("")
+    df['Talla Camisa'] = df['Talla Camisa'].str.upper()
+    for fila, linea in df.iterrows():
+        for columna in OBLIGATORIAS:
+            if linea[columna] in ("", None):
+                errores.append(f"Fila {fila}: falta {columna if columna != 'Tipo' else 'Tipo (Niño/Niña)'}")
+        if linea['Camisas'] == 0 and linea['Pantalones'] == 0:
+            errores.append(f"Fila {fila}: sin camisas ni pantalones")
+        if linea['Camisas'] > 0 and linea['Talla Camisa'] not in TALLAS:
+            errores.append(f"Fila {fila}: talla '{linea['Talla Camisa']}' no existe ({', '.join(TALLAS)})")
+        if linea['Pantalones'] > 0 and linea['Tipo'] == "Niña":
+            errores.append(f"Fila {fila}: el pantalón solo se vende para niño")
+        if linea['Pantalones'] > 0 and linea['Largo Pant (cm)'] == 0:
+            errores.append(f"Fila {fila}: falta Largo Pant (cm)")
+    if errores:
+        return [], errores
+
+    llave = ['Pedido'] if 'Pedido' in df.columns else ['Cliente', 'Celular Principal']
+    grupos = df.groupby(llave, sort=False).ngroup()
+    df['Tipo Detalle'] = df['Tipo'] + " " + (df.groupby([grupos, 'Tipo']).cumcount() + 1).astype(str)
+    df['Talla Camisa'] = df['Talla Camisa'].where(df['Camisas'] > 0, "4")  # como el formulario
+    df['Item'] = items_pedido(df, config)
+
+    clientes = df.groupby(grupos)[['Cliente', 'Celular Principal', 'Celular Adicional',
+                                   'Colegio', 'Descripción']].first().to_dict('index')
+    medios = {m.lower(): m for m in MEDIOS_PAGO}
+    recibido = _primeros(df, grupos, 'Valor Recibido')
+    medio_pago = _primeros(df, grupos, 'Medio Pago').str.lower().map(medios).fillna("")
+    entrega_tela = _primeros(df, grupos, 'Entrega Tela').str.lower().isin(["si", "sí"])
+    metros_tela = _primeros(df, grupos, 'Metros Tela (mts)')
+
+    pedidos = []
+    for numero, grupo in df.groupby(grupos, sort=False):
+        pedido = {
+            'cliente': clientes[numero],
+            'ninos': [i for i in grupo['Item'] if i['Tipo_Visual'].startswith("Niño")],
+            'ninas': [i for i in grupo['Item'] if i['Tipo_Visual'].startswith("Niña")],
+            'recibido': int(recibido[numero] or 0),
+            'medio_pago': medio_pago[numero],
+            'entrega_tela': "Si" if entrega_tela[numero] else "No",
+            'metros_tela': float(metros_tela[numero] or 0),
+            'filas': list(grupo.index),
+        }
+        total = sum(i['Subtotal'] for i in pedido['ninos'] + pedido['ninas'])
+        errores_venta = validar_venta(pedido['cliente']['Cliente'], pedido['cliente']['Celular Principal'],
+                                      total, pedido['recibido'], pedido['medio_pago'])
+        if pedido['recibido'] > total:  # en un lote nadie ve la advertencia del formulario
+            errores_venta.append("Valor recibido mayor al total")
+        for error in errores_venta:
+            errores.append(f"Filas {', '.join(map(str, pedido['filas']))} ({pedido['cliente']['Cliente']}): {error}")
+        pedidos.append(pedido)
+    return pedidos, errores
+
+
+def guardar_pedidos(pedidos, fecha=None, descripcion=None):
+    """Guarda los pedidos en una sola escritura de la cola; devuelve los IDs de venta asignados."""
+    fecha = fecha or datetime.now(ZONA_HORARIA)
+    texto_fecha = fecha.strftime("%Y-%m-%d %H:%M")
+    ids = nuevos_ids_venta(fecha, len(pedidos))
+    filas = []
+    for id_venta, pedido in zip(ids, pedidos):
+        filas += filas_venta(id_venta, texto_fecha, pedido['cliente'], pedido['ninos'], pedido['ninas'],
+                             pedido['recibido'], pedido['medio_pago'], pedido['entrega_tela'], pedido['metros_tela'])
+    ticket = encolar('insertar', filas, descripcion or f"{len(pedidos)} ventas guardadas")
+    ticket.esperar()
+    if ticket.error is not None:
+        raise ticket.error
+    return ids
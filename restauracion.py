@@ -0,0 +1,193 @@
+"""Restauración validada de respaldos en Excel.
+
+El libro se lee con openpyxl en modo read_only, de a FILAS_POR_BLOQUE
+filas, así que un respaldo grande nunca se carga completo en memoria. Se
+restaura en dos pasadas sobre el mismo archivo:
+
+1. previsualizar: verifica las columnas contra ESQUEMA_VENTAS, convierte
+   cada valor al tipo de su columna y devuelve conteos, totales, errores y
+   una suma de verificación del contenido ya normalizado.
+2. restaurar: vuelve a leer el archivo y lo aplica en una sola transacción
+   (reemplazar todo, actualizar por ID o agregar solo ventas nuevas). Si la
+   suma no coincide con la de la vista previa o algo falla a mitad de
+   camino, la transacción se deshace y la base queda como estaba.
+"""
+import hashlib
+from datetime import date, datetime
+
+import pandas as pd
+from openpyxl import load_workbook
+
+import almacenamiento
+from almacenamiento import COLUMNAS_VENTA, ESQUEMA_VENTAS
+
+FILAS_POR_BLOQUE = 5000
+MAX_ERRORES = 20  # errores que se muestran; el resto solo se cuenta
+OBLIGATORIAS = ['ID', 'Cliente', 'Tipo Detalle', 'Subtotal niño(a)',
+                'Pagado (Distribuido)', 'Saldo Pendiente (Distribuido)']
+MODOS = {
+    'reemplazar': "Reemplazar toda la base",
+    'actualizar': "Actualizar por ID (reemplaza las ventas que trae el archivo)",
+    'agregar': "Agregar solo ventas nuevas",
+}
+
+
+class RespaldoInvalido(Exception):
+    def __init__(self, errores):
+        self.errores = errores
+        super().__init__("; ".join(errores[:3]))
+
+
+def _hoja_ventas(libro):
+    return libro['Ventas'] if 'Ventas' in libro.sheetnames else libro.worksheets[0]
+
+
+def _leer(archivo, filas_por_bloque):
+    """Encabezado y bloques de filas crudas (índice = número de fila en Excel)."""
+    if hasattr(archivo, 'seek'):
+        archivo.seek(0)
+    libro = load_workbook(archivo, read_only=True, data_only=True)
+    try:
+        filas = _hoja_ventas(libro).iter_rows(values_only=True)
+        encabezado = [str(c).strip() if c is not None else None for c in next(filas, ())]
+        yield encabezado
+        bloque, numeros = [], []
+        for numero, fila in enumerate(filas, start=2):
+            if all(v is None or v == '' for v in fila):
+                continue
+            # read_only corta las celdas vacías al final de la fila
+            bloque.append((tuple(fila) + (None,) * len(encabezado))[:len(encabezado)])
+            numeros.append(numero)
+            if len(bloque) == filas_por_bloque:
+                yield pd.DataFrame(bloque, index=numeros, columns=encabezado, dtype=object)
+                bloque, numeros = [], []
+        if bloque:
+            yield pd.DataFrame(bloque, index=numeros, columns=encabezado, dtype=object)
+    finally:
+        libro.close()
+
+
+def verificar_columnas(encabezado):
+    """(errores, avisos) del encabezado frente a las columnas de guardar_venta."""
+    errores, avisos = [], []
+    nombres = [c for c in encabezado if c]
+    repetidas = sorted({c for c in nombres if nombres.count(c) > 1})
+    if repetidas:
+        errores.append(f"Columnas repetidas: {', '.join(repetidas)}")
+    faltan = [c for c in OBLIGATORIAS if c not in nombres]
+    if faltan:
+        errores.append(f"Faltan columnas obligatorias: {', '.join(faltan)}")
+    vacias = [c for c in COLUMNAS_VENTA if c not in nombres and c not in OBLIGATORIAS]
+    if vacias:
+        avisos.append(f"Columnas ausentes (quedan vacías): {', '.join(vacias)}")
+    extras = [c for c in nombres if c not in ESQUEMA_VENTAS]
+    if extras:
+        avisos.append(f"Columnas que no se restauran: {', '.join(extras)}")
+    return errores, avisos
+
+
+def _texto(valor):
+    if valor is None or valor == '':
+        return None
+    if isinstance(valor, float) and valor.is_integer():
+        valor = int(valor)  # IDs y celulares guardados como número
+    if isinstance(valor, datetime):
+        return valor.strftime('%Y-%m-%d %H:%M')
+    if isinstance(valor, date):
+        return valor.strftime('%Y-%m-%d')
+    return str(valor)
+
+
+def convertir_bloque(crudo, errores):
+    """Bloque con las columnas de la venta en su tipo; agrega a errores lo que no convierte."""
+    bloque = pd.DataFrame(index=crudo.index)
+    for columna, afinidad in ESQUEMA_VENTAS.items():
+        valores = crudo[columna] if columna in crudo.columns else pd.Series(None, index=crudo.index, dtype=object)
+        if afinidad == 'TEXT':
+            bloque[columna] = valores.map(_texto).astype(object)
+            continue
+        vacios = valores.isna() | (valores == '')
+        numeros = pd.to_numeric(valores.where(~vacios), errors='coerce')
+        for fila in valores.index[numeros.isna() & ~vacios]:
+            errores.append(f"Fila {fila}: '{columna}' = {valores[fila]!r} no es un número")
+        bloque[columna] = numeros.round().astype('Int64') if afinidad == 'INTEGER' else numeros.astype(float)
+    bloque['ID'] = bloque['ID'].str.strip()
+    for fila in bloque.index[bloque['ID'].isna() | (bloque['ID'] == '')]:
+        errores.append(f"Fila {fila}: falta el ID")
+    return bloque
+
+
+def bloques_validados(archivo, filas_por_bloque=FILAS_POR_BLOQUE):
+    """Encabezado verificado y luego los bloques convertidos, con la suma acumulada.
+
+    Cada elemento es (bloque, errores_del_bloque, hash); el hash acumulado
+    cubre todos los bloques entregados hasta ese momento.
+    """
+    lectura = _leer(archivo, filas_por_bloque)
+    encabezado = next(lectura)
+    errores, avisos = verificar_columnas(encabezado)
+    yield errores, avisos
+    if errores:
+        return
+    suma = hashlib.sha256()
+    for crudo in lectura:
+        errores_bloque = []
+        bloque = convertir_bloque(crudo, errores_bloque)
+        suma.update(pd.util.hash_pandas_object(bloque, index=False).to_numpy().tobytes())
+        yield bloque, errores_bloque, suma
+
+
+def previsualizar(archivo, filas_por_bloque=FILAS_POR_BLOQUE):
+    """Primera pasada: conteos, totales, suma de verificación y errores, sin escribir nada."""
+    pasada = bloques_validados(archivo, filas_por_bloque)
+    errores, avisos = next(pasada)
+    resumen = {'filas': 0, 'ventas': 0, 'nuevas': 0, 'existentes': 0, 'total': 0, 'pagado': 0, 'saldo': 0,
+               'checksum': None, 'errores': errores, 'n_errores': len(errores), 'avisos': avisos}
+    actuales = almacenamiento.cargar_datos(historial=True)
+    ids_actuales = set(actuales['ID'].astype(str)) if not actuales.empty else set()
+    ids = set()
+    suma = hashlib.sha256()
+    for bloque, errores_bloque, suma in pasada:
+        resumen['n_errores'] += len(errores_bloque)
+        errores.extend(errores_bloque[:MAX_ERRORES - len(errores)])
+        resumen['filas'] += len(bloque)
+        resumen['total'] += int(bloque['Subtotal niño(a)'].sum())
+        resumen['pagado'] += int(bloque['Pagado (Distribuido)'].sum())
+        resumen['saldo'] += int(bloque['Saldo Pendiente (Distribuido)'].sum())
+        ids.update(bloque['ID'].dropna())
+    if not resumen['n_errores'] and resumen['filas'] == 0:
+        errores.append("El archivo no tiene filas de ventas.")
+        resumen['n_errores'] = 1
+    resumen['ventas'] = len(ids)
+    resumen['existentes'] = len(ids & ids_actuales)
+    resumen['nuevas'] = len(ids) - resumen['existentes']
+    resumen['filas_actuales'] = len(actuales)
+    if not resumen['n_errores']:
+        resumen['checksum'] = suma.hexdigest()
+    return resumen
+
+
+def restaurar(archivo, modo, checksum, filas_por_bloque=FILAS_POR_BLOQUE):
+    """Segunda pasada: aplica el archivo si su contenido es el de la vista previa.
+
+    Lanza RespaldoInvalido (sin tocar la base) si el archivo ya no valida o
+    su suma de verificación cambió.
+    """
+    if modo not in MODOS:
+        raise ValueError(f"Modo de restauración desconocido: {modo}")
+
+    def bloques():
+        pasada = bloques_validados(archivo, filas_por_bloque)
+        errores, _ = next(pasada)
+        if errores:
+            raise RespaldoInvalido(errores)
+        suma = hashlib.sha256()
+        for bloque, errores_bloque, suma in pasada:
+            if errores_bloque:
+                raise RespaldoInvalido(errores_bloque)
+            yield bloque
+        # Se verifica dentro de la transacción: si no coincide no queda nada escrito.
+        if suma.hexdigest() != checksum:
+            raise RespaldoInvalido(["El archivo cambió desde la vista previa; vuelva a validarlo."])
+
+    return almacenamiento.restaurar_db(bloques(), modo)
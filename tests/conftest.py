@@ -0,0 +1,33 @@
+"""Cada prueba corre en un directorio propio: base, espejo, archivo y exportaciones usan rutas relativas."""
+import pytest
+
+import almacenamiento
+import benchmark
+from cola_escritura import detener_escritor
+
+
+def _reiniciar():
+    if almacenamiento._almacen is not None and hasattr(almacenamiento._almacen, 'cerrar_conexiones'):
+        almacenamiento._almacen.cerrar_conexiones()
+    almacenamiento._almacen = None
+    almacenamiento.invalidar_cache()
+
+
+@pytest.fixture(params=['sqlite'])
+def base(request, tmp_path, monkeypatch):
+    """Base vacía; SQLite salvo que la prueba pida otro backend (parametrize indirect)."""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(almacenamiento, 'BACKEND', request.param)
+    _reiniciar()
+    yield almacenamiento.obtener_almacen()
+    # Aplica lo encolado y termina el hilo antes de volver al directorio anterior:
+    # su mantenimiento usa rutas relativas.
+    assert detener_escritor(timeout=30)
+    _reiniciar()
+
+
+@pytest.fixture
+def ventas(base):
+    """Base con ventas sintéticas; devuelve el DataFrame cargado."""
+    almacenamiento.reemplazar_db(benchmark.generar_ventas(300))
+    return almacenamiento.cargar_datos()
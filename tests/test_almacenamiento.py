@@ -0,0 +1,110 @@
+import multiprocessing
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import almacenamiento
+import benchmark
+from almacenamiento import ConflictoVersion
+from tests.utiles import assert_mismas_ventas, carga_fresca
+
+
+def _venta(fecha="2026-10-18 10:00"):
+    return benchmark._venta_nueva(np.random.default_rng(7), pd.Timestamp(fecha))
+
+
+@pytest.mark.parametrize('base', ['sqlite', 'excel'], indirect=True)
+def test_cache_igual_a_carga_fresca_tras_escrituras(ventas):
+    almacenamiento.guardar_venta(_venta())
+    pd.testing.assert_frame_equal(almacenamiento.cargar_datos(), carga_fresca())
+
+    df = almacenamiento.cargar_datos()
+    filas = df[df['ID'] == df['ID'].iloc[5]].copy()
+    filas['Cliente'] = "Cliente Editado"
+    filas['Pagado (Distribuido)'] = filas['Subtotal niño(a)']
+    filas['Saldo Pendiente (Distribuido)'] = 0
+    almacenamiento.actualizar_db(filas)
+    pd.testing.assert_frame_equal(almacenamiento.cargar_datos(), carga_fresca())
+
+    almacenamiento.eliminar_venta(df['ID'].iloc[10])
+    pd.testing.assert_frame_equal(almacenamiento.cargar_datos(), carga_fresca())
+
+
+def test_edicion_con_version_vieja_se_rechaza(ventas):
+    id_venta = ventas['ID'].iloc[0]
+    version = almacenamiento.version_venta(id_venta)
+    filas = ventas[ventas['ID'] == id_venta].copy()
+    filas['Cliente'] = "Primera sesión"
+    almacenamiento.actualizar_db(filas, {id_venta: version})
+
+    antes = almacenamiento.cargar_datos()
+    filas['Cliente'] = "Segunda sesión"
+    with pytest.raises(ConflictoVersion):
+        almacenamiento.actualizar_db(filas, {id_venta: version})
+    with pytest.raises(ConflictoVersion):
+        almacenamiento.eliminar_venta(id_venta, version)
+    # Rechazada antes de escribir: la caché se conserva y no cambió nada.
+    assert almacenamiento.cargar_datos() is antes
+    assert set(carga_fresca().loc[lambda d: d['ID'] == id_venta, 'Cliente']) == {"Primera sesión"}
+
+
+def test_historial_une_activas_y_archivadas(ventas):
+    movidos = almacenamiento.archivar_liquidadas(0)
+    assert movidos
+    activas = almacenamiento.cargar_datos()
+    historial = almacenamiento.cargar_datos(historial=True)
+    assert not activas['ID'].isin(movidos).any()
+    assert set(historial['ID']) == set(ventas['ID'])
+    pd.testing.assert_frame_equal(historial, carga_fresca(historial=True))
+
+
+def test_escribir_no_reescribe_el_espejo(ventas):
+    ruta = almacenamiento.ARCHIVO_ESPEJO
+    almacenamiento.actualizar_espejo()
+    escrito = os.stat(ruta).st_mtime_ns
+    almacenamiento.guardar_venta(_venta())
+    assert os.stat(ruta).st_mtime_ns == escrito
+    assert almacenamiento.espejo_pendiente()
+
+    almacenamiento.actualizar_espejo()
+    assert not almacenamiento.espejo_pendiente()
+    escrito = os.stat(ruta).st_mtime_ns
+    almacenamiento.actualizar_espejo()  # misma versión: no se vuelve a escribir
+    assert os.stat(ruta).st_mtime_ns == escrito
+
+    cache = almacenamiento.cargar_datos()
+    almacenamiento.invalidar_cache()
+    assert_mismas_ventas(almacenamiento.cargar_datos(), cache)
+    assert not almacenamiento.espejo_pendiente()  # se cargó del espejo
+
+
+def test_tallas_numericas_del_excel_se_leen_como_texto():
+    df = almacenamiento.aplicar_tipos(pd.DataFrame({'Talla Camisa': [8, 10.0, "M", None], 'Colegio': [1, "NCP", None, 1]}))
+    assert df['Talla Camisa'].astype(object).tolist()[:3] == ["8", "10", "M"]
+    assert list(df['Talla Camisa'].cat.categories) == almacenamiento.CATEGORIAS_VENTA['Talla Camisa']
+    assert list(df['Colegio'].cat.categories) == ["1", "NCP"]
+
+
+def _reservar_en_otro_proceso(directorio, backend):
+    os.chdir(directorio)
+    almacenamiento.BACKEND = backend
+    fecha = pd.Timestamp("2026-10-18 10:00")
+    ids = []
+    for _ in range(10):
+        ids.append(almacenamiento.nuevo_id_venta(fecha))
+        ids += almacenamiento.nuevos_ids_venta(fecha, 3)
+    return ids
+
+
+@pytest.mark.parametrize('base', ['sqlite', 'excel'], indirect=True)
+def test_ids_unicos_entre_procesos(ventas, tmp_path):
+    ventas = ventas.copy()
+    ventas.loc[ventas['ID'] == ventas['ID'].iloc[0], 'ID'] = "20261018-0007"  # p.ej. un respaldo restaurado
+    almacenamiento.reemplazar_db(ventas)
+    with multiprocessing.get_context('spawn').Pool(4) as procesos:
+        por_proceso = procesos.starmap(_reservar_en_otro_proceso, [(str(tmp_path), almacenamiento.BACKEND)] * 4)
+    ids = sorted(i for lista in por_proceso for i in lista)
+    assert ids == [f"20261018-{n:04d}" for n in range(8, 8 + 4 * 40)]
+    assert all(lista == sorted(lista) for lista in por_proceso)
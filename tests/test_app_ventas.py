@@ -0,0 +1,37 @@
+from pathlib import Path
+
+import numpy as np
+from streamlit.testing.v1 import AppTest
+
+APP = str(Path(__file__).resolve().parents[1] / "app_ventas.py")
+
+
+def _por_etiqueta(elementos, etiqueta):
+    return next(e for e in elementos if e.label.startswith(etiqueta))
+
+
+def test_grilla_ordena_y_pagina_en_el_servidor(ventas):
+    at = AppTest.from_file(APP, default_timeout=60).run()
+    at.radio[0].set_value("Buscar / Editar Ventas").run()
+    _por_etiqueta(at.selectbox, "Filas por página").set_value(25)
+    _por_etiqueta(at.selectbox, "Ordenar por").set_value('Saldo Pendiente (Distribuido)')
+    _por_etiqueta(at.checkbox, "Descendente").check()
+    at.run()
+    at.number_input(key="pagina_resultados").set_value(2).run()
+    assert not at.exception
+
+    pagina = at.dataframe[0].value
+    saldos = np.sort(ventas['Saldo Pendiente (Distribuido)'].to_numpy(dtype=float))[::-1]
+    assert len(pagina) == 25
+    np.testing.assert_array_equal(pagina['Saldo Pendiente (Distribuido)'].to_numpy(dtype=float), saldos[25:50])
+    assert f"Mostrando 25 de {len(ventas)} registros." in [c.value for c in at.caption]
+
+
+def test_panel_de_tiempos_muestra_los_spans_del_rerun(ventas):
+    at = AppTest.from_file(APP, default_timeout=60).run()
+    at.radio[0].set_value("Buscar / Editar Ventas")
+    at.sidebar.checkbox(key="panel_tiempos").check().run()
+    assert not at.exception
+    este_rerun, ventana = at.sidebar.dataframe[-2].value, at.sidebar.dataframe[-1].value
+    assert {'cargar_config', 'cargar_datos', 'filtrar', 'render_tabla'} <= set(este_rerun['span'])
+    assert set(este_rerun['span']) <= set(ventana['Span'])
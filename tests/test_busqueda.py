@@ -0,0 +1,62 @@
+import numpy as np
+import pandas as pd
+
+import almacenamiento
+import benchmark
+import busqueda
+from busqueda import COLUMNAS_BUSQUEDA, buscar, normalizar, normalizar_serie
+
+CONSULTAS = ["", "a", "pe", "PÉR", "jose", "300", "ncp", "zzz"]
+
+
+def _recorriendo(df, columna, consulta):
+    """Lo que devuelve buscar, recorriendo la columna fila por fila."""
+    return np.flatnonzero(normalizar_serie(df[columna]).str.contains(normalizar(consulta), regex=False).to_numpy())
+
+
+def _assert_igual_a_recorrer(df):
+    for columna in COLUMNAS_BUSQUEDA:
+        for consulta in CONSULTAS:
+            np.testing.assert_array_equal(np.sort(buscar(df, columna, consulta)), _recorriendo(df, columna, consulta),
+                                          err_msg=f"{columna}: {consulta!r}")
+
+
+def test_normalizar():
+    assert normalizar(" José PEÑA ") == "jose pena"
+    assert normalizar(None) == normalizar(float('nan')) == ""
+    serie = pd.Series(["José Peña", None, "ÁRBOL"])
+    assert normalizar_serie(serie).tolist() == ["jose pena", "", "arbol"]
+
+
+def test_indice_incremental_igual_a_recorrer(ventas):
+    _assert_igual_a_recorrer(ventas)
+    indice = busqueda.obtener_indice(ventas)
+
+    rng = np.random.default_rng(8)
+    for minuto in range(3):
+        almacenamiento.guardar_venta(benchmark._venta_nueva(rng, pd.Timestamp(f"2026-10-18 10:0{minuto}")))
+    df = almacenamiento.cargar_datos()
+    ids = df['ID'].unique()
+    filas = df[df['ID'] == ids[0]].copy()
+    filas['Cliente'] = "Josefina Pérez"
+    filas['Nombre Alumno'] = "Zoe"
+    almacenamiento.actualizar_db(filas)
+    almacenamiento.eliminar_venta(ids[1])
+
+    df = almacenamiento.cargar_datos()
+    assert busqueda.obtener_indice(df) is indice  # mantenido, no reconstruido
+    _assert_igual_a_recorrer(df)
+    assert set(df['ID'].iloc[buscar(df, 'Cliente', "josefina")]) == {ids[0]}
+
+
+def test_columna_desgastada_se_reindexa(ventas, monkeypatch):
+    monkeypatch.setattr(busqueda, '_MUERTOS_MINIMO', 5)
+    monkeypatch.setattr(busqueda, '_MUERTOS_FRACCION', 0.05)
+    _assert_igual_a_recorrer(ventas)
+    indice = busqueda.obtener_indice(ventas)
+    for id_venta in ventas['ID'].unique()[:40]:
+        almacenamiento.eliminar_venta(id_venta)
+    df = almacenamiento.cargar_datos()
+    assert busqueda.obtener_indice(df) is indice
+    assert set(indice._indices) < set(COLUMNAS_BUSQUEDA)  # alguna columna se descartó para reindexarla
+    _assert_igual_a_recorrer(df)
@@ -0,0 +1,126 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import agregados
+import almacenamiento
+import benchmark
+import calculos
+from agregados import TALLAS_ORDEN, AgregadosPostVenta, ListaCorte
+from almacenamiento import aplicar_tipos
+from calculos import asignar_cascada, filas_tela_pendiente, filas_ventas_abiertas
+
+
+def _cascada_con_bucle(capacidades, monto):
+    """El abono como lo repartía la app antes de asignar_cascada, fila por fila."""
+    asignado = np.zeros(len(capacidades))
+    restante = monto
+    for i, saldo in enumerate(capacidades):
+        if restante <= 0:
+            break
+        if saldo > 0:
+            asignado[i] = min(saldo, restante)
+            restante -= asignado[i]
+    return asignado, max(restante, 0)
+
+
+@pytest.mark.parametrize('semilla', range(5))
+def test_cascada_igual_al_bucle(semilla):
+    rng = np.random.default_rng(semilla)
+    capacidades = rng.choice([0, 15000, 38000, 52000, -2000], size=12).astype(float)
+    for monto in [0, 1000, 60000, capacidades.clip(0).sum(), 10 ** 6]:
+        asignado, sobrante = asignar_cascada(capacidades, monto)
+        esperado, sobrante_esperado = _cascada_con_bucle(capacidades, monto)
+        np.testing.assert_array_equal(asignado, esperado)
+        assert sobrante == sobrante_esperado
+
+
+def test_cascada_por_grupos_igual_al_bucle():
+    rng = np.random.default_rng(3)
+    grupos = np.sort(rng.choice(['A', 'B', 'C', 'D'], size=40))
+    capacidades = rng.choice([0, 15000, 38000, 52000], size=40).astype(float)
+    montos = {'A': 70000, 'B': 0, 'C': 10 ** 7, 'E': 5000}  # D sin pago, E sin filas
+    asignado, sobrante = asignar_cascada(capacidades, montos, grupos)
+    for grupo, monto in montos.items():
+        filas = grupos == grupo
+        esperado, sobrante_esperado = _cascada_con_bucle(capacidades[filas], monto)
+        np.testing.assert_array_equal(asignado[filas], esperado)
+        assert sobrante[grupo] == sobrante_esperado
+    assert (asignado[grupos == 'D'] == 0).all()
+
+
+@pytest.mark.parametrize('talla', [None] + TALLAS_ORDEN[:4])
+def test_agregados_igual_a_resumen_por_filas(talla):
+    df = aplicar_tipos(benchmark.generar_ventas(2000))
+    esperado = calculos.resumen_post_venta(df, talla)
+    resumen = AgregadosPostVenta(df).resumen(talla)
+    assert resumen.keys() == esperado.keys()
+    for clave, valor in esperado.items():
+        assert resumen[clave] == pytest.approx(valor, abs=1e-6), clave
+        if clave in ('camisas_nino', 'camisas_nina', 'pantalones', 'venta_total', 'pendiente'):
+            assert type(resumen[clave]) is int
+
+
+def test_agregados_incrementales_igual_a_reconstruir():
+    df = aplicar_tipos(benchmark.generar_ventas(500))
+    agregados = AgregadosPostVenta(df)
+    cambiadas = df.iloc[:50].copy()
+    cambiadas['Pantalones'] += 1
+    cambiadas['Saldo Pendiente (Distribuido)'] = 0
+    nuevo = df.copy()
+    nuevo.loc[cambiadas.index] = cambiadas
+    agregados.aplicar('actualizar', df, nuevo, cambiadas)
+    sin_ultimas = nuevo.iloc[:-30]
+    agregados.aplicar('eliminar', nuevo, sin_ultimas, nuevo.iloc[-30:])
+    for talla in [None] + TALLAS_ORDEN:
+        assert agregados.resumen(talla) == pytest.approx(calculos.resumen_post_venta(sin_ultimas, talla)), talla
+
+
+def test_tela_por_entregar_se_calcula_por_venta():
+    df = aplicar_tipos(benchmark.generar_ventas(200))
+    df['Entrega Tela'] = "No"
+    df['Tela Sugerida (mts)'] = 0.0
+    df['Metros Tela (mts)'] = 0.0
+    a, b = df['ID'].unique()[:2]
+    df.loc[df['ID'] == a, 'Tela Sugerida (mts)'] = 1.0 / (df['ID'] == a).sum()
+    df.loc[df['ID'] == b, 'Tela Sugerida (mts)'] = 2.0 / (df['ID'] == b).sum()
+    df.loc[(df['ID'] == a).idxmax(), 'Metros Tela (mts)'] = 3.0  # le sobran 2 m, a b le faltan 2 m
+    assert ListaCorte(df).tela() == {'sugerida': 3.0, 'entregada': 3.0, 'pendiente': 2.0}
+
+
+@pytest.mark.parametrize('base', ['sqlite', 'excel'], indirect=True)
+def test_lista_corte_incremental_igual_a_reconstruir(ventas):
+    agregados.obtener_lista_corte(ventas)
+    df = ventas
+    abiertas = df.loc[filas_ventas_abiertas(df), 'ID'].unique()
+    a_cerrar = next(i for i in abiertas if not (df.loc[df['ID'] == i, 'Entrega Tela'] == "No").any())
+    saldo = int(df.loc[df['ID'] == a_cerrar, 'Saldo Pendiente (Distribuido)'].sum())
+    pagos = [{'ID': a_cerrar, 'Valor': saldo, 'Fecha': "2026-10-18 11:00"}]
+    almacenamiento.actualizar_fusionando([a_cerrar], lambda d: calculos.aplicar_pagos(d, pagos)[0],
+                                         evento=('pago', {a_cerrar: {'pagos': pagos}}))
+    sin_tela = df.loc[filas_tela_pendiente(df), 'ID'].unique()[:3]
+    entregas = [{'ID': i, 'Metros': 0.7, 'Fecha': "2026-10-18 11:05"} for i in sin_tela]
+    almacenamiento.actualizar_fusionando(list(sin_tela), lambda d: calculos.aplicar_telas(d, entregas),
+                                         evento=('tela', {i: {'entregas': []} for i in sin_tela}))
+    almacenamiento.guardar_venta(benchmark._venta_nueva(np.random.default_rng(9), pd.Timestamp("2026-10-18 12:00")))
+    almacenamiento.eliminar_venta(abiertas[-1])
+
+    df = almacenamiento.cargar_datos()
+    corte, esperado = agregados.obtener_lista_corte(df), ListaCorte(df)
+    assert corte is not esperado and a_cerrar not in esperado.tela_ventas.index.get_level_values('ID')
+    assert corte.colegios() == esperado.colegios()
+    for colegio in [None] + esperado.colegios():
+        pd.testing.assert_frame_equal(corte.camisas(colegio), esperado.camisas(colegio))
+        pd.testing.assert_frame_equal(corte.pantalones(colegio), esperado.pantalones(colegio))
+        assert corte.tela(colegio) == pytest.approx(esperado.tela(colegio)), colegio
+
+
+def test_filas_pendientes_igual_al_color_por_fila():
+    df = aplicar_tipos(benchmark.generar_ventas(300))
+
+    def roja(fila):  # la regla con que la grilla coloreaba cada fila
+        return fila['Saldo Pendiente (Distribuido)'] > 0 or (fila['Entrega Tela'] == 'No' and fila['Pantalones'] > 0)
+
+    esperado = [bool(roja(fila)) for _, fila in df.fillna({'Pantalones': 0}).iterrows()]
+    assert calculos.filas_pendientes(df).tolist() == esperado
+    assert 0 < sum(esperado) < len(df)
@@ -0,0 +1,91 @@
+from contextlib import closing
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import almacenamiento
+import benchmark
+import cola_escritura
+import diario
+from calculos import filas_tela_pendiente
+from cola_escritura import EscritorFondo, Ticket, encolar, esperar_escrituras
+from tests.utiles import assert_mismas_ventas
+
+
+def _pago(id_venta, valor):
+    return [{'ID': id_venta, 'Valor': valor, 'Fecha': "2026-10-18 10:00"}]
+
+
+def _saldos(ids):
+    df = almacenamiento.cargar_datos()
+    return df[df['ID'].isin(ids)].groupby('ID', observed=True)['Saldo Pendiente (Distribuido)'].sum()
+
+
+def test_un_pago_malo_no_descarta_los_demas_del_grupo(ventas):
+    con_saldo = _saldos(ventas['ID'].unique())
+    a, b = con_saldo[con_saldo > 20000].index[:2]
+    grupo = [(None, _pago(a, 10000), Ticket('pagos', "a")),
+             (None, _pago('NO-EXISTE', "mucho"), Ticket('pagos', "malo")),
+             (None, _pago(b, 5000), Ticket('pagos', "b"))]
+    EscritorFondo()._aplicar_grupo('pagos', grupo)
+
+    tickets = [ticket for _, _, ticket in grupo]
+    assert all(ticket.listo for ticket in tickets)
+    assert tickets[0].error is None and tickets[2].error is None
+    assert tickets[1].error is not None
+    despues = _saldos([a, b])
+    assert despues[a] == con_saldo[a] - 10000
+    assert despues[b] == con_saldo[b] - 5000
+
+
+def test_rafaga_de_pagos_se_aplica_y_sale_de_la_cola(ventas, base):
+    con_saldo = _saldos(ventas['ID'].unique())
+    ids = list(con_saldo[con_saldo > 1000].index[:20])
+    tickets = [encolar('pagos', _pago(i, 1000)) for i in ids]
+    tickets.append(encolar('pagos', _pago(ids[0], "mucho")))
+    assert esperar_escrituras(timeout=30)
+    assert all(ticket.error is None for ticket in tickets[:-1])
+    assert tickets[-1].error is not None
+    pd.testing.assert_series_equal(_saldos(ids), con_saldo[ids] - 1000, check_names=False)
+    with closing(base._conectar()) as con:
+        assert con.execute("SELECT COUNT(*) FROM cola").fetchone()[0] == 0
+
+
+def test_lo_encolado_se_ve_antes_de_aplicarse(ventas, monkeypatch):
+    escritor = EscritorFondo()
+    con_saldo = _saldos(ventas['ID'].unique())
+    a, b = con_saldo[con_saldo > 20000].index[:2]
+    filas = ventas[ventas['ID'] == a].copy()
+    filas['Cliente'] = "Cliente Editado"
+    nueva = benchmark._venta_nueva(np.random.default_rng(3), pd.Timestamp("2026-10-18 10:00"))
+    with monkeypatch.context() as m:
+        m.setattr(cola_escritura, '_escritor', escritor)
+        m.setattr(escritor, '_arrancar', lambda: None)  # sin hilo escritor: nada se aplica
+        tickets = [encolar('insertar', nueva), encolar('pagos', _pago(a, 10000)),
+                   cola_escritura.encolar_actualizacion(filas[['Cliente']]),
+                   encolar('pagos', _pago(a, "mucho")), encolar('eliminar', {'id': b, 'version': None})]
+        vista = cola_escritura.cargar_datos(tickets=tickets)
+        assert not any(ticket.listo for ticket in tickets)
+    assert_mismas_ventas(almacenamiento.cargar_datos(), ventas)
+    assert b not in set(vista['ID'])
+    assert (vista.loc[vista['ID'] == a, 'Cliente'] == "Cliente Editado").all()
+
+    assert escritor.esperar(timeout=30) and escritor.detener(timeout=30)
+    assert [ticket.error is None for ticket in tickets] == [True, True, True, False, True]
+    assert_mismas_ventas(almacenamiento.cargar_datos(historial=True), vista)  # el escritor también archiva
+
+
+@pytest.mark.parametrize('base', ['sqlite', 'excel'], indirect=True)
+def test_fechas_de_tela_sin_diario_se_acumulan(ventas, base):
+    id_venta = ventas.loc[filas_tela_pendiente(ventas), 'ID'].iloc[0]
+    for hora in ("10:00", "11:00"):  # dos entregas separadas: una ráfaga se combinaría en una
+        encolar('telas', [{'ID': id_venta, 'Metros': 0.3, 'Fecha': f"2026-10-18 {hora}"}])
+        assert esperar_escrituras(timeout=30)
+    df = almacenamiento.cargar_datos(historial=True)
+    fechas = df.loc[df['ID'] == id_venta, 'Fecha Entrega Nueva Tela'].dropna().iloc[0]
+    if hasattr(base, 'eventos'):
+        assert fechas == "2026-10-18 11:00 (+0.30mts)"
+        assert len(diario.movimientos(id_venta)) == 2
+    else:
+        assert fechas == "2026-10-18 10:00 (+0.30mts) | 2026-10-18 11:00 (+0.30mts)"
@@ -0,0 +1,54 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import almacenamiento
+import benchmark
+import diario
+from calculos import aplicar_pagos, aplicar_telas
+from tests.utiles import assert_mismas_ventas
+
+
+def _mezcla_de_escrituras(ventas):
+    rng = np.random.default_rng(11)
+    for minuto in range(3):
+        almacenamiento.guardar_venta(benchmark._venta_nueva(rng, pd.Timestamp(f"2026-10-18 10:0{minuto}")))
+    ids = list(ventas['ID'].unique()[:20])
+    pagos = [{'ID': i, 'Valor': 20000, 'Fecha': "2026-10-18 11:00"} for i in ids[:10]]
+    almacenamiento.actualizar_fusionando(ids[:10], lambda df: aplicar_pagos(df, pagos),
+                                         evento=('pago', {i: {'pagos': []} for i in ids[:10]}))
+    entregas = [{'ID': i, 'Metros': 1.5, 'Fecha': "2026-10-18 11:05"} for i in ids[10:15]]
+    almacenamiento.actualizar_fusionando(ids[10:15], lambda df: aplicar_telas(df, entregas),
+                                         evento=('tela', {i: {'entregas': []} for i in ids[10:15]}))
+    df = almacenamiento.cargar_datos()
+    filas = df[df['ID'] == ids[15]].copy()
+    filas['Cliente'] = "Cliente Editado"
+    almacenamiento.actualizar_db(filas)
+    almacenamiento.eliminar_venta(ids[16])
+    almacenamiento.archivar_liquidadas(0)
+
+
+def test_diario_cuadra_tras_escrituras(ventas):
+    _mezcla_de_escrituras(ventas)
+    assert diario.verificar() == []
+
+
+def test_instantanea_no_cambia_la_reconstruccion(ventas, base):
+    _mezcla_de_escrituras(ventas)
+    antes = diario.reconstruir()
+    assert base.guardar_instantanea() is not None
+    assert base.eventos_sin_instantanea() == 0
+    assert_mismas_ventas(diario.reconstruir(), antes)
+    assert diario.verificar() == []
+
+
+def test_se_conservan_las_ultimas_instantaneas(ventas, base, monkeypatch):
+    monkeypatch.setattr(almacenamiento, 'INSTANTANEAS_GUARDADAS', 2)
+    rng = np.random.default_rng(5)
+    primera = base.eventos()[0][0]
+    for minuto in range(4):
+        almacenamiento.guardar_venta(benchmark._venta_nueva(rng, pd.Timestamp(f"2026-10-18 12:0{minuto}")))
+        base.guardar_instantanea()
+    with pytest.raises(ValueError):
+        diario.reconstruir(primera)
+    assert diario.verificar() == []
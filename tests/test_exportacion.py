@@ -0,0 +1,41 @@
+import io
+import os
+
+import pandas as pd
+from openpyxl import load_workbook
+
+import almacenamiento
+import exportacion
+from tests.utiles import carga_fresca
+
+HOJAS = ['Ventas', 'Producción por Talla', 'Cartera', 'Corte Camisas', 'Corte Pantalones', 'Corte Tela']
+
+
+def test_libro_se_reutiliza_hasta_la_siguiente_escritura(ventas):
+    ruta = exportacion.ruta_exportacion()
+    creado = os.stat(ruta).st_mtime_ns
+    assert exportacion.ruta_exportacion() == ruta
+    assert os.stat(ruta).st_mtime_ns == creado
+
+    almacenamiento.eliminar_venta(ventas['ID'].iloc[0])
+    nueva = exportacion.ruta_exportacion()
+    assert nueva != ruta and not os.path.exists(ruta)
+    assert os.listdir(exportacion.DIRECTORIO) == [os.path.basename(nueva)]
+
+
+def test_hojas_del_libro(ventas):
+    almacenamiento.archivar_liquidadas(0)
+    historial = carga_fresca(historial=True)
+    libro = load_workbook(exportacion.ruta_exportacion(), read_only=True)
+    assert libro.sheetnames == HOJAS
+    hojas = pd.read_excel(exportacion.ruta_exportacion(), sheet_name=None)
+    assert len(hojas['Ventas']) == len(historial)  # también las archivadas: es el respaldo completo
+    saldos = historial.groupby('ID')['Saldo Pendiente (Distribuido)'].sum()
+    assert set(hojas['Cartera']['ID']) == set(saldos[saldos > 0].index)
+    assert hojas['Cartera']['Saldo'].sum() == saldos[saldos > 0].sum()
+    assert hojas['Producción por Talla']['Camisas'].sum() == historial['Camisas'].sum()
+
+
+def test_lista_corte_sola(ventas):
+    libro = load_workbook(io.BytesIO(exportacion.exportar_lista_corte()), read_only=True)
+    assert libro.sheetnames == HOJAS[3:]
@@ -0,0 +1,44 @@
+import numpy as np
+import pandas as pd
+
+import almacenamiento
+import benchmark
+from indices import IndicesVentas, obtener_indices
+
+
+def _contenido(indices):
+    return ({i: sorted(llaves) for i, llaves in indices.por_id.items()}, indices.por_cliente, indices.por_celular)
+
+
+def test_indices_incrementales_igual_a_reconstruir(ventas):
+    obtener_indices(ventas)
+    almacenamiento.guardar_venta(benchmark._venta_nueva(np.random.default_rng(2), pd.Timestamp("2026-10-18 10:00")))
+    df = almacenamiento.cargar_datos()
+    ids = df['ID'].unique()
+    filas = df[df['ID'] == ids[0]].copy()
+    filas['Cliente'] = "Cliente Editado"
+    filas['Celular Principal'] = "3009998888"
+    almacenamiento.actualizar_db(filas)
+    almacenamiento.eliminar_venta(ids[1])
+
+    df = almacenamiento.cargar_datos()
+    indices = obtener_indices(df)
+    assert _contenido(indices) == _contenido(IndicesVentas(df))
+    assert indices.ids_cliente("Cliente Editado") == [ids[0]]
+    assert indices.ids_celular("3009998888") == [ids[0]]
+    assert ids[1] not in indices
+    pd.testing.assert_frame_equal(indices.filas(ids[0]), df[df['ID'] == ids[0]])
+
+
+def test_indices_anteriores_siguen_validos_para_su_origen(ventas):
+    anteriores = obtener_indices(ventas)
+    contenido = _contenido(anteriores)
+    id_venta = ventas['ID'].iloc[0]
+    esperadas = ventas[ventas['ID'] == id_venta]
+    almacenamiento.guardar_venta(benchmark._venta_nueva(np.random.default_rng(4), pd.Timestamp("2026-10-18 10:00")))
+    almacenamiento.eliminar_venta(id_venta)
+
+    assert anteriores.origen is ventas
+    assert _contenido(anteriores) == contenido
+    pd.testing.assert_frame_equal(anteriores.filas(id_venta), esperadas)
+    assert id_venta not in obtener_indices(almacenamiento.cargar_datos())
@@ -0,0 +1,53 @@
+import json
+import logging
+
+import pandas as pd
+
+import instrumentacion
+from instrumentacion import cerrar_rerun, iniciar_rerun, medido, rerun_en_curso, resumen_ventana, span
+
+
+@medido('prueba_medido')
+def _contar(df):
+    with span('prueba_interno'):
+        return len(df)
+
+
+def test_spans_de_un_rerun_se_registran_y_se_escriben(caplog):
+    caplog.set_level(logging.INFO, logger='ventas.tiempos')
+    iniciar_rerun('sesion-a', pagina="prueba")
+    assert rerun_en_curso()
+    with span('prueba_externo') as medicion:
+        assert _contar(pd.DataFrame({'a': range(7)})) == 7
+        medicion['filas'] = 3
+    rerun = cerrar_rerun('sesion-a')
+    assert not rerun_en_curso()
+
+    spans = {s['span']: s for s in rerun['spans']}
+    assert spans['prueba_interno']['padre'] == 'prueba_medido'
+    assert spans['prueba_medido']['padre'] == 'prueba_externo' and spans['prueba_medido']['filas'] == 7
+    assert spans['prueba_externo']['padre'] is None and spans['prueba_externo']['filas'] == 3
+    assert rerun['total_ms'] >= spans['prueba_externo']['ms'] >= spans['prueba_medido']['ms']
+    (linea,) = [json.loads(r.getMessage()) for r in caplog.records]
+    assert linea['completo'] and linea['pagina'] == "prueba" and len(linea['spans']) == 3
+
+
+def test_rerun_cortado_se_cierra_incompleto_en_el_siguiente(caplog):
+    caplog.set_level(logging.INFO, logger='ventas.tiempos')
+    iniciar_rerun('sesion-b')
+    with span('prueba_cortado'):
+        pass
+    iniciar_rerun('sesion-b')  # st.rerun() cortó el anterior antes de cerrar_rerun
+    assert cerrar_rerun('sesion-b')['spans'] == []
+    assert [json.loads(r.getMessage())['completo'] for r in caplog.records] == [False, True]
+
+
+def test_resumen_ventana_por_span(monkeypatch):
+    monkeypatch.setattr(instrumentacion, '_ventana', type(instrumentacion._ventana)(instrumentacion._ventana.default_factory))
+    for _ in range(20):
+        with span('prueba_resumen'):
+            pass
+    resumen = resumen_ventana()
+    assert resumen['Span'].tolist() == ['prueba_resumen']
+    fila = resumen.iloc[0]
+    assert fila['N'] == 20 and fila['p50 (ms)'] <= fila['p95 (ms)'] <= fila['Máx (ms)']
@@ -0,0 +1,81 @@
+import pandas as pd
+
+import almacenamiento
+import importar_pedidos
+from pedidos import (cargar_config, config_de_filas, config_defecto, config_version, guardar_config,
+                     historial_precios, item_nina)
+
+LISTA = """Pedido;Cliente;Celular Principal;Tipo;Nombre Alumno;Camisas;Talla Camisa;Pantalones;Largo Pant (cm);Valor Recibido;Medio Pago
+1;Ana;3001112222;Niño;Luis;2;8;1;70;50000;efectivo
+1;Ana;3001112222;niña;Sofi;1;10;0;;;
+2;Beto;3003334444;Nino;Juan;1;s;0;;;
+"""
+
+
+def _lista(contenido=LISTA):
+    with open('lista.csv', 'w', encoding='utf-8-sig') as f:
+        f.write(contenido)
+    return 'lista.csv'
+
+
+def test_validar_no_guarda_nada(base, capsys):
+    assert importar_pedidos.main([_lista(), '--colegio', "NCP", '--validar']) == 0
+    assert "2 ventas, 3 niños(as)" in capsys.readouterr().out
+    assert almacenamiento.cargar_datos(historial=True).empty
+
+
+def test_con_errores_no_guarda_nada(base, capsys):
+    malas = LISTA.replace("Juan;1;s;", "Juan;1;XXL;").replace("Luis;2;", "Luis;dos;")
+    assert importar_pedidos.main([_lista(malas)]) == 1
+    salida = capsys.readouterr().out
+    assert "2 errores" in salida and "Fila 2: 'Camisas'" in salida and "Fila 4: talla 'XXL'" in salida
+    assert almacenamiento.cargar_datos(historial=True).empty
+
+
+def test_importa_una_venta_por_pedido(base, capsys):
+    assert importar_pedidos.main([_lista(), '--colegio', "NCP"]) == 0
+    df = almacenamiento.cargar_datos(historial=True)
+    assert df['ID'].nunique() == 2 and len(df) == 3
+    assert (df['Colegio'] == "NCP").all()
+
+    por_venta = df.groupby('Cliente', observed=True)
+    pd.testing.assert_series_equal(por_venta.size(), pd.Series({'Ana': 2, 'Beto': 1}),
+                                   check_names=False, check_index_type=False)
+    assert por_venta['Pagado (Distribuido)'].sum().to_dict() == {'Ana': 50000, 'Beto': 0}
+    ana = df[df['Cliente'] == "Ana"].set_index('Tipo Detalle')
+    assert ana.loc["Niño 1", 'Medio Pago'] == "Efectivo" and ana.loc["Niña 1", 'Entrega Tela'] == "No Aplica"
+    assert df.loc[df['Cliente'] == "Beto", 'Talla Camisa'].astype(str).tolist() == ["S"]
+    ids = sorted(df['ID'].unique())
+    assert f"Guardadas: {ids[0]} a {ids[-1]}" in capsys.readouterr().out
+
+
+def test_cada_lista_guardada_es_una_version(tmp_path):
+    ruta = str(tmp_path / 'precios.json')
+    assert cargar_config(ruta)['version'] == 0  # sin archivo: la lista por defecto
+    subida = config_defecto()
+    subida['precios_nina']["10"] = 42000
+    assert guardar_config(subida, ruta)['version'] == 1
+    subida['precio_pantalon'] = 36000
+    assert guardar_config(subida, ruta)['version'] == 2
+
+    vigente = cargar_config(ruta)
+    assert vigente is cargar_config(ruta)  # se parsea una vez por versión del archivo
+    assert vigente['version'] == 2 and vigente['precio_pantalon'] == 36000
+    historial = historial_precios(ruta)
+    assert list(historial) == [0, 1, 2]
+    assert [c['precios_nina']["10"] for c in historial.values()] == [40000, 42000, 42000]
+    assert config_version(1, ruta)['precio_pantalon'] == 35000
+    assert config_version(None, ruta) is vigente and config_version(99, ruta) is vigente
+
+
+def test_las_filas_se_recalculan_con_su_version(tmp_path):
+    ruta = str(tmp_path / 'precios.json')
+    vendida = item_nina(1, "Sofi", 1, "10", cargar_config(ruta))
+    subida = config_defecto()
+    subida['precios_nina']["10"] = 42000
+    guardar_config(subida, ruta)
+
+    filas = pd.DataFrame([{'Versión Precios': vendida['Versión Precios']}])
+    assert item_nina(1, "Sofi", 1, "10", config_de_filas(filas, ruta))['Subtotal'] == vendida['Subtotal'] == 40000
+    assert item_nina(1, "Sofi", 1, "10", cargar_config(ruta))['Subtotal'] == 42000
+    assert config_de_filas(pd.DataFrame({'Cliente': ["Ana"]}), ruta)['version'] == 1  # fila sin versión
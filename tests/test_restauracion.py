@@ -0,0 +1,68 @@
+import shutil
+
+import pytest
+
+import almacenamiento
+import diario
+import exportacion
+import restauracion
+from restauracion import RespaldoInvalido
+from tests.utiles import assert_mismas_ventas, carga_fresca
+
+
+@pytest.fixture
+def respaldo(ventas, tmp_path):
+    """(ruta del respaldo descargado, ventas que contiene), con parte de ellas ya archivadas."""
+    almacenamiento.archivar_liquidadas(0)
+    ruta = tmp_path / "respaldo.xlsx"
+    shutil.copy(exportacion.ruta_exportacion(), ruta)
+    return ruta, almacenamiento.cargar_datos(historial=True)
+
+
+def _restaurar(ruta, modo):
+    resumen = restauracion.previsualizar(ruta)
+    assert resumen['errores'] == []
+    return restauracion.restaurar(ruta, modo, resumen['checksum'])
+
+
+def test_reemplazar_recupera_el_respaldo(respaldo):
+    ruta, guardadas = respaldo
+    almacenamiento.eliminar_venta(almacenamiento.cargar_datos()['ID'].iloc[0])
+    _restaurar(ruta, 'reemplazar')
+    assert_mismas_ventas(carga_fresca(historial=True), guardadas)
+    assert diario.verificar() == []
+
+
+def test_actualizar_reemplaza_las_ventas_del_archivo(respaldo):
+    ruta, guardadas = respaldo
+    df = almacenamiento.cargar_datos()
+    filas = df[df['ID'] == df['ID'].iloc[0]].copy()
+    filas['Cliente'] = "Cliente Editado"
+    almacenamiento.actualizar_db(filas)
+    resultado = _restaurar(ruta, 'actualizar')
+    assert resultado['ventas'] == guardadas['ID'].nunique()
+    assert_mismas_ventas(carga_fresca(historial=True), guardadas)
+    assert diario.verificar() == []
+
+
+def test_agregar_solo_trae_ventas_nuevas(respaldo):
+    ruta, guardadas = respaldo
+    borrada = almacenamiento.cargar_datos()['ID'].iloc[0]
+    almacenamiento.eliminar_venta(borrada)
+    resultado = _restaurar(ruta, 'agregar')
+    assert resultado['insertadas'] == int((guardadas['ID'] == borrada).sum())
+    assert resultado['omitidas'] == len(guardadas) - resultado['insertadas']
+    assert_mismas_ventas(carga_fresca(historial=True), guardadas)
+    assert diario.verificar() == []
+
+
+def test_suma_de_verificacion_distinta_no_escribe_nada(respaldo):
+    ruta, guardadas = respaldo
+    almacenamiento.eliminar_venta(almacenamiento.cargar_datos()['ID'].iloc[0])
+    antes = carga_fresca(historial=True)
+    version = almacenamiento.obtener_almacen().version()
+    with pytest.raises(RespaldoInvalido):
+        restauracion.restaurar(ruta, 'reemplazar', "0" * 64)
+    assert almacenamiento.obtener_almacen().version() == version
+    assert_mismas_ventas(carga_fresca(historial=True), antes)
+    assert almacenamiento.obtener_almacen().particiones()  # el archivo volvió a su lugar
@@ -0,0 +1,28 @@
+"""Comparaciones compartidas por las pruebas."""
+import os
+
+import pandas as pd
+
+import almacenamiento
+from almacenamiento import COLUMNAS_VENTA
+
+
+def carga_fresca(historial=False):
+    """Lo que leería un proceso recién iniciado (sin caché ni espejo)."""
+    if os.path.exists(almacenamiento.ARCHIVO_ESPEJO):
+        os.remove(almacenamiento.ARCHIVO_ESPEJO)
+    almacenamiento.invalidar_cache()
+    return almacenamiento.cargar_datos(historial)
+
+
+def ordenadas(df):
+    """Filas de venta sin la llave de fila, en un orden estable, para comparar contenidos.
+
+    "" y vacío cuentan igual: el respaldo en Excel no los distingue.
+    """
+    return (df[COLUMNAS_VENTA].astype(object).where(df[COLUMNAS_VENTA].notna(), None).replace({"": None})
+            .sort_values(['ID', 'Tipo Detalle']).reset_index(drop=True))
+
+
+def assert_mismas_ventas(a, b):
+    pd.testing.assert_frame_equal(ordenadas(a), ordenadas(b))